@@ -0,0 +1,82 @@
+"""Micro-benchmark: cost of routing one callback query, regex handler chain vs. CallbackRouter.
+
+Usage: python bench_callback_routing.py [iterations]
+"""
+import re
+import sys
+import timeit
+
+import m
+
+# The CallbackQueryHandler patterns main() used to register, in registration order
+LEGACY_PATTERNS = [re.compile(p) for p in [
+    '^submit_payment_proof$', '^start_upload$', '^submit_task_proof$', '^verify_reject_.*$', '^admin_set_price$',
+    '^admin_set_instructions$', '^admin_set_photo$', r"^appeal_report_", "^admin_user_management$", "^instruct_",
+    '^get_task$', '^my_status$', '^remove_video_start$', '^remove_confirm_', '^remove_cancel$', "^verify_accept_",
+    "^rate_", "^admin_main_panel$", "^admin_payment_settings$", "^admin_feature_settings$",
+    r"^admin_toggle_(payment|reciprocal|quality|credits|tx)$", "^admin_approve_info$", "^admin_remove_photo$",
+    r"^sub_(approve|reject)_",
+]]
+
+# A mix of the buttons users actually press, weighted towards the hot ones
+SAMPLES = [
+    ('verify_accept', 1234), ('verify_accept', 98765), ('rate_good', 17, 1234), ('rate_bad', 42, 98765),
+    ('get_task',), ('my_status',), ('remove_confirm', 7), ('sub_approve', 5718213826), ('admin_toggle', 'credits'),
+    ('instruct', 'viewreports'), ('admin_main_panel',), ('verify_reject', 1234),
+]
+
+def legacy_data(sample):
+    return "_".join(str(part) for part in sample)
+
+def route_legacy(data):
+    for pattern in LEGACY_PATTERNS:
+        if pattern.match(data):
+            return data.split('_')  # every handler then re-parsed query.data itself
+    return None
+
+def build_router():
+    router = m.CallbackRouter()
+    for action in m.CALLBACK_ACTIONS:
+        router.route(action, None)
+    return router
+
+def route_new(router, data, decode=m.decode_callback):
+    decoded = decode(data)
+    if decoded is None:
+        return None
+    handler = router.handlers.get(decoded.action)
+    return handler, decoded.args
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    router = build_router()
+    legacy = [legacy_data(sample) for sample in SAMPLES]
+    encoded = [m.encode_callback(*sample) for sample in SAMPLES]
+
+    def run_legacy():
+        for data in legacy: route_legacy(data)
+
+    # First sight of a callback: the lru_cache in front of decode_callback misses
+    uncached_decode = m.decode_callback.__wrapped__
+
+    def run_router_cold():
+        for data in encoded: route_new(router, data, uncached_decode)
+
+    def run_router_warm():
+        for data in encoded: route_new(router, data)
+
+    def run_router_legacy_data():
+        for data in legacy: route_new(router, data, uncached_decode)
+
+    print(f"{'case':<40} {'ns/callback':>12}")
+    for name, func in [
+        ("regex chain + split (before)", run_legacy),
+        ("router, new data, uncached decode", run_router_cold),
+        ("router, new data, cached decode", run_router_warm),
+        ("router, legacy data, uncached", run_router_legacy_data),
+    ]:
+        seconds = min(timeit.repeat(func, number=iterations, repeat=5))
+        print(f"{name:<40} {seconds / (iterations * len(SAMPLES)) * 1e9:>12.0f}")
+
+if __name__ == "__main__":
+    main()
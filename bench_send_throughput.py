@@ -0,0 +1,60 @@
+"""Benchmark: sendMessage throughput against the local fake Bot API, by connection pool size.
+
+Usage: python bench_send_throughput.py [messages] [latency_ms]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from telegram import Bot
+
+import m
+from fake_bot_api import FakeBotAPI
+
+POOL_SIZES = [1, 4, 16, 32]
+CONCURRENCY = 64  # roughly a notification burst: many sends in flight at once
+
+
+async def run_case(base_url: str, pool_size: int, messages: int):
+    request = m.build_api_request(pool_size)
+    bot = Bot("123456:BENCH", base_url=base_url, request=request)
+    latencies = []
+    slots = asyncio.Semaphore(CONCURRENCY)
+
+    async def send(i):
+        async with slots:
+            started = time.perf_counter()
+            await bot.send_message(chat_id=1000 + i, text=f"notification {i}")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    async with bot:
+        started = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(messages)), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+    stats = request.endpoint_stats['sendMessage']
+    latencies.sort()
+    return {
+        'rate': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else 0,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] if latencies else 0,
+        'errors': stats['errors'],
+    }
+
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 40
+    api = FakeBotAPI(latency_ms)
+    server = await api.start()
+    base_url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/bot"
+    print(f"{messages} sends, {latency_ms:.0f} ms server latency, HTTP/{m.HTTP_VERSION}, {CONCURRENCY} in flight")
+    print(f"{'pool':>6} {'msg/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    async with server:
+        for pool_size in POOL_SIZES:
+            result = await run_case(base_url, pool_size, messages)
+            print(f"{pool_size:>6} {result['rate']:>9.0f} {result['p50']:>9.1f} {result['p99']:>9.1f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
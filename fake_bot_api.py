@@ -0,0 +1,105 @@
+"""Local stand-in for the Telegram Bot API, for benchmarking send throughput without network.
+
+Answers getMe, getUpdates (empty), send*/copy*/forward* (a fake Message) and everything else (true)
+after a fixed latency. Optionally rejects a share of calls with 429 Too Many Requests.
+
+Usage: python fake_bot_api.py [--port 8081] [--latency-ms 40] [--throttle-ratio 0.0]
+Then run the bot with BOT_API_BASE_URL=http://127.0.0.1:8081/bot
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency_ms: float = 40, throttle_ratio: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.throttle_ratio = throttle_ratio
+        self.message_ids = itertools.count(1)
+        self.calls = Counter()
+        self.connections = 0
+
+    def answer(self, method: str, params: dict):
+        if self.throttle_ratio and random.random() < self.throttle_ratio:
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                         "parameters": {"retry_after": 1}}
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": []}
+        if method.startswith(("send", "copy", "forward")):
+            chat_id = int(params.get("chat_id", 0))
+            message = {"message_id": next(self.message_ids), "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+            if "text" in params:
+                message["text"] = params["text"]
+            return 200, {"ok": True, "result": message}
+        return 200, {"ok": True, "result": True}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = request_line.split()[1].decode().rsplit("/", 1)[-1]
+                params = {}
+                if headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+                    params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+                self.calls[method] += 1
+                await asyncio.sleep(self.latency)
+                status, payload = self.answer(method, params)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        """Starts serving; port 0 picks a free port (see server.sockets[0].getsockname())."""
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def serve(port: int, latency_ms: float, throttle_ratio: float):
+    api = FakeBotAPI(latency_ms, throttle_ratio)
+    server = await api.start(port=port)
+    print(f"Fake Bot API on http://127.0.0.1:{port}/bot ({latency_ms:.0f} ms latency)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        print(f"{api.connections} connections, calls: {dict(api.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    parser.add_argument("--throttle-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.latency_ms, args.throttle_ratio))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
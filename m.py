@@ -3,8 +3,31 @@ import sqlite3
 import logging
 import random
 import os
+import time
+import asyncio
+import csv
+import gzip
+import json
+import math
+import re
+import hashlib
+import zlib
+import shutil
+import tempfile
+import threading
+import resource
+import signal
+import importlib.util
+import httpx
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from functools import lru_cache
+from pathlib import Path
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -13,8 +36,15 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
+    ExtBot,
 )
-from telegram.error import Forbidden
+from telegram.error import BadRequest, ChatMigrated, Forbidden, RetryAfter, TelegramError
+
+# --- Logging ---
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -36,10 +66,102 @@ STRIKE_LIMIT = 4
 VERIFICATION_EXPIRY_HOURS = 4
 MIN_RATINGS_FOR_FLAG = 5
 QUALITY_SCORE_FLAG_THRESHOLD = 40.0
-
-# --- Logging ---
-logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
-logger = logging.getLogger(__name__)
+WILSON_Z = 1.645  # 90% two-sided interval for the rating share
+QUALITY_FLAG_INTERVAL_SECONDS = 300
+# Outbox retries: exponential backoff from the base delay, then the message is marked dead
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_BASE_SECONDS = 5
+OUTBOX_RETRY_MAX_SECONDS = 3600
+OUTBOX_RETENTION_HOURS = 24
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_BATCH_PAUSE_SECONDS = 0.05
+ARCHIVE_INTERVAL_HOURS = 6
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024  # Telegram bot API document limit
+BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), "backups")
+BACKUP_GENERATIONS = 7
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP_SECONDS = 0.01
+BACKUP_MAX_RESTARTS = 3  # a write from another connection restarts a stepped backup; after this many, copy in one step
+BACKUP_INTERVAL_HOURS = 24
+ROLLUP_INTERVAL_MINUTES = 5
+ROLLUP_BATCH_SIZE = 5000
+# Engagement analytics: 2**11 one-byte registers per HyperLogLog sketch, about 2.3% standard error on distinct users
+ENGAGEMENT_HLL_PRECISION = 11
+ENGAGEMENT_FLUSH_SECONDS = 120
+ENGAGEMENT_SKETCH_RETENTION_DAYS = 90
+ENGAGEMENT_TOP_COMMANDS = 15
+TRIAL_REMINDER_WINDOW_HOURS = 24
+TRIAL_REMINDER_INTERVAL_MINUTES = 30
+TRIAL_REMINDER_BATCH_SIZE = 25
+TRIAL_REMINDER_BATCH_PAUSE_SECONDS = 1.5
+TRIAL_REMINDER_MAX_PER_RUN = 500
+COLLUSION_SCAN_INTERVAL_MINUTES = 30
+COLLUSION_MAX_DIRTY_PER_RUN = 2000
+COLLUSION_MAX_RING_SIZE = 12
+COLLUSION_MIN_MUTUAL_ACCEPTS = 2
+COLLUSION_MIN_RING_ACCEPTS = 10
+COLLUSION_INTERNAL_RATIO_THRESHOLD = 0.8
+COLLUSION_DENSITY_THRESHOLD = 0.6
+# Flood control: (burst, tokens refilled per second) per user and command class
+FLOOD_LIMITS = {
+    'task': (3, 1 / 10),
+    'read': (5, 1 / 4),
+    'default': (12, 1.0),
+}
+FLOOD_BUCKET_IDLE_SECONDS = 600
+FLOOD_MAX_BUCKETS = 50000
+FLOOD_WARNING_COOLDOWN_SECONDS = 30
+FLOOD_EVICTION_INTERVAL_SECONDS = 60
+# Proof pre-screening: a recording must cover this share of the required watch time
+PROOF_MIN_WATCH_RATIO = 0.9
+PROOF_FAST_TRACK_MIN_COMPLETED = 10
+PROOF_FAST_TRACK_MIN_BYTES_PER_SECOND = 20000  # ~160 kbit/s; below this the recording is likely a static screen
+REVIEW_PAGE_SIZE = 8
+REVIEW_MAX_BATCH = 200  # stays well under SQLite's bound-parameter limit
+NOTIFICATION_SENDS_PER_TICK = 20  # under Telegram's ~30 messages/second bot-wide limit
+NOTIFICATION_TICK_SECONDS = 1
+# Read path: how stale a snapshot-served command may be, and the read-only pool size
+READ_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("READ_SNAPSHOT_MAX_AGE_SECONDS", "30"))
+READ_SNAPSHOT_MAX_ENTRIES = 5000
+READ_POOL_SIZE = 4
+DIGEST_FLUSH_TICK_SECONDS = 15
+DIGEST_MAX_LINES_PER_KIND = 10
+REPORT_URGENT_PENDING_THRESHOLD = 3  # a report is sent at once when its target already has this many open reports
+# Per-user state: abandoned conversations end after the timeout; user_data is evicted when idle or over the ceiling
+CONVERSATION_TIMEOUT_SECONDS = 900
+USER_DATA_IDLE_SECONDS = 3600
+USER_DATA_MAX_ENTRIES = int(os.getenv("USER_DATA_MAX_ENTRIES", "20000"))
+USER_DATA_COMPACT_AFTER_SECONDS = 60
+USER_DATA_EVICTION_INTERVAL_SECONDS = 300
+TASK_LEASE_SECONDS = 600
+# Multi-bot hosting: set BOT_TENANTS_CONFIG to a JSON file to run several bots in this process
+SHARED_HTTP_POOL_SIZE = 32
+SHARED_EXECUTOR_WORKERS = 8
+TENANT_METRICS_INTERVAL_SECONDS = 300
+# Bot API HTTP client: a pool for sends and a single connection for long polling.
+# BOT_API_BASE_URL can point the bot at another server, e.g. fake_bot_api.py for benchmarks.
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "https://api.telegram.org/bot")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_VERSION = os.getenv("HTTP_VERSION", "2" if importlib.util.find_spec("h2") else "1.1")
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 10.0
+HTTP_WRITE_TIMEOUT = 10.0
+HTTP_MEDIA_WRITE_TIMEOUT = 30.0
+HTTP_POOL_TIMEOUT = 5.0  # how long a send waits for a free connection before failing
+HTTP_KEEPALIVE_EXPIRY_SECONDS = 60.0
+HTTP_STATS_MAX_ENDPOINTS = 15
+# Credit ledger: a user's balance is snapshotted once this many entries follow their last snapshot
+CREDIT_SNAPSHOT_MIN_ENTRIES = 20
+CREDIT_SNAPSHOT_INTERVAL_MINUTES = 60
+CREDIT_RECONCILE_BATCH = 500
+CREDIT_RECONCILE_INTERVAL_MINUTES = 10
+LEDGER_MAX_ENTRIES_SHOWN = 15
+SEARCH_PAGE_SIZE = 10
+SEARCH_SNIPPET_TOKENS = 12
+DEDUPE_BACKFILL_BATCH = 200
+DEDUPE_INTERVAL_SECONDS = 60
+TIER_RECOMPUTE_INTERVAL_HOURS = 24
 
 # --- Conversation States ---
 # At the top of your file, with the other states
@@ -58,8 +180,10 @@ logger = logging.getLogger(__name__)
 
 # --- Database Setup ---
 def initialize_database():
-    conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(tenant().db_name)
     cursor = conn.cursor()
+    # WAL lets the read-only pool keep reading while verification traffic writes
+    cursor.execute("PRAGMA journal_mode=WAL")
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY, status TEXT NOT NULL DEFAULT 'active',
@@ -107,12 +231,209 @@ def initialize_database():
     logger.info("Database initialized successfully.")
 
 # --- Helper Functions ---
+def wilson_bounds(good: int, total: int):
+    """Wilson score interval (lower, upper) for the share of good ratings; (0, 1) when there are none."""
+    if not total:
+        return 0.0, 1.0
+    share, z_squared = good / total, WILSON_Z * WILSON_Z
+    centre = share + z_squared / (2 * total)
+    margin = WILSON_Z * math.sqrt(share * (1 - share) / total + z_squared / (4 * total * total))
+    denominator = 1 + z_squared / total
+    return (centre - margin) / denominator, (centre + margin) / denominator
+
+def register_sql_functions(conn):
+    conn.create_function("wilson_lower_bound", 2, lambda good, total: wilson_bounds(good or 0, total or 0)[0], deterministic=True)
+    conn.create_function("wilson_upper_bound", 2, lambda good, total: wilson_bounds(good or 0, total or 0)[1], deterministic=True)
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(tenant().db_name)
+    conn.row_factory = sqlite3.Row
+    register_sql_functions(conn)
+    return conn
+
+def get_readonly_db_connection(db_name: str = None):
+    """Opens the database read-only, for long scans that must never take a write lock."""
+    conn = sqlite3.connect(f"{Path(db_name or tenant().db_name).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    register_sql_functions(conn)
     return conn
 
-def is_admin(user_id: int) -> bool: return user_id in ADMIN_IDS
+class ReadConnectionPool:
+    """Reuses a few read-only connections. In WAL mode they read the last committed state without waiting on writers."""
+
+    def __init__(self, db_name: str, size: int):
+        self.db_name, self.size = db_name, size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = get_readonly_db_connection(self.db_name)
+        try:
+            yield conn
+        finally:
+            with self.lock:
+                if len(self.idle) < self.size:
+                    self.idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+class SnapshotCache:
+    """Serves read-only query results from memory for at most max_age seconds, loading misses from the read pool."""
+
+    def __init__(self, pool: ReadConnectionPool, max_age: float, max_entries: int):
+        self.pool, self.max_age, self.max_entries = pool, max_age, max_entries
+        self.entries = OrderedDict()  # key -> (loaded_at, value), least recently used first
+        self.stats = Counter()
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and now - entry[0] <= self.max_age:
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+        self.stats['misses'] += 1
+        with self.pool.connection() as conn:
+            value = loader(conn)
+        self.entries[key] = (now, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+class Tenant:
+    """One hosted bot: its token, admins and database, plus the in-memory state that must not leak between bots."""
+
+    def __init__(self, name: str, token: str, admin_ids, db_name: str, backup_dir: str = None):
+        self.name, self.token, self.admin_ids, self.db_name = name, token, list(admin_ids), db_name
+        self.backup_dir = backup_dir or os.path.join(os.path.dirname(os.path.abspath(db_name)), "backups", name)
+        self.read_pool = ReadConnectionPool(db_name, READ_POOL_SIZE)
+        self.snapshots = SnapshotCache(self.read_pool, READ_SNAPSHOT_MAX_AGE_SECONDS, READ_SNAPSHOT_MAX_ENTRIES)
+        self.backup_lock = asyncio.Lock()
+        self.flood_buckets = OrderedDict()  # (user_id, command_class) -> [tokens, last_seen, last_warned], least recently used first
+        self.flood_stats = Counter()
+        self.notification_state = {'resume_at': 0.0}  # monotonic time the outbox drainer may send again after a RetryAfter
+        self.outbox_stats = Counter()  # sent, retried, dead
+        self.digest_buffers = {}  # recipient_id -> {'flush_at': monotonic time, 'events': {kind: [item, ...]}}
+        self.digest_last_sent = {}  # recipient_id -> monotonic time of the last message sent to them
+        self.unreachable_chat_ids = {}  # chat_id -> chat id it migrated to, or None when the chat blocked the bot
+        self.user_state_last_seen = OrderedDict()  # user_id -> monotonic time of the user's last update, least recent first
+        self.user_state_stats = Counter()
+        self.stats = Counter()  # updates, errors
+        self.http_requests = ()  # the InstrumentedHTTPXRequest objects behind the tenant's bot
+        self.credit_reconcile = {'after_user_id': 0, 'mismatches': {}, 'passes': 0}
+        self.startup = {'started_at': time.perf_counter(), 'phases': {}}  # phase -> milliseconds, in the order they ran
+        # Not yet persisted: (day, metric) -> HyperLogLog of the users seen, (hour bucket, metric) -> calls
+        self.engagement = {'sketches': {}, 'counts': Counter()}
+        self.engagement_commands = frozenset()  # commands the bot registers; any other /word counts as command_other
+
+# Set once per bot: by main() for the single-bot process, or by each tenant's task in run_tenants().
+# Handler tasks, jobs and to_thread workers inherit it from there.
+current_tenant = ContextVar('current_tenant')
+
+def tenant() -> Tenant:
+    return current_tenant.get()
+
+def fetch_settings(conn) -> dict:
+    return {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings").fetchall()}
+
+def invalidate_user_snapshots(*user_ids):
+    """Drops the cached /status and trial views of these users. Call after committing a write that changes them."""
+    for user_id in user_ids:
+        tenant().snapshots.invalidate(('status', user_id))
+        tenant().snapshots.invalidate(('trial', user_id))
+
+def is_admin(user_id: int) -> bool: return user_id in tenant().admin_ids
+
+# --- Callback Data Codec & Router ---
+# Buttons carry "<version>|<action>|<arg>|<arg>...". Each action declares its argument types,
+# so handlers get typed arguments instead of re-splitting query.data themselves.
+# Buttons sent before the codec existed ("verify_accept_12") are still decoded: the longest known action
+# before an '_' is found by walking the separators right to left with rfind('_').
+CALLBACK_DATA_VERSION = "1"
+CALLBACK_ACTIONS = {
+    'submit_payment_proof': (), 'start_upload': (), 'get_task': (), 'my_status': (), 'submit_task_proof': (),
+    'remove_video_start': (), 'remove_confirm': (int,), 'remove_cancel': (),
+    'verify_accept': (int,), 'verify_reject': (int,), 'rate_good': (int, int), 'rate_bad': (int, int),
+    'appeal_report': (int,), 'sub_approve': (int,), 'sub_reject': (int,),
+    'admin_main_panel': (), 'admin_payment_settings': (), 'admin_feature_settings': (), 'admin_user_management': (),
+    'admin_toggle': (str,), 'admin_approve_info': (), 'admin_remove_photo': (),
+    'admin_set_price': (), 'admin_set_upi': (), 'admin_set_photo': (), 'instruct': (str,),
+    'review_page': (int,), 'review_watch': (int, int), 'review_mark': (int, int), 'review_accept': (int,),
+    'search_page': (int,),
+}
+CallbackData = namedtuple('CallbackData', ['action', 'args'])
+
+def encode_callback(action: str, *args) -> str:
+    """Encodes an action and its arguments as button callback data."""
+    arg_types = CALLBACK_ACTIONS[action]
+    if len(args) != len(arg_types):
+        raise ValueError(f"Callback action '{action}' takes {len(arg_types)} argument(s), got {len(args)}")
+    return "|".join([CALLBACK_DATA_VERSION, action, *(str(arg) for arg in args)])
+
+def split_legacy_callback(data: str):
+    """Finds the longest known action that prefixes legacy underscore-separated data. Returns (action, raw_args).
+
+    The rest is split at most once per declared argument, so the last argument may itself contain '_'
+    (instruct_remove_strike is the instruct action with 'remove_strike').
+    """
+    if data in CALLBACK_ACTIONS:
+        return data, []
+    end = len(data)
+    while (end := data.rfind('_', 0, end)) > 0:
+        arg_types = CALLBACK_ACTIONS.get(data[:end])
+        if arg_types is not None:
+            raw = data[end + 1:]
+            return data[:end], raw.split('_', len(arg_types) - 1) if arg_types else [raw]
+    return None, []
+
+@lru_cache(maxsize=4096)
+def decode_callback(data: str):
+    """Decodes callback data into a CallbackData(action, typed args), or None if it is unknown or malformed."""
+    if data.startswith(CALLBACK_DATA_VERSION + "|"):
+        action, *raw_args = data.split("|")[1:]
+    else:
+        action, raw_args = split_legacy_callback(data)
+    arg_types = CALLBACK_ACTIONS.get(action)
+    if arg_types is None or len(raw_args) != len(arg_types):
+        return None
+    try:
+        return CallbackData(action, tuple(arg_type(raw) for arg_type, raw in zip(arg_types, raw_args)))
+    except ValueError:
+        return None
+
+def callback_pattern(*actions):
+    """CallbackQueryHandler pattern that matches the given actions (used for conversation entry points)."""
+    def matches(data):
+        decoded = decode_callback(data) if isinstance(data, str) else None
+        return decoded is not None and decoded.action in actions
+    return matches
+
+class CallbackRouter:
+    """Routes every callback query to its handler with one dict lookup on the decoded action."""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def route(self, action: str, handler):
+        if action not in CALLBACK_ACTIONS:
+            raise ValueError(f"Unknown callback action '{action}'")
+        self.handlers[action] = handler
+
+    def can_route(self, data) -> bool:
+        decoded = decode_callback(data) if isinstance(data, str) else None
+        return decoded is not None and decoded.action in self.handlers
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        return await self.handlers[decode_callback(update.callback_query.data).action](update, context)
 
 #
 # DELETE your old check_user_access function and REPLACE it with this block
@@ -135,7 +456,7 @@ def check_user_access(user_id: int) -> bool:
         return True
 
     # Fetch user data
-    user = conn.execute("SELECT has_paid, trial_start_date FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    user = conn.execute("SELECT has_paid, trial_expires_at FROM users WHERE user_id = ?", (user_id,)).fetchone()
     if not user:
         conn.close()
         return False
@@ -145,18 +466,10 @@ def check_user_access(user_id: int) -> bool:
         conn.close()
         return True
 
-    # Check for active free trial if not paid
-    free_trial_hours_setting = conn.execute("SELECT value FROM settings WHERE key = 'free_trial_days'").fetchone()
-    free_trial_hours = int(free_trial_hours_setting['value']) if free_trial_hours_setting else 0
-    
-    if free_trial_hours > 0 and user['trial_start_date']:
-        try:
-            start_date = datetime.strptime(user['trial_start_date'], '%Y-%m-%d %H:%M:%S')
-            if datetime.now() <= start_date + timedelta(hours=free_trial_hours):
-                conn.close()
-                return True
-        except (ValueError, TypeError):
-            pass
+    # Check for active free trial if not paid (expiry is precomputed as an epoch)
+    if user['trial_expires_at'] and time.time() <= user['trial_expires_at']:
+        conn.close()
+        return True
             
     # If neither paid, in trial, nor unblocked, deny access
     conn.close()
@@ -174,10 +487,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # âœ… NEW: Add trial start date and subscription status for new users
     if not user_exists:
-        current_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        now = datetime.now()
+        trial_days_setting = conn.execute("SELECT value FROM settings WHERE key = 'free_trial_days'").fetchone()
+        trial_days = int(trial_days_setting['value']) if trial_days_setting else 0
         conn.execute(
-            "INSERT INTO users (user_id, trial_start_date, subscription_status) VALUES (?, ?, ?)",
-            (user.id, current_time_str, 'trial')
+            "INSERT INTO users (user_id, trial_start_date, subscription_status, trial_expires_at) VALUES (?, ?, ?, ?)",
+            (user.id, now.strftime('%Y-%m-%d %H:%M:%S'), 'trial', int(now.timestamp()) + trial_days * 86400)
         )
         conn.commit()
         logger.info(f"New user registered with trial: {user.id}")
@@ -201,7 +516,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             tx_id_info = f"\n\n*IMPORTANT*: Please include this code in your payment notes/remarks: `{tx_id}`"
 
         payment_caption = (f"ðŸ‘‹ *Welcome, {user.first_name}!* To use this bot, a one-time payment is required.\n\n" f"ðŸ’° **Amount:** {settings.get('payment_price')}\n{tx_id_info}\n\n" f"ðŸ“ **Instructions:**\n{settings.get('payment_instructions')}\n\n" "After paying, press the button below to submit your proof.")
-        keyboard = [[InlineKeyboardButton("âœ… Submit Payment Proof", callback_data="submit_payment_proof")]]
+        keyboard = [[InlineKeyboardButton("âœ… Submit Payment Proof", callback_data=encode_callback("submit_payment_proof"))]]
         photo_id = settings.get('payment_photo_id')
         if photo_id:
             await update.message.reply_photo(photo=photo_id, caption=payment_caption, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
@@ -227,7 +542,7 @@ async def received_payment_proof(update: Update, context: ContextTypes.DEFAULT_T
     tx_id_info = f" (TX ID: `{context.user_data.get('tx_id', 'N/A')}`)" if context.user_data.get('tx_id') else ""
     await update.message.reply_text("âœ… Thank you! Your proof has been submitted. Admins will verify it shortly.\n\nYou can check your status with the /approve command.")
     notification_caption = (f"ðŸ”” *Payment Verification Required*\n\n" f"User *{user.first_name}* (ID: `{user.id}`){tx_id_info} has submitted the attached payment proof.\n\n" f"Please verify and use `/approve {user.id}` to grant access.")
-    for admin_id in ADMIN_IDS:
+    for admin_id in tenant().admin_ids:
         try: await context.bot.send_photo(chat_id=admin_id, photo=proof_photo_id, caption=notification_caption, parse_mode='Markdown')
         except Forbidden: logger.warning(f"Could not send payment proof to admin {admin_id}")
     context.user_data.pop('tx_id', None)
@@ -238,11 +553,11 @@ async def command_wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, co
     if not check_user_access(update.effective_user.id):
         # âœ… NEW: Custom message for expired trial users
         conn = get_db_connection()
-        user = conn.execute("SELECT trial_start_date FROM users WHERE user_id = ?", (update.effective_user.id,)).fetchone()
+        user = conn.execute("SELECT trial_expires_at FROM users WHERE user_id = ?", (update.effective_user.id,)).fetchone()
         free_trial_days_setting = conn.execute("SELECT value FROM settings WHERE key = 'free_trial_days'").fetchone()
         conn.close()
         
-        trial_has_run = user and user['trial_start_date'] and free_trial_days_setting and int(free_trial_days_setting['value']) > 0
+        trial_has_run = user and user['trial_expires_at'] is not None and free_trial_days_setting and int(free_trial_days_setting['value']) > 0
 
         if trial_has_run:
             await update.message.reply_text("â³ Your free trial has ended. To continue using the bot, please subscribe.\n\nUse /pay to see payment instructions.")
@@ -264,18 +579,20 @@ async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("ðŸ“œ *Bot Rules & Guidelines*\n\n1. *Direct Exchange*: After you approve a task, that user is prioritized to watch your video.\n2. *Fair Play*: Honest engagement is required.\n3. *Video Limit*: Max 5 videos (5 min max duration).\n4. *Proof*: A full screen recording is mandatory.\n5. *Strike System*: 4 strikes = temporary ban.", parse_mode='Markdown')
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [[InlineKeyboardButton("âž• Upload Video", callback_data="start_upload")], [InlineKeyboardButton("âœ… Get a Task", callback_data="get_task")], [InlineKeyboardButton("ðŸ“Š My Status", callback_data="my_status")], [InlineKeyboardButton("ðŸ—‘ï¸ Remove Video", callback_data="remove_video_start")], [InlineKeyboardButton("ðŸ§¾ Submit Task Proof", callback_data="submit_task_proof")]]
+    keyboard = [[InlineKeyboardButton("âž• Upload Video", callback_data=encode_callback("start_upload"))], [InlineKeyboardButton("âœ… Get a Task", callback_data=encode_callback("get_task"))], [InlineKeyboardButton("ðŸ“Š My Status", callback_data=encode_callback("my_status"))], [InlineKeyboardButton("ðŸ—‘ï¸ Remove Video", callback_data=encode_callback("remove_video_start"))], [InlineKeyboardButton("ðŸ§¾ Submit Task Proof", callback_data=encode_callback("submit_task_proof"))]]
     await update.message.reply_text("ðŸ“‹ Menu:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def my_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    conn = get_db_connection()
-    settings = {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings").fetchall()}
-    user_info = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
-    videos = conn.execute("SELECT title, views_received, quality_score FROM videos WHERE user_id = ?", (user_id,)).fetchall()
-    owed_tasks = conn.execute("SELECT COUNT(*) FROM reciprocal_tasks WHERE owed_by_user_id = ? AND status = 'pending'", (user_id,)).fetchone()[0]
-    pending_verifications = conn.execute("SELECT COUNT(*) FROM tasks WHERE uploader_id = ? AND status = 'proof_submitted'", (user_id,)).fetchone()[0]
-    conn.close()
+    settings = tenant().snapshots.get('settings', fetch_settings)
+    snapshot = tenant().snapshots.get(('status', user_id), lambda conn: {
+        'user_info': dict(conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()),
+        'videos': [dict(row) for row in conn.execute("SELECT title, views_received, quality_score FROM videos WHERE user_id = ? AND status != 'duplicate'", (user_id,)).fetchall()],
+        'owed_tasks': conn.execute("SELECT COUNT(*) FROM reciprocal_tasks WHERE owed_by_user_id = ? AND status = 'pending'", (user_id,)).fetchone()[0],
+        'pending_verifications': conn.execute("SELECT COUNT(*) FROM tasks WHERE uploader_id = ? AND status = 'proof_submitted'", (user_id,)).fetchone()[0],
+    })
+    user_info, videos = snapshot['user_info'], snapshot['videos']
+    owed_tasks, pending_verifications = snapshot['owed_tasks'], snapshot['pending_verifications']
     credit_info = f"ðŸ’° Credits: *{user_info['credits']}*\n" if settings.get('task_credits_enabled') == '1' else ""
     status_message = (f"ðŸ“Š *Your Status*\n\n" f"ðŸ… Tier: *{user_info['tier']}*\n" f"âœ… Tasks Completed: *{user_info['completed_tasks']}*\n" f"ðŸ”¥ Strikes: *{user_info['strikes']} / {STRIKE_LIMIT}*\n" f"{credit_info}" f"ðŸ¤ Direct Exchanges Owed: *{owed_tasks}*\n" f"â³ Tasks Pending Your Verification: *{pending_verifications}*\n\n" f"ðŸ“š *Your Videos ({len(videos)}/{MAX_VIDEOS_PER_USER})*\n")
     if not videos: status_message += "_No videos uploaded._"
@@ -298,9 +615,7 @@ async def toggle_participation(update: Update, context: ContextTypes.DEFAULT_TYP
     await update.message.reply_text(message, parse_mode='Markdown')
 
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = get_db_connection()
-    top_users = conn.execute("SELECT user_id, completed_tasks FROM users ORDER BY completed_tasks DESC LIMIT 10").fetchall()
-    conn.close()
+    top_users = tenant().snapshots.get('leaderboard', lambda conn: [dict(row) for row in conn.execute("SELECT user_id, completed_tasks FROM users ORDER BY completed_tasks DESC LIMIT 10").fetchall()])
     leaderboard_text = "ðŸ† *Top 10 Users*\n\n"
     if not top_users: leaderboard_text += "No users have completed tasks yet."
     else:
@@ -322,14 +637,14 @@ async def remove_video_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not videos:
         await message_sender.reply_text("You have no videos to remove.")
         return
-    keyboard = [[InlineKeyboardButton(f"ðŸ—‘ï¸ {v['title'][:40]}", callback_data=f"remove_confirm_{v['video_id']}")] for v in videos]
-    keyboard.append([InlineKeyboardButton("Cancel", callback_data="remove_cancel")])
+    keyboard = [[InlineKeyboardButton(f"ðŸ—‘ï¸ {v['title'][:40]}", callback_data=encode_callback("remove_confirm", v['video_id']))] for v in videos]
+    keyboard.append([InlineKeyboardButton("Cancel", callback_data=encode_callback("remove_cancel"))])
     await message_sender.reply_text("Select a video to remove:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def remove_video_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    video_id = int(query.data.split('_')[2])
+    video_id, = decode_callback(query.data).args
     conn = get_db_connection()
     video = conn.execute("SELECT status FROM videos WHERE video_id = ? AND user_id = ?", (video_id, query.from_user.id)).fetchone()
     if not video:
@@ -340,10 +655,29 @@ async def remove_video_confirm(update: Update, context: ContextTypes.DEFAULT_TYP
         conn.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
         conn.execute("DELETE FROM tasks WHERE video_id = ?", (video_id,))
         conn.commit()
+        invalidate_user_snapshots(query.from_user.id)
         await query.edit_message_text("âœ… Video has been successfully removed.")
     conn.close()
 
 # --- TASK MANAGEMENT ---
+def find_task_candidate(conn, user_id: int, settings: dict):
+    """Runs the full candidate search for a viewer. Returns (video row, reciprocal task id or None).
+
+    Videos softly reserved for other viewers by an unexpired lease are skipped, and with task credits enabled so
+    are videos whose uploader cannot pay for the view.
+    """
+    now = int(time.time())
+    credits_required = settings.get('task_credits_enabled') == '1'
+    video_to_watch, reciprocal_task_id = None, None
+    if settings.get('reciprocal_tasks_enabled') == '1':
+        reciprocal_obligation = conn.execute("SELECT id, owed_to_user_id FROM reciprocal_tasks WHERE owed_by_user_id = ? AND status = 'pending' ORDER BY created_timestamp ASC LIMIT 1", (user_id,)).fetchone()
+        if reciprocal_obligation:
+            video_to_watch = conn.execute("SELECT v.*, 'Bronze' as tier FROM videos v WHERE v.user_id = ? AND v.status = 'active' AND v.video_id NOT IN (SELECT video_id FROM watched_videos WHERE user_id = ?) AND v.video_id NOT IN (SELECT video_id FROM task_leases WHERE viewer_id != ? AND expires_at > ?) AND (? = 0 OR (SELECT credits FROM users WHERE user_id = v.user_id) >= v.duration) ORDER BY RANDOM() LIMIT 1", (reciprocal_obligation['owed_to_user_id'], user_id, user_id, now, credits_required)).fetchone()
+            if video_to_watch: reciprocal_task_id = reciprocal_obligation['id']
+    if not video_to_watch:
+        video_to_watch = conn.execute("SELECT v.*, u.tier FROM videos v JOIN users u ON v.user_id = u.user_id LEFT JOIN watched_videos wv ON v.video_id = wv.video_id AND wv.user_id = ? LEFT JOIN unreachable_chats uc ON uc.chat_id = v.user_id WHERE v.user_id != ? AND v.status = 'active' AND wv.video_id IS NULL AND v.video_id NOT IN (SELECT video_id FROM task_leases WHERE viewer_id != ? AND expires_at > ?) AND (? = 0 OR u.credits >= v.duration) ORDER BY uc.chat_id IS NOT NULL, CASE u.tier WHEN 'Gold' THEN 3 WHEN 'Silver' THEN 2 ELSE 1 END DESC, v.views_received ASC, wilson_lower_bound(v.good_ratings, v.total_ratings) DESC, RANDOM() LIMIT 1", (user_id, user_id, user_id, now, credits_required)).fetchone()
+    return video_to_watch, reciprocal_task_id
+
 async def get_task_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     message_sender = update.callback_query.message if update.callback_query else update.message
@@ -360,14 +694,10 @@ async def get_task_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await message_sender.reply_text("âš ï¸ You have no credits! Complete more tasks to earn credits for your own videos.")
             conn.close()
             return
-    video_to_watch, reciprocal_task_id = None, None
-    if settings.get('reciprocal_tasks_enabled') == '1':
-        reciprocal_obligation = conn.execute("SELECT id, owed_to_user_id FROM reciprocal_tasks WHERE owed_by_user_id = ? AND status = 'pending' ORDER BY created_timestamp ASC LIMIT 1", (user_id,)).fetchone()
-        if reciprocal_obligation:
-            video_to_watch = conn.execute("SELECT v.*, 'Bronze' as tier FROM videos v WHERE v.user_id = ? AND v.status = 'active' AND v.video_id NOT IN (SELECT video_id FROM watched_videos WHERE user_id = ?) ORDER BY RANDOM() LIMIT 1", (reciprocal_obligation['owed_to_user_id'], user_id)).fetchone()
-            if video_to_watch: reciprocal_task_id = reciprocal_obligation['id']
+    # A prefetched lease turns this into a claim; otherwise fall back to the full search
+    video_to_watch, reciprocal_task_id = claim_task_lease(conn, user_id, settings.get('task_credits_enabled') == '1')
     if not video_to_watch:
-        video_to_watch = conn.execute("SELECT v.*, u.tier FROM videos v JOIN users u ON v.user_id = u.user_id LEFT JOIN watched_videos wv ON v.video_id = wv.video_id AND wv.user_id = ? WHERE v.user_id != ? AND v.status = 'active' AND wv.video_id IS NULL ORDER BY CASE u.tier WHEN 'Gold' THEN 3 WHEN 'Silver' THEN 2 ELSE 1 END DESC, v.views_received ASC, RANDOM() LIMIT 1", (user_id, user_id)).fetchone()
+        video_to_watch, reciprocal_task_id = find_task_candidate(conn, user_id, settings)
     if not video_to_watch:
         await message_sender.reply_text("No new videos available right now.")
         conn.close()
@@ -376,9 +706,17 @@ async def get_task_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cursor.execute("INSERT INTO tasks (video_id, uploader_id, viewer_id, status) VALUES (?, ?, ?, 'assigned')", (video_to_watch['video_id'], video_to_watch['user_id'], user_id))
     cursor.execute("UPDATE videos SET status = 'being_watched' WHERE video_id = ?", (video_to_watch['video_id'],))
     task_type_info = "This is a direct exchange task." if reciprocal_task_id else f"Uploader Tier: {video_to_watch['tier']}"
+    task_id = cursor.lastrowid
     if reciprocal_task_id: cursor.execute("UPDATE reciprocal_tasks SET status = 'completed' WHERE id = ?", (reciprocal_task_id,))
     if settings.get('task_credits_enabled') == '1':
-        conn.execute("UPDATE users SET credits = credits - ? WHERE user_id = ?", (video_to_watch['duration'], video_to_watch['user_id']))
+        try:
+            apply_credit_change(cursor, video_to_watch['user_id'], -video_to_watch['duration'], 'task_assigned', task_id)
+        except InsufficientCredits:
+            # The uploader spent their credits between the search and this debit
+            conn.rollback()
+            conn.close()
+            await message_sender.reply_text("No new videos available right now.")
+            return
     conn.commit()
     conn.close()
     task_message = (f"ðŸ”¥ *New Task Assigned!* ({task_type_info})\n\n" f"_*Instructions:*_\n" f"1. Search YouTube for: `{video_to_watch['title']}`\n" f"2. Find the video with this thumbnail.\n" f"3. Watch at least *{max(1, video_to_watch['duration'] // 2)} minute(s)*.\n" f"4. Like, Comment, and Subscribe.\n\n" f"When done, use /submitproof.")
@@ -394,7 +732,7 @@ async def appeal_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    report_id = int(query.data.split('_')[2])
+    report_id, = decode_callback(query.data).args
     context.user_data['appeal_report_id'] = report_id
 
     await query.message.reply_text(
@@ -420,7 +758,7 @@ async def received_appeal_reason(update: Update, context: ContextTypes.DEFAULT_T
     await update.message.reply_text(" Your appeal has been submitted and will be reviewed by an admin.")
 
     # Notify admin of the appeal
-    for admin_id in ADMIN_IDS:
+    for admin_id in tenant().admin_ids:
         try:
             admin_message = (
                 f" Report Appeal Filed for Report #{report_id}\n\n"
@@ -471,19 +809,26 @@ async def received_report_reason(update: Update, context: ContextTypes.DEFAULT_T
         (reporter_id, reported_user_id, reason)
     )
     report_id = cursor.lastrowid
+    open_reports = cursor.execute("SELECT COUNT(*) FROM reports WHERE reported_user_id = ? AND status = 'filed'", (reported_user_id,)).fetchone()[0]
     conn.commit()
     conn.close()
 
     await update.message.reply_text(" Your report has been filed. Thank you.")
     
     # Notify admin
-    for admin_id in ADMIN_IDS:
+    urgent = open_reports >= REPORT_URGENT_PENDING_THRESHOLD
+    for admin_id in tenant().admin_ids:
         try:
             # This message is now more robust to prevent formatting errors
             admin_message = " New User Report Filed.\n"
             admin_message += f"Report ID: #{report_id}\n\n"
+            if urgent:
+                admin_message += f"User {reported_user_id} now has {open_reports} open reports.\n"
             admin_message += "Use /viewreports to see details."
-            await context.bot.send_message(chat_id=admin_id, text=admin_message)
+            await notify_with_digest(
+                admin_id, 'report', {'report_id': report_id, 'reported_user_id': reported_user_id},
+                lambda: context.bot.send_message(chat_id=admin_id, text=admin_message), urgent=urgent,
+            )
         except Exception as e:
             logger.error(f"Failed to send report notification to admin {admin_id}: {e}")
 
@@ -494,7 +839,7 @@ async def received_report_reason(update: Update, context: ContextTypes.DEFAULT_T
             f"*Reason:* {reason}\n\n"
             f"If you believe this report is incorrect, you have the right to appeal."
         )
-        keyboard = [[InlineKeyboardButton("Appeal This Report", callback_data=f"appeal_report_{report_id}")]]
+        keyboard = [[InlineKeyboardButton("Appeal This Report", callback_data=encode_callback("appeal_report", report_id))]]
         await context.bot.send_message(
             chat_id=reported_user_id,
             text=reported_user_message,
@@ -512,7 +857,7 @@ async def upload_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_sender = update.callback_query.message if update.callback_query else update.message
     if update.callback_query: await update.callback_query.answer()
     conn = get_db_connection()
-    video_count = conn.execute("SELECT COUNT(*) FROM videos WHERE user_id = ?", (user_id,)).fetchone()[0]
+    video_count = conn.execute("SELECT COUNT(*) FROM videos WHERE user_id = ? AND status != 'duplicate'", (user_id,)).fetchone()[0]
     conn.close()
     if video_count >= MAX_VIDEOS_PER_USER:
         await message_sender.reply_text(f"âš ï¸ You have reached the max of {MAX_VIDEOS_PER_USER} videos.")
@@ -531,6 +876,7 @@ async def received_thumbnail(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("That's not a photo. Please send an image.")
         return AWAIT_THUMBNAIL
     context.user_data['video_info']['thumbnail_file_id'] = update.message.photo[-1].file_id
+    context.user_data['video_info']['thumbnail_unique_id'] = update.message.photo[-1].file_unique_id
     await update.message.reply_text("Enter the video's duration in *minutes* (1-5).", parse_mode='Markdown')
     return AWAIT_DURATION
 
@@ -552,10 +898,23 @@ async def received_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['video_info']['link'] = None if link.lower() == 'skip' else link
     user_id = update.effective_user.id
     video = context.user_data['video_info']
+    dedupe_key = video_dedupe_key(video['link'], video['title'], video['thumbnail_unique_id'])
     conn = get_db_connection()
-    conn.execute("INSERT INTO videos (user_id, title, thumbnail_file_id, duration, link) VALUES (?, ?, ?, ?, ?)", (user_id, video['title'], video['thumbnail_file_id'], video['duration'], video['link']))
-    conn.commit()
+    duplicate = find_duplicate_video(conn, dedupe_key)
+    if not duplicate:
+        try:
+            conn.execute("INSERT INTO videos (user_id, title, thumbnail_file_id, duration, link, dedupe_key, thumbnail_unique_id) VALUES (?, ?, ?, ?, ?, ?, ?)", (user_id, video['title'], video['thumbnail_file_id'], video['duration'], video['link'], dedupe_key, video['thumbnail_unique_id']))
+            conn.commit()
+            invalidate_user_snapshots(user_id)
+        except sqlite3.IntegrityError:
+            # Lost a race with an identical upload; the unique index caught it
+            duplicate = find_duplicate_video(conn, dedupe_key)
     conn.close()
+    if duplicate:
+        owner = "your account" if duplicate['user_id'] == user_id else "another account"
+        await update.message.reply_text(f"This video is already in the exchange under {owner}, so it was not added again.")
+        context.user_data.clear()
+        return ConversationHandler.END
     await update.message.reply_text("âœ… *Video uploaded successfully!*", parse_mode='Markdown')
     context.user_data.clear()
     return ConversationHandler.END
@@ -571,54 +930,144 @@ async def submit_task_proof_start(update: Update, context: ContextTypes.DEFAULT_
     await update.message.reply_text("Upload your screen recording video as proof.")
     return AWAIT_TASK_PROOF
 
+PRESCREEN_REJECT, PRESCREEN_RETRY, PRESCREEN_FAST_TRACK, PRESCREEN_MANUAL = 'reject', 'retry', 'fast_track', 'manual'
+
+def prescreen_proof(conn, task, video):
+    """Checks a proof recording's Telegram metadata against its task and the viewer's history.
+
+    Returns (verdict, reason). `task` needs the tasks columns plus the video duration and
+    the seconds elapsed since assignment; `video` is the telegram.Video that was uploaded.
+    """
+    required_seconds = max(1, task['duration'] // 2) * 60
+    reused = conn.execute(
+        "SELECT 1 FROM tasks WHERE proof_unique_id = ? AND task_id != ? UNION ALL SELECT 1 FROM tasks_archive WHERE proof_unique_id = ? LIMIT 1",
+        (video.file_unique_id, task['task_id'], video.file_unique_id),
+    ).fetchone()
+    if reused:
+        return PRESCREEN_REJECT, "This recording was already submitted for another task."
+    if video.duration < required_seconds * PROOF_MIN_WATCH_RATIO:
+        return PRESCREEN_RETRY, f"The recording is {video.duration // 60}m {video.duration % 60}s long, but this task needs at least {required_seconds // 60} minute(s) of watching."
+    if task['elapsed_seconds'] is not None and task['elapsed_seconds'] < required_seconds * PROOF_MIN_WATCH_RATIO:
+        return PRESCREEN_REJECT, f"The proof arrived {int(task['elapsed_seconds']) // 60} minute(s) after the task was assigned, before the required watch time of {required_seconds // 60} minute(s) could pass."
+    viewer = conn.execute("SELECT completed_tasks, strikes FROM users WHERE user_id = ?", (task['viewer_id'],)).fetchone()
+    failed_tasks = conn.execute("SELECT COUNT(*) FROM tasks WHERE viewer_id = ? AND status = 'failed'", (task['viewer_id'],)).fetchone()[0]
+    bytes_per_second = (video.file_size or 0) / max(1, video.duration)
+    if (viewer and viewer['completed_tasks'] >= PROOF_FAST_TRACK_MIN_COMPLETED and viewer['strikes'] == 0 and failed_tasks == 0
+            and video.duration >= required_seconds and bytes_per_second >= PROOF_FAST_TRACK_MIN_BYTES_PER_SECOND):
+        return PRESCREEN_FAST_TRACK, None
+    return PRESCREEN_MANUAL, None
+
+def reject_task(cursor, task_id, viewer_id, reason):
+    """Fails a task, gives the viewer a strike and puts the video back in rotation. Runs inside the caller's transaction."""
+    cursor.execute("UPDATE tasks SET status = 'failed', rejection_reason = ? WHERE task_id = ?", (reason, task_id))
+    cursor.execute("UPDATE users SET strikes = strikes + 1 WHERE user_id = ?", (viewer_id,))
+    video_id = cursor.execute("SELECT video_id FROM tasks WHERE task_id = ?", (task_id,)).fetchone()['video_id']
+    cursor.execute("UPDATE videos SET status = 'active' WHERE video_id = ?", (video_id,))
+    evaluate_user_tier(cursor, viewer_id)
+
+def accept_task(cursor, task, settings):
+    """Completes a task with an accepted proof: credits the viewer, counts the view, creates the reciprocal obligation
+    and queues the viewer's notices in the outbox.
+
+    Runs inside the caller's transaction; `task` needs the tasks columns plus the video duration.
+    """
+    video_id, viewer_id, uploader_id = task['video_id'], task['viewer_id'], task['uploader_id']
+    cursor.execute("UPDATE tasks SET status = 'completed' WHERE task_id = ?", (task['task_id'],))
+    cursor.execute("UPDATE users SET completed_tasks = completed_tasks + 1 WHERE user_id = ?", (viewer_id,))
+    evaluate_user_tier(cursor, viewer_id)
+    if settings.get('task_credits_enabled') == '1':
+        apply_credit_change(cursor, viewer_id, task['duration'], 'task_completed', task['task_id'])
+    cursor.execute("INSERT OR IGNORE INTO watched_videos (user_id, video_id) VALUES (?, ?)", (viewer_id, video_id))
+    cursor.execute("UPDATE videos SET views_received = views_received + 1, status = 'active' WHERE video_id = ?", (video_id,))
+    if settings.get('reciprocal_tasks_enabled') == '1': cursor.execute("INSERT INTO reciprocal_tasks (owed_by_user_id, owed_to_user_id) VALUES (?, ?)", (uploader_id, viewer_id))
+    record_exchange_edge(cursor, viewer_id, uploader_id)
+    for index, message in enumerate(task_accepted_messages(task, settings)):
+        queue_notification(message, cursor, f"task_accepted:{task['task_id']}:{index}")
+
+def task_accepted_messages(task, settings):
+    """Builds the viewer's acceptance notice and rating prompt as send_message arguments."""
+    viewer_id = task['viewer_id']
+    messages = [dict(chat_id=viewer_id, text="ðŸŽ‰ Your proof was accepted!")]
+    if settings.get('quality_score_enabled') == '1':
+        keyboard = [[InlineKeyboardButton("ðŸ‘ Good Video", callback_data=encode_callback("rate_good", task['video_id'], task['task_id'])), InlineKeyboardButton("ðŸ‘Ž Bad Video", callback_data=encode_callback("rate_bad", task['video_id'], task['task_id']))]]
+        messages.append(dict(chat_id=viewer_id, text="Finally, please rate the quality of the video you just watched.", reply_markup=InlineKeyboardMarkup(keyboard)))
+    return messages
+
 async def received_task_proof(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.video:
         await update.message.reply_text("That's not a video. Please upload a screen recording.")
         return AWAIT_TASK_PROOF
-    task_id, proof_file_id = context.user_data.get('task_id_for_proof'), update.message.video.file_id
+    video = update.message.video
+    task_id, proof_file_id = context.user_data.get('task_id_for_proof'), video.file_id
     conn = get_db_connection()
-    conn.execute("UPDATE tasks SET proof_file_id = ?, status = 'proof_submitted', proof_timestamp = CURRENT_TIMESTAMP WHERE task_id = ?", (proof_file_id, task_id))
+    task = conn.execute(
+        "SELECT t.*, v.duration, (julianday('now') - julianday(t.assigned_timestamp)) * 86400 AS elapsed_seconds "
+        "FROM tasks t JOIN videos v ON t.video_id = v.video_id WHERE t.task_id = ? AND t.status = 'assigned'",
+        (task_id,),
+    ).fetchone()
+    if not task:
+        conn.close()
+        await update.message.reply_text("You don't have an active task.")
+        context.user_data.clear()
+        return ConversationHandler.END
+    settings = {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings").fetchall()}
+    verdict, reason = prescreen_proof(conn, task, video) if settings.get('proof_prescreen_enabled') == '1' else (PRESCREEN_MANUAL, None)
+    if verdict == PRESCREEN_RETRY:
+        conn.close()
+        await update.message.reply_text(f"{reason}\n\nPlease upload a complete screen recording, or use /cancel.")
+        return AWAIT_TASK_PROOF
+    conn.execute("UPDATE tasks SET proof_file_id = ?, proof_unique_id = ?, proof_duration = ?, status = 'proof_submitted', proof_timestamp = CURRENT_TIMESTAMP WHERE task_id = ?", (proof_file_id, video.file_unique_id, video.duration, task_id))
+    if verdict == PRESCREEN_REJECT:
+        reject_task(conn.cursor(), task_id, task['viewer_id'], f"Automatic check: {reason}")
+        conn.commit()
+        invalidate_user_snapshots(task['viewer_id'], task['uploader_id'])
+        new_strikes = conn.execute("SELECT strikes FROM users WHERE user_id = ?", (task['viewer_id'],)).fetchone()['strikes']
+        conn.close()
+        await update.message.reply_text(f"Your proof was rejected by the automatic check.\nReason: {reason}\nYou now have {new_strikes} strike(s).")
+        context.user_data.clear()
+        return ConversationHandler.END
+    if verdict == PRESCREEN_FAST_TRACK:
+        cursor = conn.cursor()
+        accept_task(cursor, task, settings)
+        queue_notification(dict(chat_id=task['uploader_id'], text=f"User {task['viewer_id']} watched your video. Their proof passed the automatic check, so no review is needed."), cursor, f"fast_tracked:{task_id}")
+        conn.commit()
+        conn.close()
+        invalidate_user_snapshots(task['viewer_id'], task['uploader_id'])
+        schedule_task_prefetch(context.application, [task['viewer_id']])
+        context.user_data.clear()
+        return ConversationHandler.END
     conn.commit()
+    invalidate_user_snapshots(task['uploader_id'])
     task_data = conn.execute("SELECT uploader_id, viewer_id FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
     conn.close()
     await update.message.reply_text("âœ… Task proof submitted for verification.")
-    verification_message = f"ðŸ”” *Task Verification Required*\n\nUser `{task_data['viewer_id']}` submitted proof."
-    keyboard = [[InlineKeyboardButton("âœ… Accept", callback_data=f"verify_accept_{task_id}"), InlineKeyboardButton("âŒ Reject", callback_data=f"verify_reject_{task_id}")]]
-    try: await context.bot.send_video(chat_id=task_data['uploader_id'], video=proof_file_id, caption=verification_message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-    except Forbidden: pass
+    verification_message = f"ðŸ”” *Task Verification Required*\n\nUser `{task_data['viewer_id']}` submitted proof.\n\nUse /reviewproofs to go through all pending proofs at once."
+    keyboard = [[InlineKeyboardButton("âœ… Accept", callback_data=encode_callback("verify_accept", task_id)), InlineKeyboardButton("âŒ Reject", callback_data=encode_callback("verify_reject", task_id))]]
+    await notify_with_digest(
+        task_data['uploader_id'], 'proof', {'task_id': task_id, 'viewer_id': task_data['viewer_id']},
+        lambda: context.bot.send_video(chat_id=task_data['uploader_id'], video=proof_file_id, caption=verification_message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown'),
+    )
     context.user_data.clear()
     return ConversationHandler.END
 
 async def handle_verification_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query, user_id = update.callback_query, update.effective_user.id
     await query.answer()
-    action, task_id = query.data.split('_')[1], int(query.data.split('_')[2])
+    callback = decode_callback(query.data)
+    action, task_id = callback.action.split('_')[1], callback.args[0]
     conn = get_db_connection()
     settings = {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings").fetchall()}
     task = conn.execute("SELECT t.*, v.duration FROM tasks t JOIN videos v ON t.video_id = v.video_id WHERE t.task_id = ? AND t.uploader_id = ? AND t.status = 'proof_submitted'", (task_id, user_id)).fetchone()
     if not task:
-        await query.edit_message_text("Task already processed.")
+        await query.edit_message_caption(caption="Task already processed.")
         conn.close()
         return
     if action == "accept":
-        video_id, viewer_id, uploader_id = task['video_id'], task['viewer_id'], task['uploader_id']
-        cursor = conn.cursor()
-        cursor.execute("UPDATE tasks SET status = 'completed' WHERE task_id = ?", (task_id,))
-        cursor.execute("UPDATE users SET completed_tasks = completed_tasks + 1 WHERE user_id = ?", (viewer_id,))
-        if settings.get('task_credits_enabled') == '1':
-            credits_earned = task['duration']
-            cursor.execute("UPDATE users SET credits = credits + ? WHERE user_id = ?", (credits_earned, viewer_id))
-        cursor.execute("INSERT OR IGNORE INTO watched_videos (user_id, video_id) VALUES (?, ?)", (viewer_id, video_id))
-        cursor.execute("UPDATE videos SET views_received = views_received + 1, status = 'active' WHERE video_id = ?", (video_id,))
-        if settings.get('reciprocal_tasks_enabled') == '1': cursor.execute("INSERT INTO reciprocal_tasks (owed_by_user_id, owed_to_user_id) VALUES (?, ?)", (uploader_id, viewer_id))
+        accept_task(conn.cursor(), task, settings)
         conn.commit()
+        invalidate_user_snapshots(task['viewer_id'], task['uploader_id'])
         await query.edit_message_caption(caption="âœ… *Proof Accepted!*\nA reciprocal task has been created.", parse_mode='Markdown')
-        try:
-            await context.bot.send_message(chat_id=viewer_id, text="ðŸŽ‰ Your proof was accepted!")
-            if settings.get('quality_score_enabled') == '1':
-                keyboard = [[InlineKeyboardButton("ðŸ‘ Good Video", callback_data=f"rate_good_{video_id}_{task_id}"), InlineKeyboardButton("ðŸ‘Ž Bad Video", callback_data=f"rate_bad_{video_id}_{task_id}")]]
-                await context.bot.send_message(chat_id=viewer_id, text="Finally, please rate the quality of the video you just watched.", reply_markup=InlineKeyboardMarkup(keyboard))
-        except Forbidden: pass
+        schedule_task_prefetch(context.application, [task['viewer_id']])
     elif action == "reject":
         context.user_data['rejection_info'] = {'task_id': task_id, 'viewer_id': task['viewer_id']}
         await query.edit_message_caption(caption="*Proof Rejection*\nPlease provide a brief reason.", parse_mode='Markdown')
@@ -629,45 +1078,46 @@ async def received_rejection_reason(update: Update, context: ContextTypes.DEFAUL
     reason, info = update.message.text, context.user_data.get('rejection_info')
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE tasks SET status = 'failed', rejection_reason = ? WHERE task_id = ?", (reason, info['task_id']))
-    cursor.execute("UPDATE users SET strikes = strikes + 1 WHERE user_id = ?", (info['viewer_id'],))
-    video_id = cursor.execute("SELECT video_id FROM tasks WHERE task_id = ?", (info['task_id'],)).fetchone()['video_id']
-    cursor.execute("UPDATE videos SET status = 'active' WHERE video_id = ?", (video_id,))
-    conn.commit()
+    reject_task(cursor, info['task_id'], info['viewer_id'], reason)
     new_strikes = conn.execute("SELECT strikes FROM users WHERE user_id = ?", (info['viewer_id'],)).fetchone()['strikes']
+    queue_notification(dict(chat_id=info['viewer_id'], text=f"âŒ Your proof was rejected.\n*Reason*: {reason}\nYou now have *{new_strikes}* strike(s).", parse_mode='Markdown'), cursor, f"task_rejected:{info['task_id']}")
+    conn.commit()
     conn.close()
+    invalidate_user_snapshots(info['viewer_id'], update.effective_user.id)
     await update.message.reply_text("Rejection recorded.")
-    try: await context.bot.send_message(chat_id=info['viewer_id'], text=f"âŒ Your proof was rejected.\n*Reason*: {reason}\nYou now have *{new_strikes}* strike(s).", parse_mode='Markdown')
-    except Forbidden: pass
     context.user_data.clear()
     return ConversationHandler.END
 
 async def rate_video_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, rating_type, video_id_str, task_id_str = query.data.split('_')
-    video_id, task_id = int(video_id_str), int(task_id_str)
+    callback = decode_callback(query.data)
+    rating_type = callback.action.split('_')[1]
+    video_id, task_id = callback.args
     rating_value = 1 if rating_type == "good" else 0
     conn = get_db_connection()
     task = conn.execute("SELECT quality_rating FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
-    if task and task['quality_rating'] is not None:
+    if not task:
+        await query.edit_message_text("This task is no longer available for rating.")
+        conn.close()
+        return
+    # Claiming the rating and bumping the counters are single statements, so concurrent taps can't double-count
+    claimed = conn.execute("UPDATE tasks SET quality_rating = ? WHERE task_id = ? AND quality_rating IS NULL", (rating_value, task_id)).rowcount
+    if not claimed:
         await query.edit_message_text("You have already rated this video. Thank you!")
         conn.close()
         return
-    conn.execute("UPDATE tasks SET quality_rating = ? WHERE task_id = ?", (rating_value, task_id))
-    video_info = conn.execute("SELECT quality_score, total_ratings FROM videos WHERE video_id = ?", (video_id,)).fetchone()
-    new_total_ratings = video_info['total_ratings'] + 1
-    new_quality_score = ((video_info['quality_score'] * video_info['total_ratings']) + (rating_value * 100)) / new_total_ratings
-    conn.execute("UPDATE videos SET quality_score = ?, total_ratings = ? WHERE video_id = ?", (new_quality_score, new_total_ratings, video_id))
-    await query.edit_message_text("Thank you for your feedback!")
-    if new_total_ratings >= MIN_RATINGS_FOR_FLAG and new_quality_score < QUALITY_SCORE_FLAG_THRESHOLD:
-        conn.execute("UPDATE videos SET status = 'flagged' WHERE video_id = ?", (video_id,))
-        video_title = conn.execute("SELECT title FROM videos WHERE video_id = ?", (video_id,)).fetchone()['title']
-        for admin_id in ADMIN_IDS:
-            try: await context.bot.send_message(chat_id=admin_id, text=f"âš ï¸ *Video Flagged*\n\nVideo `{video_title}` (ID: {video_id}) has been automatically flagged for low quality ({new_quality_score:.0f}%) and paused.")
-            except Forbidden: pass
+    conn.execute(
+        "UPDATE videos SET good_ratings = good_ratings + ?, total_ratings = total_ratings + 1, "
+        "quality_score = 100.0 * (good_ratings + ?) / (total_ratings + 1), rating_dirty = 1 WHERE video_id = ?",
+        (rating_value, rating_value, video_id),
+    )
+    owner_id = conn.execute("SELECT user_id FROM videos WHERE video_id = ?", (video_id,)).fetchone()['user_id']
+    evaluate_user_tier(conn.cursor(), owner_id)
     conn.commit()
     conn.close()
+    invalidate_user_snapshots(owner_id)
+    await query.edit_message_text("Thank you for your feedback!")
 
 # --- ADMIN ---
 
@@ -675,11 +1125,10 @@ async def rate_video_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def my_reports_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Allows a user to see the status of their own reports."""
     user_id = update.effective_user.id
-    conn = get_db_connection()
-
-    reports_filed = conn.execute("SELECT report_id, reported_user_id, status FROM reports WHERE reporter_id = ? ORDER BY timestamp DESC", (user_id,)).fetchall()
-    reports_against = conn.execute("SELECT report_id, reporter_id, status FROM reports WHERE reported_user_id = ? ORDER BY timestamp DESC", (user_id,)).fetchall()
-    conn.close()
+    reports_filed, reports_against = tenant().snapshots.get(('reports', user_id), lambda conn: (
+        [dict(row) for row in conn.execute("SELECT report_id, reported_user_id, status FROM reports WHERE reporter_id = ? ORDER BY timestamp DESC", (user_id,)).fetchall()],
+        [dict(row) for row in conn.execute("SELECT report_id, reporter_id, status FROM reports WHERE reported_user_id = ? ORDER BY timestamp DESC", (user_id,)).fetchall()],
+    ))
 
     message = " *Your Report Summary*\n\n"
     message += "*Reports You Have Filed:*\n"
@@ -705,15 +1154,12 @@ async def admin_view_reports(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Allows an admin to view the latest user reports and any appeals."""
     if not is_admin(update.effective_user.id): return
 
-    conn = get_db_connection()
     try:
-        reports = conn.execute("SELECT * FROM reports ORDER BY timestamp DESC LIMIT 10").fetchall()
+        with tenant().read_pool.connection() as conn:
+            reports = [dict(row) for row in conn.execute("SELECT * FROM reports ORDER BY timestamp DESC LIMIT 10").fetchall()]
     except sqlite3.OperationalError:
         await update.message.reply_text("Error: The 'reports' table seems to be missing. Please delete your .db file and restart the bot.")
-        conn.close()
         return
-        
-    conn.close()
 
     if not reports:
         await update.message.reply_text("No user reports have been filed yet.")
@@ -755,12 +1201,12 @@ async def admin_user_management_panel(update: Update, context: ContextTypes.DEFA
     await query.answer()
     
     keyboard = [
-        [InlineKeyboardButton("ðŸ”’ Block User", callback_data="instruct_block"), InlineKeyboardButton("ðŸ”“ Unblock User", callback_data="instruct_unblock")],
-        [InlineKeyboardButton("âš¡ï¸ Add Strike", callback_data="instruct_addstrike"), InlineKeyboardButton("âœ¨ Remove Strike", callback_data="instruct_removestrike")],
-        [InlineKeyboardButton("ðŸ“ Pending Proofs", callback_data="instruct_pendingproofs")],
+        [InlineKeyboardButton("ðŸ”’ Block User", callback_data=encode_callback("instruct", "block")), InlineKeyboardButton("ðŸ”“ Unblock User", callback_data=encode_callback("instruct", "unblock"))],
+        [InlineKeyboardButton("âš¡ï¸ Add Strike", callback_data=encode_callback("instruct", "addstrike")), InlineKeyboardButton("âœ¨ Remove Strike", callback_data=encode_callback("instruct", "removestrike"))],
+        [InlineKeyboardButton("ðŸ“ Pending Proofs", callback_data=encode_callback("instruct", "pendingproofs"))],
         # This is the new button
-        [InlineKeyboardButton("ðŸ“„ Review Reports", callback_data="instruct_viewreports")],
-        [InlineKeyboardButton("Â« Back to Main Panel", callback_data="admin_main_panel")]
+        [InlineKeyboardButton("ðŸ“„ Review Reports", callback_data=encode_callback("instruct", "viewreports"))],
+        [InlineKeyboardButton("Â« Back to Main Panel", callback_data=encode_callback("admin_main_panel"))]
     ]
     
     await query.edit_message_text(
@@ -776,16 +1222,16 @@ async def admin_show_command_instructions(update: Update, context: ContextTypes.
     await query.answer()
     
     command_map = {
-        "instruct_block": "To block a user, type:\n`/block <user_id>`",
-        "instruct_unblock": "To unblock a user, type:\n`/unblock <user_id>`",
-        "instruct_addstrike": "To add a strike, type:\n`/addstrike <user_id>`",
-        "instruct_removestrike": "To remove a strike, type:\n`/removestrike <user_id>`",
-        "instruct_pendingproofs": "To see users with pending proofs, type:\n`/pendingproofs`",
+        "block": "To block a user, type:\n`/block <user_id>`",
+        "unblock": "To unblock a user, type:\n`/unblock <user_id>`",
+        "addstrike": "To add a strike, type:\n`/addstrike <user_id>`",
+        "removestrike": "To remove a strike, type:\n`/removestrike <user_id>`",
+        "pendingproofs": "To see users with pending proofs, type:\n`/pendingproofs`",
         # This is the new instruction
-        "instruct_viewreports": "To see the latest user reports, type:\n`/viewreports`",
+        "viewreports": "To see the latest user reports, type:\n`/viewreports`",
     }
     
-    instruction_text = command_map.get(query.data, "Unknown command.")
+    instruction_text = command_map.get(decode_callback(query.data).args[0], "Unknown command.")
     await query.message.reply_text(instruction_text, parse_mode='Markdown')
 
 #
@@ -795,10 +1241,10 @@ async def admin_panel_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not is_admin(update.effective_user.id): return
     
     keyboard = [
-        [InlineKeyboardButton("ðŸ’³ Payment Settings", callback_data="admin_payment_settings")],
-        [InlineKeyboardButton("âš™ï¸ Feature Settings", callback_data="admin_feature_settings")],
+        [InlineKeyboardButton("ðŸ’³ Payment Settings", callback_data=encode_callback("admin_payment_settings"))],
+        [InlineKeyboardButton("âš™ï¸ Feature Settings", callback_data=encode_callback("admin_feature_settings"))],
         # This is the new button we are adding
-        [InlineKeyboardButton("ðŸ‘¨â€âš–ï¸ User Management", callback_data="admin_user_management")]
+        [InlineKeyboardButton("ðŸ‘¨â€âš–ï¸ User Management", callback_data=encode_callback("admin_user_management"))]
     ]
     
     # Use edit_message_text if coming from a callback, otherwise reply
@@ -814,40 +1260,39 @@ async def admin_panel_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def admin_payment_settings_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    conn = get_db_connection()
-    settings = {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings").fetchall()}
-    conn.close()
+    with tenant().read_pool.connection() as conn:
+        settings = fetch_settings(conn)
     payment_status = "âœ… Enabled" if settings.get('payment_required') == '1' else "âŒ Disabled"
     photo_status = "âœ… Set" if settings.get('payment_photo_id') else "âŒ Not Set"
     tx_id_status = "âœ… Enabled" if settings.get('unique_transaction_id_enabled') == '1' else "âŒ Disabled"
     
     keyboard = [
-        [InlineKeyboardButton(f"Require Payments: {payment_status}", callback_data="admin_toggle_payment")],
+        [InlineKeyboardButton(f"Require Payments: {payment_status}", callback_data=encode_callback("admin_toggle", "payment"))],
         # The buttons are now clearer and don't conflict
-        [InlineKeyboardButton("Set Subscription Price", callback_data="admin_set_price"), InlineKeyboardButton("Set UPI ID", callback_data="admin_set_upi")],
-        [InlineKeyboardButton(f"Payment Photo: {photo_status}", callback_data="admin_set_photo"), InlineKeyboardButton("Remove Photo", callback_data="admin_remove_photo")],
-        [InlineKeyboardButton(f"Unique TX ID: {tx_id_status}", callback_data="admin_toggle_tx")],
-        [InlineKeyboardButton("Â« Back to Main Panel", callback_data="admin_main_panel")]
+        [InlineKeyboardButton("Set Subscription Price", callback_data=encode_callback("admin_set_price")), InlineKeyboardButton("Set UPI ID", callback_data=encode_callback("admin_set_upi"))],
+        [InlineKeyboardButton(f"Payment Photo: {photo_status}", callback_data=encode_callback("admin_set_photo")), InlineKeyboardButton("Remove Photo", callback_data=encode_callback("admin_remove_photo"))],
+        [InlineKeyboardButton(f"Unique TX ID: {tx_id_status}", callback_data=encode_callback("admin_toggle", "tx"))],
+        [InlineKeyboardButton("Â« Back to Main Panel", callback_data=encode_callback("admin_main_panel"))]
     ]
     await query.message.edit_text("ðŸ’³ *Payment Settings*", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
 async def admin_feature_settings_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    conn = get_db_connection()
-    settings = {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings").fetchall()}
-    conn.close()
+    with tenant().read_pool.connection() as conn:
+        settings = fetch_settings(conn)
     reciprocal_status = "âœ… Enabled" if settings.get('reciprocal_tasks_enabled') == '1' else "âŒ Disabled"
     quality_status = "âœ… Enabled" if settings.get('quality_score_enabled') == '1' else "âŒ Disabled"
     credits_status = "âœ… Enabled" if settings.get('task_credits_enabled') == '1' else "âŒ Disabled"
-    keyboard = [[InlineKeyboardButton(f"Reciprocal Tasks: {reciprocal_status}", callback_data="admin_toggle_reciprocal")], [InlineKeyboardButton(f"Video Quality Score: {quality_status}", callback_data="admin_toggle_quality")], [InlineKeyboardButton(f"Task Credits System: {credits_status}", callback_data="admin_toggle_credits")], [InlineKeyboardButton("Â« Back to Main Panel", callback_data="admin_main_panel")]]
+    prescreen_status = "âœ… Enabled" if settings.get('proof_prescreen_enabled') == '1' else "âŒ Disabled"
+    keyboard = [[InlineKeyboardButton(f"Reciprocal Tasks: {reciprocal_status}", callback_data=encode_callback("admin_toggle", "reciprocal"))], [InlineKeyboardButton(f"Video Quality Score: {quality_status}", callback_data=encode_callback("admin_toggle", "quality"))], [InlineKeyboardButton(f"Task Credits System: {credits_status}", callback_data=encode_callback("admin_toggle", "credits"))], [InlineKeyboardButton(f"Proof Pre-screening: {prescreen_status}", callback_data=encode_callback("admin_toggle", "prescreen"))], [InlineKeyboardButton("Â« Back to Main Panel", callback_data=encode_callback("admin_main_panel"))]]
     await query.message.edit_text("âš™ï¸ *Feature Settings*", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
 async def admin_toggle_setting(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    setting_key = query.data.split('_')[-1]
-    db_key_map = {'payment': 'payment_required', 'tx': 'unique_transaction_id_enabled', 'reciprocal': 'reciprocal_tasks_enabled', 'quality': 'quality_score_enabled', 'credits': 'task_credits_enabled'}
+    setting_key, = decode_callback(query.data).args
+    db_key_map = {'payment': 'payment_required', 'tx': 'unique_transaction_id_enabled', 'reciprocal': 'reciprocal_tasks_enabled', 'quality': 'quality_score_enabled', 'credits': 'task_credits_enabled', 'prescreen': 'proof_prescreen_enabled'}
     db_key = db_key_map.get(setting_key)
     if not db_key: return
     conn = get_db_connection()
@@ -856,7 +1301,8 @@ async def admin_toggle_setting(update: Update, context: ContextTypes.DEFAULT_TYP
     conn.execute("UPDATE settings SET value = ? WHERE key = ?", (new_val, db_key))
     conn.commit()
     conn.close()
-    if "payment" in query.data or "tx" in query.data:
+    tenant().snapshots.invalidate('settings')
+    if setting_key in ('payment', 'tx'):
         await admin_payment_settings_panel(update, context)
     else:
         await admin_feature_settings_panel(update, context)
@@ -869,6 +1315,7 @@ async def admin_approve_payment(update: Update, context: ContextTypes.DEFAULT_TY
         res = conn.execute("UPDATE users SET has_paid = 1 WHERE user_id = ?", (user_id,))
         conn.commit()
         conn.close()
+        tenant().snapshots.invalidate(('trial', user_id))
         if res.rowcount > 0:
             await update.message.reply_text(f"âœ… Access granted to user `{user_id}`.", parse_mode='Markdown')
             try: await context.bot.send_message(chat_id=user_id, text="ðŸŽ‰ An admin has approved your access! Use /menu to get started.")
@@ -886,6 +1333,7 @@ async def admin_received_price(update: Update, context: ContextTypes.DEFAULT_TYP
     conn.execute("UPDATE settings SET value = ? WHERE key = 'payment_price'", (update.message.text,))
     conn.commit()
     conn.close()
+    tenant().snapshots.invalidate('settings')
     await update.message.reply_text(f"âœ… Price updated to: {update.message.text}")
     return ConversationHandler.END
 
@@ -903,6 +1351,7 @@ async def admin_received_instructions(update: Update, context: ContextTypes.DEFA
     conn.execute("UPDATE settings SET value = ? WHERE key = 'upi_id'", (update.message.text,))
     conn.commit()
     conn.close()
+    tenant().snapshots.invalidate('settings')
     await update.message.reply_text(f"âœ… UPI ID has been updated to: {update.message.text}")
     return ConversationHandler.END
 
@@ -920,6 +1369,7 @@ async def admin_received_photo(update: Update, context: ContextTypes.DEFAULT_TYP
     conn.execute("UPDATE settings SET value = ? WHERE key = 'payment_photo_id'", (photo_id,))
     conn.commit()
     conn.close()
+    tenant().snapshots.invalidate('settings')
     await update.message.reply_text("âœ… Payment photo has been updated successfully.")
     return ConversationHandler.END
 
@@ -930,6 +1380,7 @@ async def admin_remove_photo(update: Update, context: ContextTypes.DEFAULT_TYPE)
     conn.execute("UPDATE settings SET value = NULL WHERE key = 'payment_photo_id'")
     conn.commit()
     conn.close()
+    tenant().snapshots.invalidate('settings')
     await query.message.reply_text("âœ… Payment photo has been removed.")
     await admin_payment_settings_panel(update, context)
 
@@ -945,6 +1396,17 @@ async def admin_approve_info(update: Update, context: ContextTypes.DEFAULT_TYPE)
 #
 # REPLACE your existing initialize_database_additions function with this one
 #
+# Trial expiry as epoch seconds from the stored (local time) trial start; takes the trial length in seconds
+TRIAL_EXPIRY_SQL = "CAST(strftime('%s', trial_start_date, 'utc') AS INTEGER) + ?"
+
+def add_column_if_missing(cursor, table: str, column: str, definition: str) -> bool:
+    """Adds a column unless it already exists. Returns True if the column was added."""
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column in existing:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
 def initialize_database_additions():
     """Safely adds new columns and settings to the database without altering existing data."""
     conn = get_db_connection()
@@ -977,14 +1439,233 @@ def initialize_database_additions():
         if "duplicate column name" not in str(e):
             raise
         
+    # Archive tables for finished tasks and reciprocal obligations (same columns + archive time)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS tasks_archive (
+        task_id INTEGER PRIMARY KEY, video_id INTEGER NOT NULL, uploader_id INTEGER NOT NULL,
+        viewer_id INTEGER NOT NULL, status TEXT NOT NULL, proof_file_id TEXT,
+        assigned_timestamp DATETIME, proof_timestamp DATETIME, rejection_reason TEXT,
+        quality_rating INTEGER, archived_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS reciprocal_tasks_archive (
+        id INTEGER PRIMARY KEY, owed_by_user_id INTEGER NOT NULL,
+        owed_to_user_id INTEGER NOT NULL, status TEXT NOT NULL,
+        created_timestamp DATETIME, archived_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archive_viewer ON tasks_archive (viewer_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archive_uploader ON tasks_archive (uploader_id)")
+
+    # Indexes for the hot-path lookups on the (now bounded) live tables
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_viewer_status ON tasks (viewer_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_uploader_status ON tasks (uploader_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reciprocal_owed_by_status ON reciprocal_tasks (owed_by_user_id, status)")
+
+    # Rollups: triggers append one row per interesting change to activity_events,
+    # and the rollup job folds everything past the watermark into hourly/daily counters
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS activity_events (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT, metric TEXT NOT NULL,
+        event_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE TABLE IF NOT EXISTS rollup_hourly (bucket TEXT NOT NULL, metric TEXT NOT NULL, value INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (bucket, metric))")
+    cursor.execute("CREATE TABLE IF NOT EXISTS rollup_daily (bucket TEXT NOT NULL, metric TEXT NOT NULL, value INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (bucket, metric))")
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_rollup_task_assigned AFTER INSERT ON tasks
+    BEGIN INSERT INTO activity_events (metric) VALUES ('tasks_assigned'); END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_rollup_task_finished AFTER UPDATE OF status ON tasks
+    WHEN NEW.status != OLD.status AND NEW.status IN ('completed', 'failed')
+    BEGIN INSERT INTO activity_events (metric) VALUES (CASE NEW.status WHEN 'completed' THEN 'tasks_completed' ELSE 'tasks_rejected' END); END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_rollup_user_registered AFTER INSERT ON users
+    BEGIN INSERT INTO activity_events (metric) VALUES ('users_registered'); END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_rollup_user_paid AFTER UPDATE OF has_paid ON users
+    WHEN NEW.has_paid = 1 AND OLD.has_paid = 0
+    BEGIN INSERT INTO activity_events (metric) VALUES ('users_paid'); END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_rollup_video_flagged AFTER UPDATE OF status ON videos
+    WHEN NEW.status = 'flagged' AND OLD.status != 'flagged'
+    BEGIN INSERT INTO activity_events (metric) VALUES ('videos_flagged'); END
+    """)
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('rollup_event_watermark', '0')")
+
+    # Exchange graph for collusion detection: one edge per (viewer -> uploader) with its accept count
+    edges_exist = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'exchange_edges'").fetchone()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS exchange_edges (
+        viewer_id INTEGER NOT NULL, uploader_id INTEGER NOT NULL, accepts INTEGER NOT NULL DEFAULT 0,
+        last_accept_timestamp DATETIME, PRIMARY KEY (viewer_id, uploader_id)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_exchange_edges_uploader ON exchange_edges (uploader_id, viewer_id)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS exchange_dirty_users (user_id INTEGER PRIMARY KEY, marked_seq INTEGER NOT NULL DEFAULT 0)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS collusion_flags (
+        ring_key TEXT PRIMARY KEY, members TEXT NOT NULL, score REAL NOT NULL,
+        flagged_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    if not edges_exist:
+        # One-time backfill from the task history; afterwards edges are maintained on each accept
+        cursor.execute("""
+        INSERT INTO exchange_edges (viewer_id, uploader_id, accepts, last_accept_timestamp)
+        SELECT viewer_id, uploader_id, COUNT(*), MAX(COALESCE(proof_timestamp, assigned_timestamp))
+        FROM (SELECT viewer_id, uploader_id, proof_timestamp, assigned_timestamp FROM tasks WHERE status = 'completed'
+              UNION ALL SELECT viewer_id, uploader_id, proof_timestamp, assigned_timestamp FROM tasks_archive WHERE status = 'completed')
+        GROUP BY viewer_id, uploader_id
+        """)
+        cursor.execute("INSERT OR IGNORE INTO exchange_dirty_users (user_id) SELECT viewer_id FROM exchange_edges")
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('rollup_trial_watermark', datetime('now'))")
+
+    # Before trial expiry was precomputed, free_trial_days was enforced as hours (the default was '24').
+    # Convert a stored value once, rounding up, before the backfill below reads it as days.
+    legacy_trial = cursor.execute("SELECT value FROM settings WHERE key = 'free_trial_days'").fetchone()
+    if legacy_trial and 'trial_expires_at' not in {row[1] for row in cursor.execute("PRAGMA table_info(users)").fetchall()}:
+        trial_hours = int(legacy_trial['value'])
+        trial_days = math.ceil(trial_hours / 24)
+        cursor.execute("UPDATE settings SET value = ? WHERE key = 'free_trial_days'", (str(trial_days),))
+        logger.info(f"Converted free_trial_days from {trial_hours} hour(s) to {trial_days} day(s).")
+
     # Add new settings for the trial and subscription system
     new_settings = {
-        'free_trial_days': '24', # Default to 24 hours
+        'free_trial_days': '1', # Trial length in days
         'subscription_price': '30',
-        'upi_id': 'your-upi-id@oksbi'
+        'upi_id': 'your-upi-id@oksbi',
+        'archive_retention_days': '30',
+        'proof_prescreen_enabled': '1',
+        'digest_window_seconds': '300',
+        'video_dedupe_completed': '0',
+        # Tier thresholds: completed tasks, weighted video quality (%), strikes
+        'tier_silver_min_completed': '20', 'tier_silver_min_quality': '60', 'tier_silver_max_strikes': '1',
+        'tier_gold_min_completed': '100', 'tier_gold_min_quality': '80', 'tier_gold_max_strikes': '0'
     }
     for key, value in new_settings.items():
         cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    # Precomputed trial expiry (epoch seconds), backfilled once from trial_start_date
+    if add_column_if_missing(cursor, "users", "trial_expires_at", "INTEGER"):
+        trial_days = int(cursor.execute("SELECT value FROM settings WHERE key = 'free_trial_days'").fetchone()['value'])
+        cursor.execute(f"UPDATE users SET trial_expires_at = {TRIAL_EXPIRY_SQL} WHERE trial_start_date IS NOT NULL", (trial_days * 86400,))
+        logger.info("Backfilled trial_expires_at for existing users.")
+    add_column_if_missing(cursor, "users", "trial_reminder_sent", "INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("DROP INDEX IF EXISTS idx_users_trial_start")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_trial_expires ON users (trial_expires_at)")
+
+    # Chats that blocked the bot (or migrated); consulted before every send
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS unreachable_chats (
+        chat_id INTEGER PRIMARY KEY,
+        reason TEXT,
+        migrated_to INTEGER,
+        marked_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Soft next-task reservations made by the prefetcher (one per viewer)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS task_leases (
+        viewer_id INTEGER PRIMARY KEY,
+        video_id INTEGER NOT NULL,
+        reciprocal_task_id INTEGER,
+        expires_at INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_leases_video ON task_leases (video_id, expires_at)")
+
+    # Append-only history of every credit change, plus periodic per-user balance checkpoints
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS credit_ledger (
+        entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        balance_after INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        task_id INTEGER,
+        created_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_credit_ledger_user ON credit_ledger (user_id, entry_id)")
+    cursor.execute("CREATE TRIGGER IF NOT EXISTS credit_ledger_no_update BEFORE UPDATE ON credit_ledger BEGIN SELECT RAISE(ABORT, 'credit_ledger is append-only'); END")
+    cursor.execute("CREATE TRIGGER IF NOT EXISTS credit_ledger_no_delete BEFORE DELETE ON credit_ledger BEGIN SELECT RAISE(ABORT, 'credit_ledger is append-only'); END")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS credit_snapshots (
+        user_id INTEGER NOT NULL,
+        entry_id INTEGER NOT NULL,
+        balance INTEGER NOT NULL,
+        created_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, entry_id)
+    )
+    """)
+    # Normalized identity of each video (see video_dedupe_key), checked on upload
+    add_column_if_missing(cursor, "videos", "dedupe_key", "TEXT")
+    add_column_if_missing(cursor, "videos", "thumbnail_unique_id", "TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_videos_dedupe_key ON videos (dedupe_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_videos_user ON videos (user_id)")
+
+    # Durable outbox: user-visible messages committed in the same transaction as the change they report
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT UNIQUE,
+        chat_id INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        sent_timestamp DATETIME
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at, outbox_id) WHERE status = 'pending'")
+
+    # Raw rating counters (quality_score is kept as their percentage) and the changed-since-last-scan marker
+    if add_column_if_missing(cursor, "videos", "good_ratings", "INTEGER NOT NULL DEFAULT 0"):
+        cursor.execute("UPDATE videos SET good_ratings = CAST(ROUND(quality_score * total_ratings / 100.0) AS INTEGER) WHERE total_ratings > 0")
+    add_column_if_missing(cursor, "videos", "rating_dirty", "INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_videos_rating_dirty ON videos (video_id) WHERE rating_dirty = 1")
+
+    # Full-text indexes over report and appeal text and video titles. They are external-content
+    # FTS5 tables: the text stays in reports/videos and the triggers keep the index in step.
+    add_column_if_missing(cursor, "reports", "appeal_reason", "TEXT")
+    existing_tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+    for fts_table, source_table, id_column, text_columns in SEARCH_INDEXES:
+        columns = ", ".join(text_columns)
+        new_values = ", ".join(f"new.{column}" for column in text_columns)
+        old_values = ", ".join(f"old.{column}" for column in text_columns)
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({columns}, content='{source_table}', content_rowid='{id_column}', tokenize='porter unicode61 remove_diacritics 2')")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source_table} BEGIN INSERT INTO {fts_table} (rowid, {columns}) VALUES (new.{id_column}, {new_values}); END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source_table} BEGIN INSERT INTO {fts_table} ({fts_table}, rowid, {columns}) VALUES ('delete', old.{id_column}, {old_values}); END")
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {columns} ON {source_table} BEGIN "
+            f"INSERT INTO {fts_table} ({fts_table}, rowid, {columns}) VALUES ('delete', old.{id_column}, {old_values}); "
+            f"INSERT INTO {fts_table} (rowid, {columns}) VALUES (new.{id_column}, {new_values}); END"
+        )
+        if fts_table not in existing_tables:
+            cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+
+    # The first time the ledger exists, existing balances become opening entries
+    cursor.execute(
+        "INSERT INTO credit_ledger (user_id, delta, balance_after, reason) "
+        "SELECT user_id, credits, credits, 'opening_balance' FROM users "
+        "WHERE credits != 0 AND NOT EXISTS (SELECT 1 FROM credit_ledger)"
+    )
+
+    # Proof metadata used by the pre-screening rules
+    for table in ("tasks", "tasks_archive"):
+        add_column_if_missing(cursor, table, "proof_unique_id", "TEXT")
+        add_column_if_missing(cursor, table, "proof_duration", "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_proof_unique ON tasks (proof_unique_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archive_proof_unique ON tasks_archive (proof_unique_id)")
     
     conn.commit()
     conn.close()
@@ -1031,7 +1712,9 @@ async def admin_add_strike(update: Update, context: ContextTypes.DEFAULT_TYPE):
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("UPDATE users SET strikes = strikes + 1 WHERE user_id = ?", (user_id_to_strike,))
+        evaluate_user_tier(cursor, user_id_to_strike)
         conn.commit()
+        invalidate_user_snapshots(user_id_to_strike)
         
         new_strikes = cursor.execute("SELECT strikes FROM users WHERE user_id = ?", (user_id_to_strike,)).fetchone()['strikes']
         await update.message.reply_text(f"âš¡ï¸ Strike added. User `{user_id_to_strike}` now has {new_strikes} strike(s).", parse_mode='Markdown')
@@ -1054,7 +1737,9 @@ async def admin_remove_strike(update: Update, context: ContextTypes.DEFAULT_TYPE
         user_id_to_pardon = int(context.args[0])
         conn = get_db_connection()
         conn.execute("UPDATE users SET strikes = strikes - 1 WHERE user_id = ? AND strikes > 0", (user_id_to_pardon,))
+        evaluate_user_tier(conn.cursor(), user_id_to_pardon)
         conn.commit()
+        invalidate_user_snapshots(user_id_to_pardon)
         new_strikes = conn.execute("SELECT strikes FROM users WHERE user_id = ?", (user_id_to_pardon,)).fetchone()['strikes']
         conn.close()
         await update.message.reply_text(f"âœ¨ Strike removed. User `{user_id_to_pardon}` now has {new_strikes} strike(s).", parse_mode='Markdown')
@@ -1063,16 +1748,14 @@ async def admin_remove_strike(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def admin_get_pending_proofs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id): return
-    conn = get_db_connection()
-    pending = conn.execute("""
-        SELECT u.user_id, u.first_name, COUNT(t.task_id) as pending_count
-        FROM users u
-        JOIN tasks t ON u.user_id = t.uploader_id
-        WHERE t.status = 'proof_submitted'
-        GROUP BY u.user_id
-        ORDER BY pending_count DESC
-    """).fetchall()
-    conn.close()
+    with tenant().read_pool.connection() as conn:
+        pending = conn.execute("""
+            SELECT uploader_id AS user_id, COUNT(*) as pending_count
+            FROM tasks
+            WHERE status = 'proof_submitted'
+            GROUP BY uploader_id
+            ORDER BY pending_count DESC
+        """).fetchall()
     
     if not pending:
         await update.message.reply_text("No users have pending proofs to verify.")
@@ -1080,7 +1763,7 @@ async def admin_get_pending_proofs(update: Update, context: ContextTypes.DEFAULT
 
     message = "ðŸ“ *Users with Pending Proof Verifications:*\n\n"
     for row in pending:
-        message += f"- `{row['user_id']}` ({row['first_name']}): *{row['pending_count']}* proof(s)\n"
+        message += f"- `{row['user_id']}`: *{row['pending_count']}* proof(s)\n"
     
     await update.message.reply_text(message, parse_mode='Markdown')
 
@@ -1134,12 +1817,12 @@ async def received_subscription_proof(update: Update, context: ContextTypes.DEFA
     
     keyboard = InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("âœ… Approve Subscription", callback_data=f"sub_approve_{user.id}"),
-            InlineKeyboardButton("âŒ Reject Payment", callback_data=f"sub_reject_{user.id}")
+            InlineKeyboardButton("âœ… Approve Subscription", callback_data=encode_callback("sub_approve", user.id)),
+            InlineKeyboardButton("âŒ Reject Payment", callback_data=encode_callback("sub_reject", user.id))
         ]
     ])
     
-    for admin_id in ADMIN_IDS:
+    for admin_id in tenant().admin_ids:
         try:
             # The parse_mode has been removed to ensure reliability
             await context.bot.send_photo(
@@ -1161,8 +1844,8 @@ async def handle_subscription_approval(update: Update, context: ContextTypes.DEF
     query = update.callback_query
     await query.answer()
     
-    action, user_id_str = query.data.split('_', 2)[1:]
-    user_id = int(user_id_str)
+    callback = decode_callback(query.data)
+    action, user_id = callback.action.split('_')[1], callback.args[0]
     
     conn = get_db_connection()
     if action == "approve":
@@ -1184,6 +1867,7 @@ async def handle_subscription_approval(update: Update, context: ContextTypes.DEF
             logger.warning(f"Could not send rejection message to user {user_id}.")
             
     conn.close()
+    tenant().snapshots.invalidate(('trial', user_id))
 
 
 # --- New Feature: Free Trial Management ---
@@ -1204,10 +1888,17 @@ async def admin_received_trial_days(update: Update, context: ContextTypes.DEFAUL
             
         conn = get_db_connection()
         conn.execute("UPDATE settings SET value = ? WHERE key = 'free_trial_days'", (str(days),))
+        # Recompute every stored expiry in one statement; re-arm the reminder where the expiry moved
+        recomputed = conn.execute(
+            f"UPDATE users SET trial_reminder_sent = CASE WHEN trial_expires_at = {TRIAL_EXPIRY_SQL} THEN trial_reminder_sent ELSE 0 END, "
+            f"trial_expires_at = {TRIAL_EXPIRY_SQL} WHERE trial_start_date IS NOT NULL",
+            (days * 86400, days * 86400)
+        ).rowcount
         conn.commit()
         conn.close()
+        tenant().snapshots.invalidate('settings')
         
-        await update.message.reply_text(f"âœ… Free trial period has been updated to {days} days.")
+        await update.message.reply_text(f"âœ… Free trial period has been updated to {days} days. Trial expiry recomputed for {recomputed} user(s).")
         return ConversationHandler.END
     except ValueError:
         await update.message.reply_text("Invalid number. Please enter a whole number for the days.")
@@ -1216,57 +1907,1982 @@ async def admin_received_trial_days(update: Update, context: ContextTypes.DEFAUL
 async def trial_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Allows a user to check their current trial status."""
     user_id = update.effective_user.id
-    conn = get_db_connection()
-    user = conn.execute("SELECT has_paid, trial_start_date FROM users WHERE user_id = ?", (user_id,)).fetchone()
-    settings = {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings").fetchall()}
-    conn.close()
+    def load_trial(conn):
+        row = conn.execute("SELECT has_paid, trial_expires_at FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return dict(row) if row else None  # a plain dict, so the cached value holds no reference to the pooled connection
+    user = tenant().snapshots.get(('trial', user_id), load_trial)
+    settings = tenant().snapshots.get('settings', fetch_settings)
+
+    if not user:
+        await update.message.reply_text("You are not registered yet. Use /start to begin.")
+        return
 
     if user['has_paid']:
         await update.message.reply_text("âœ… You have an active subscription and full access to the bot.")
         return
 
     trial_days = int(settings.get('free_trial_days', 0))
-    if trial_days == 0 or not user['trial_start_date']:
+    if trial_days == 0 or user['trial_expires_at'] is None:
         await update.message.reply_text("â„¹ï¸ A free trial is not currently active for your account.\nUse /pay to subscribe.")
         return
 
+    seconds_left = user['trial_expires_at'] - int(time.time())
+    if seconds_left > 0:
+        days_left, remainder = divmod(seconds_left, 86400)
+        hours_left = remainder // 3600
+        message = (f"â³ You are currently on a free trial.\n"
+                   f"It will expire in approximately *{days_left} days and {hours_left} hours*.\n\n"
+                   f"You can use /pay at any time to get a permanent subscription.")
+    else:
+        message = "âŒ Your free trial has expired.\nTo continue using the bot, please use the /pay command to subscribe."
+        
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+async def trial_expiry_reminder_job(context: ContextTypes.DEFAULT_TYPE):
+    """Reminds unpaid users whose trial ends within the reminder window, in throttled batches."""
+    conn = get_db_connection()
+    payment_required = conn.execute("SELECT value FROM settings WHERE key = 'payment_required'").fetchone()
+    if not (payment_required and payment_required['value'] == '1'):
+        conn.close()
+        return
+    now = int(time.time())
+    # Range scan on idx_users_trial_expires
+    expiring = conn.execute(
+        "SELECT user_id, trial_expires_at FROM users WHERE trial_expires_at > ? AND trial_expires_at <= ? "
+        "AND has_paid = 0 AND trial_reminder_sent = 0 AND status != 'blocked' ORDER BY trial_expires_at LIMIT ?",
+        (now, now + TRIAL_REMINDER_WINDOW_HOURS * 3600, TRIAL_REMINDER_MAX_PER_RUN)
+    ).fetchall()
+
+    # Each user is marked as soon as their reminder is delivered (or can never be), so a failure part-way
+    # through leaves only the unsent users for the next run.
+    sent = 0
+    try:
+        for start in range(0, len(expiring), TRIAL_REMINDER_BATCH_SIZE):
+            batch = expiring[start:start + TRIAL_REMINDER_BATCH_SIZE]
+            for row in batch:
+                hours_left = max(1, (row['trial_expires_at'] - now) // 3600)
+                try:
+                    await context.bot.send_message(chat_id=row['user_id'], text=f"Your free trial ends in about {hours_left} hour(s).\n\nUse /pay to subscribe and keep your access.")
+                    sent += 1
+                except RetryAfter:
+                    return
+                except Forbidden:
+                    pass
+                except TelegramError as e:
+                    logger.warning(f"Could not send the trial reminder to user {row['user_id']}: {e}")
+                    continue
+                conn.execute("UPDATE users SET trial_reminder_sent = 1 WHERE user_id = ?", (row['user_id'],))
+                conn.commit()
+            if start + TRIAL_REMINDER_BATCH_SIZE < len(expiring):
+                await asyncio.sleep(TRIAL_REMINDER_BATCH_PAUSE_SECONDS)
+    finally:
+        conn.close()
+        if sent:
+            logger.info(f"Sent trial expiry reminders to {sent} user(s).")
+
+
+# --- New Feature: Hot/Cold Archival ---
+# Each entry: (live table, archive table, id column, copied columns, "finished" condition).
+# The condition takes one parameter: the SQLite datetime modifier for the retention window.
+ARCHIVE_SPECS = [
+    (
+        "tasks", "tasks_archive", "task_id",
+        "task_id, video_id, uploader_id, viewer_id, status, proof_file_id, assigned_timestamp, proof_timestamp, rejection_reason, quality_rating, proof_unique_id, proof_duration",
+        "status IN ('completed', 'failed') AND COALESCE(proof_timestamp, assigned_timestamp) < datetime('now', ?)",
+    ),
+    (
+        "reciprocal_tasks", "reciprocal_tasks_archive", "id",
+        "id, owed_by_user_id, owed_to_user_id, status, created_timestamp",
+        "status = 'completed' AND created_timestamp < datetime('now', ?)",
+    ),
+]
+
+def archive_finished_rows():
+    """Moves finished rows older than the retention window into the archive tables, in small batches."""
+    conn = get_db_connection()
+    retention_setting = conn.execute("SELECT value FROM settings WHERE key = 'archive_retention_days'").fetchone()
+    retention_days = int(retention_setting['value']) if retention_setting else 30
+    cutoff_modifier = f"-{retention_days} days"
+    moved = {}
+    for table, archive_table, id_column, columns, condition in ARCHIVE_SPECS:
+        moved[table] = 0
+        while True:
+            # Each batch is its own short write transaction so live handlers are never blocked for long
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [row[0] for row in conn.execute(f"SELECT {id_column} FROM {table} WHERE {condition} LIMIT ?", (cutoff_modifier, ARCHIVE_BATCH_SIZE)).fetchall()]
+            if not ids:
+                conn.rollback()
+                break
+            placeholders = ",".join("?" * len(ids))
+            conn.execute(f"INSERT OR IGNORE INTO {archive_table} ({columns}) SELECT {columns} FROM {table} WHERE {id_column} IN ({placeholders})", ids)
+            conn.execute(f"DELETE FROM {table} WHERE {id_column} IN ({placeholders})", ids)
+            conn.commit()
+            moved[table] += len(ids)
+            if len(ids) < ARCHIVE_BATCH_SIZE:
+                break
+            time.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+    conn.close()
+    return moved
+
+async def archive_finished_rows_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: runs the archival off the event loop."""
     try:
-        start_date = datetime.strptime(user['trial_start_date'], '%Y-%m-%d %H:%M:%S')
-        expiry_date = start_date + timedelta(days=trial_days)
-        time_left = expiry_date - datetime.now()
-
-        if time_left.total_seconds() > 0:
-            days_left = time_left.days
-            hours_left = time_left.seconds // 3600
-            message = (f"â³ You are currently on a free trial.\n"
-                       f"It will expire in approximately *{days_left} days and {hours_left} hours*.\n\n"
-                       f"You can use /pay at any time to get a permanent subscription.")
+        moved = await asyncio.to_thread(archive_finished_rows)
+    except sqlite3.Error as e:
+        logger.error(f"Archival job failed: {e}")
+        return
+    if any(moved.values()):
+        logger.info(f"Archived finished rows: {moved}")
+
+
+# --- New Feature: Streaming Data Export ---
+TASK_EXPORT_COLUMNS = "task_id, video_id, uploader_id, viewer_id, status, proof_file_id, assigned_timestamp, proof_timestamp, rejection_reason, quality_rating, proof_unique_id, proof_duration"
+EXPORT_QUERIES = {
+    'users': "SELECT * FROM users ORDER BY user_id",
+    'videos': "SELECT * FROM videos ORDER BY video_id",
+    # Live and archived tasks together, so the export covers the full history
+    'tasks': f"SELECT {TASK_EXPORT_COLUMNS} FROM tasks UNION ALL SELECT {TASK_EXPORT_COLUMNS} FROM tasks_archive",
+    'reports': "SELECT * FROM reports ORDER BY report_id",
+}
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+def export_table_to_file(table: str, export_format: str):
+    """Streams a table into a gzip-compressed temp file chunk by chunk. Returns (path, row_count)."""
+    fd, path = tempfile.mkstemp(prefix=f"export_{table}_", suffix=f".{export_format}.gz")
+    os.close(fd)
+    row_count = 0
+    conn = get_readonly_db_connection()
+    try:
+        cursor = conn.execute(EXPORT_QUERIES[table])
+        columns = [description[0] for description in cursor.description]
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as out:
+            writer = csv.writer(out) if export_format == 'csv' else None
+            if writer:
+                writer.writerow(columns)
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                if writer:
+                    writer.writerows(tuple(row) for row in rows)
+                else:
+                    out.writelines(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+                row_count += len(rows)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        conn.close()
+    return path, row_count
+
+async def admin_export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /export <users|videos|tasks|reports> [csv|jsonl]"""
+    if not is_admin(update.effective_user.id): return
+    usage = f"Usage: `/export <{'|'.join(EXPORT_QUERIES)}> [{'|'.join(EXPORT_FORMATS)}]`"
+    if not context.args or context.args[0].lower() not in EXPORT_QUERIES:
+        await update.message.reply_text(usage, parse_mode='Markdown')
+        return
+    table = context.args[0].lower()
+    export_format = context.args[1].lower() if len(context.args) > 1 else 'csv'
+    if export_format not in EXPORT_FORMATS:
+        await update.message.reply_text(usage, parse_mode='Markdown')
+        return
+
+    await update.message.reply_text(f"Exporting `{table}` as {export_format}...", parse_mode='Markdown')
+    try:
+        path, row_count = await asyncio.to_thread(export_table_to_file, table, export_format)
+    except sqlite3.Error as e:
+        logger.error(f"Export of {table} failed: {e}")
+        await update.message.reply_text(f"Export failed: {e}")
+        return
+
+    try:
+        size = os.path.getsize(path)
+        if size > EXPORT_MAX_UPLOAD_BYTES:
+            await update.message.reply_text(f"The compressed export is {size / 1024 / 1024:.1f} MB, which is over Telegram's upload limit.")
+            return
+        filename = f"{table}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}.gz"
+        with open(path, 'rb') as document:
+            await context.bot.send_document(chat_id=update.effective_chat.id, document=document, filename=filename, caption=f"{table}: {row_count} rows")
+    finally:
+        os.remove(path)
+
+
+# --- New Feature: Online Database Backups ---
+BACKUP_FILE_PREFIX = "engagement_bot_"
+
+class BackupRestartLimitReached(Exception):
+    """Raised from the backup progress callback to abandon a stepped copy that keeps starting over."""
+
+def backup_database():
+    """Takes an online snapshot with the sqlite3 backup API, verifies and compresses it, and rotates old generations.
+
+    Returns (backup_path, size_in_bytes, duration_in_seconds).
+    """
+    current = tenant()
+    started = time.monotonic()
+    os.makedirs(current.backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    snapshot_path = os.path.join(current.backup_dir, f"{BACKUP_FILE_PREFIX}{stamp}.db.tmp")
+    backup_path = os.path.join(current.backup_dir, f"{BACKUP_FILE_PREFIX}{stamp}.db.gz")
+
+    restarts, last_remaining = 0, None
+    def count_restarts(status, remaining, total):
+        # Each step copies pages, so remaining only fails to drop when the backup started over
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise BackupRestartLimitReached()
+        last_remaining = remaining
+
+    try:
+        source = sqlite3.connect(current.db_name)
+        snapshot = sqlite3.connect(snapshot_path)
+        try:
+            try:
+                # Copy a few pages at a time and sleep in between, so writers can get the lock between steps
+                source.backup(snapshot, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP_SECONDS, progress=count_restarts)
+            except BackupRestartLimitReached:
+                # Under steady writes a stepped copy may never finish; in WAL mode one step only holds a read snapshot
+                logger.warning(f"Backup restarted {restarts} times under write traffic; copying in a single step.")
+                source.backup(snapshot)
+            integrity = snapshot.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            snapshot.close()
+            source.close()
+        if integrity != 'ok':
+            raise sqlite3.DatabaseError(f"Backup integrity check failed: {integrity}")
+
+        with open(snapshot_path, 'rb') as src, gzip.open(backup_path + ".partial", 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(backup_path + ".partial", backup_path)
+    finally:
+        for leftover in (snapshot_path, backup_path + ".partial"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    generations = sorted(name for name in os.listdir(current.backup_dir) if name.startswith(BACKUP_FILE_PREFIX) and name.endswith(".db.gz"))
+    for old_backup in generations[:-BACKUP_GENERATIONS]:
+        os.remove(os.path.join(current.backup_dir, old_backup))
+
+    return backup_path, os.path.getsize(backup_path), time.monotonic() - started
+
+async def run_backup():
+    """Runs one backup on a worker thread; concurrent requests wait for the running one."""
+    async with tenant().backup_lock:
+        return await asyncio.to_thread(backup_database)
+
+async def backup_database_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback for the scheduled backup."""
+    try:
+        path, size, duration = await run_backup()
+        logger.info(f"Database backup written to {path} ({size} bytes, {duration:.1f}s)")
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Scheduled database backup failed: {e}")
+        for admin_id in tenant().admin_ids:
+            try: await context.bot.send_message(chat_id=admin_id, text=f"Scheduled database backup failed: {e}")
+            except Forbidden: pass
+
+async def admin_backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command to take a backup on demand."""
+    if not is_admin(update.effective_user.id): return
+    await update.message.reply_text("Starting database backup...")
+    try:
+        path, size, duration = await run_backup()
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"On-demand database backup failed: {e}")
+        await update.message.reply_text(f"Backup failed: {e}")
+        return
+    await update.message.reply_text(
+        f"Backup complete.\n\n"
+        f"File: `{os.path.basename(path)}`\n"
+        f"Size: {size / 1024:.1f} KB\n"
+        f"Duration: {duration:.2f}s\n"
+        f"Keeping the last {BACKUP_GENERATIONS} backups.",
+        parse_mode='Markdown'
+    )
+
+
+# --- New Feature: Rollups & Admin Analytics ---
+ROLLUP_METRICS = ['tasks_assigned', 'tasks_completed', 'tasks_rejected', 'users_registered', 'users_paid', 'trial_expiries', 'videos_flagged']
+
+def add_to_rollups(conn, hourly_counts):
+    """Adds {(hour_bucket, metric): count} into both the hourly and the daily rollup tables."""
+    daily_counts = Counter()
+    for (hour_bucket, metric), count in hourly_counts.items():
+        daily_counts[(hour_bucket[:10], metric)] += count
+    conn.executemany(
+        "INSERT INTO rollup_hourly (bucket, metric, value) VALUES (?, ?, ?) ON CONFLICT(bucket, metric) DO UPDATE SET value = value + excluded.value",
+        [(bucket, metric, count) for (bucket, metric), count in hourly_counts.items()]
+    )
+    conn.executemany(
+        "INSERT INTO rollup_daily (bucket, metric, value) VALUES (?, ?, ?) ON CONFLICT(bucket, metric) DO UPDATE SET value = value + excluded.value",
+        [(bucket, metric, count) for (bucket, metric), count in daily_counts.items()]
+    )
+
+def refresh_rollups():
+    """Folds activity events and trial expiries since the last watermarks into the rollup tables."""
+    conn = get_db_connection()
+    processed = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        watermark = int(conn.execute("SELECT value FROM settings WHERE key = 'rollup_event_watermark'").fetchone()['value'])
+        events = conn.execute("SELECT event_id, metric, event_timestamp FROM activity_events WHERE event_id > ? ORDER BY event_id LIMIT ?", (watermark, ROLLUP_BATCH_SIZE)).fetchall()
+        if not events:
+            conn.rollback()
+            break
+        hourly_counts = Counter((event['event_timestamp'][:13] + ":00:00", event['metric']) for event in events)
+        add_to_rollups(conn, hourly_counts)
+        new_watermark = events[-1]['event_id']
+        conn.execute("UPDATE settings SET value = ? WHERE key = 'rollup_event_watermark'", (str(new_watermark),))
+        conn.execute("DELETE FROM activity_events WHERE event_id <= ?", (new_watermark,))
+        conn.commit()
+        processed += len(events)
+
+    # Trial expiries are time-driven rather than row-driven: count the trials that ended
+    # between the last run and now with a range scan on the trial expiry index.
+    conn.execute("BEGIN IMMEDIATE")
+    trial_watermark = conn.execute("SELECT value FROM settings WHERE key = 'rollup_trial_watermark'").fetchone()['value']
+    now_utc = conn.execute("SELECT datetime('now')").fetchone()[0]
+    expiries = conn.execute(
+        "SELECT strftime('%Y-%m-%d %H:00:00', trial_expires_at, 'unixepoch') AS bucket, COUNT(*) AS expired FROM users "
+        "WHERE trial_expires_at >= CAST(strftime('%s', ?) AS INTEGER) AND trial_expires_at < CAST(strftime('%s', ?) AS INTEGER) AND has_paid = 0 "
+        "GROUP BY bucket",
+        (trial_watermark, now_utc)
+    ).fetchall()
+    add_to_rollups(conn, Counter({(row['bucket'], 'trial_expiries'): row['expired'] for row in expiries}))
+    conn.execute("UPDATE settings SET value = ? WHERE key = 'rollup_trial_watermark'", (now_utc,))
+    conn.commit()
+    conn.close()
+    return processed
+
+async def refresh_rollups_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: keeps the rollup tables current."""
+    try:
+        await asyncio.to_thread(refresh_rollups)
+    except sqlite3.Error as e:
+        logger.error(f"Rollup job failed: {e}")
+
+async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /adminstats [days] - aggregate activity served from the daily rollups."""
+    if not is_admin(update.effective_user.id): return
+    try:
+        days = int(context.args[0]) if context.args else 7
+    except ValueError:
+        await update.message.reply_text("Usage: `/adminstats [days]`", parse_mode='Markdown')
+        return
+    days = max(1, min(days, 90))
+
+    started = time.perf_counter()
+    conn = get_db_connection()
+    rows = conn.execute("SELECT bucket, metric, value FROM rollup_daily WHERE bucket >= date('now', ?)", (f"-{days - 1} days",)).fetchall()
+    conn.close()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    per_day = {}
+    for row in rows:
+        per_day.setdefault(row['bucket'], Counter())[row['metric']] = row['value']
+    totals = sum(per_day.values(), Counter())
+
+    def rate(part, whole): return f"{part / whole * 100:.0f}%" if whole else "-"
+
+    message = f"*Activity for the last {days} day(s)* (UTC)\n```\n"
+    message += f"{'Day':<10} {'Asgn':>5} {'Done':>5} {'Rej%':>5} {'New':>4} {'Paid':>4} {'Conv':>5} {'Trial':>5} {'Flag':>4}\n"
+    for day in sorted(per_day, reverse=True):
+        c = per_day[day]
+        message += (
+            f"{day:<10} {c['tasks_assigned']:>5} {c['tasks_completed']:>5} "
+            f"{rate(c['tasks_rejected'], c['tasks_completed'] + c['tasks_rejected']):>5} "
+            f"{c['users_registered']:>4} {c['users_paid']:>4} {rate(c['users_paid'], c['users_registered']):>5} "
+            f"{c['trial_expiries']:>5} {c['videos_flagged']:>4}\n"
+        )
+    message += "```\n"
+    message += (
+        f"*Totals:* {totals['tasks_assigned']} assigned, {totals['tasks_completed']} completed, "
+        f"rejection rate {rate(totals['tasks_rejected'], totals['tasks_completed'] + totals['tasks_rejected'])}, "
+        f"paid conversion {rate(totals['users_paid'], totals['users_registered'])}, "
+        f"{totals['trial_expiries']} trial expiries, {totals['videos_flagged']} videos flagged.\n\n"
+        f"_Served from rollups in {elapsed_ms:.1f} ms, refreshed every {ROLLUP_INTERVAL_MINUTES} min._"
+    )
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+
+# --- New Feature: Collusion-Ring Detection ---
+collusion_executor = None
+
+def record_exchange_edge(cursor, viewer_id: int, uploader_id: int):
+    """Adds one accept to the viewer -> uploader edge and marks both users for re-scoring. Runs inside the caller's transaction."""
+    cursor.execute(
+        "INSERT INTO exchange_edges (viewer_id, uploader_id, accepts, last_accept_timestamp) VALUES (?, ?, 1, CURRENT_TIMESTAMP) "
+        "ON CONFLICT(viewer_id, uploader_id) DO UPDATE SET accepts = accepts + 1, last_accept_timestamp = CURRENT_TIMESTAMP",
+        (viewer_id, uploader_id)
+    )
+    # A fresh sequence number on every mark, so a scan that read an older mark never deletes this one
+    cursor.executemany(
+        "INSERT INTO exchange_dirty_users (user_id, marked_seq) VALUES (?, (SELECT COALESCE(MAX(marked_seq), 0) + 1 FROM exchange_dirty_users)) "
+        "ON CONFLICT(user_id) DO UPDATE SET marked_seq = excluded.marked_seq",
+        [(viewer_id,), (uploader_id,)]
+    )
+
+def score_collusion_candidates(db_name: str):
+    """Scores the mutual-exchange neighbourhoods of users whose edges changed since the last scan.
+
+    Runs in a worker process. Only the changed users and their mutual partners are read, never the whole graph.
+    Returns (processed_marks, suspects): processed_marks is a list of (user_id, marked_seq) and suspects a list of
+    (members, score, internal_accepts, internal_ratio, density).
+    """
+    conn = sqlite3.connect(db_name)
+    dirty = conn.execute("SELECT user_id, marked_seq FROM exchange_dirty_users LIMIT ?", (COLLUSION_MAX_DIRTY_PER_RUN,)).fetchall()
+    out_edges, in_edges = {}, {}
+
+    def load(user_id):
+        if user_id not in out_edges:
+            out_edges[user_id] = dict(conn.execute("SELECT uploader_id, accepts FROM exchange_edges WHERE viewer_id = ?", (user_id,)).fetchall())
+            in_edges[user_id] = dict(conn.execute("SELECT viewer_id, accepts FROM exchange_edges WHERE uploader_id = ?", (user_id,)).fetchall())
+
+    def mutual_partners(user_id):
+        """Partners with at least COLLUSION_MIN_MUTUAL_ACCEPTS accepts each way, strongest exchange first."""
+        load(user_id)
+        strength = {p: min(n, in_edges[user_id].get(p, 0)) for p, n in out_edges[user_id].items()}
+        return sorted((p for p, s in strength.items() if s >= COLLUSION_MIN_MUTUAL_ACCEPTS), key=strength.get, reverse=True)
+
+    def score(members):
+        for m in members:
+            load(m)
+        given_total = sum(sum(out_edges[m].values()) for m in members)
+        internal = sum(n for m in members for p, n in out_edges[m].items() if p in members)
+        mutual_pairs = sum(1 for m in members for p in mutual_partners(m) if p in members) // 2
+        internal_ratio = internal / given_total if given_total else 0.0
+        density = mutual_pairs / (len(members) * (len(members) - 1) // 2)
+        return internal_ratio * density, internal, internal_ratio, density
+
+    # Each changed user's neighbourhood is scored on its own, bounded to COLLUSION_MAX_RING_SIZE nearest and strongest
+    # partners. A ring attached to a hub user or to another ring shows up as a dense core inside that neighbourhood,
+    # so the loosest member is peeled off until the rest passes the thresholds or fewer than two are left.
+    suspects = {}
+    for seed, _ in dirty:
+        members, frontier = {seed}, [seed]
+        while frontier and len(members) < COLLUSION_MAX_RING_SIZE:
+            for partner in mutual_partners(frontier.pop(0)):
+                if partner not in members and len(members) < COLLUSION_MAX_RING_SIZE:
+                    members.add(partner)
+                    frontier.append(partner)
+        while len(members) >= 2:
+            ring_score, internal, internal_ratio, density = score(members)
+            if internal >= COLLUSION_MIN_RING_ACCEPTS and internal_ratio >= COLLUSION_INTERNAL_RATIO_THRESHOLD and density >= COLLUSION_DENSITY_THRESHOLD:
+                suspects[frozenset(members)] = (sorted(members), ring_score, internal, internal_ratio, density)
+                break
+            members.remove(min(members, key=lambda m: (sum(1 for p in mutual_partners(m) if p in members), sum(out_edges[m].values()))))
+    conn.close()
+    return [tuple(mark) for mark in dirty], list(suspects.values())
+
+async def collusion_scan_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: scores changed neighbourhoods in a background process and flags new suspect rings to admins."""
+    global collusion_executor
+    if collusion_executor is None:
+        collusion_executor = ProcessPoolExecutor(max_workers=1)
+    try:
+        processed, suspects = await asyncio.get_running_loop().run_in_executor(collusion_executor, score_collusion_candidates, tenant().db_name)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Collusion scan failed: {e}")
+        return
+
+    conn = get_db_connection()
+    new_flags = []
+    for members, score, internal, internal_ratio, density in suspects:
+        ring_key = ",".join(str(m) for m in members)
+        inserted = conn.execute("INSERT OR IGNORE INTO collusion_flags (ring_key, members, score) VALUES (?, ?, ?)", (ring_key, ring_key, score)).rowcount
+        if inserted:
+            new_flags.append((members, internal, internal_ratio, density))
+    conn.executemany("DELETE FROM exchange_dirty_users WHERE user_id = ? AND marked_seq <= ?", processed)
+    conn.commit()
+    conn.close()
+
+    if not new_flags:
+        return
+    message = "Possible collusion rings detected\n\n"
+    for members, internal, internal_ratio, density in new_flags:
+        message += (
+            f"Users: {', '.join(str(m) for m in members)}\n"
+            f"  {internal} accepted proofs inside the group ({internal_ratio:.0%} of everything they watched), "
+            f"mutual-exchange density {density:.0%}\n\n"
+        )
+    message += "Review their recent proofs before taking action."
+    for admin_id in tenant().admin_ids:
+        try: await context.bot.send_message(chat_id=admin_id, text=message)
+        except Forbidden: pass
+
+
+# --- New Feature: Flood Control Middleware ---
+# Commands and button actions that hit the database hardest get the tightest buckets
+FLOOD_COMMAND_CLASSES = {
+    'gettask': 'task', 'get_task': 'task', 'submitproof': 'task', 'submit_task_proof': 'task', 'upload': 'task', 'start_upload': 'task',
+    'status': 'read', 'my_status': 'read', 'leaderboard': 'read', 'trialstatus': 'read', 'myreports': 'read', 'menu': 'read',
+    'reviewproofs': 'read', 'review_page': 'read', 'search': 'read', 'search_page': 'read',
+}
+
+def update_command(update: Update) -> tuple:
+    """Returns ('button', action) or ('command', name) for the update, or (None, None) for anything else."""
+    if update.callback_query and update.callback_query.data:
+        decoded = decode_callback(update.callback_query.data)
+        return ('button', decoded.action) if decoded else (None, None)
+    if update.message and update.message.text and update.message.text.startswith('/'):
+        command = update.message.text[1:].split(maxsplit=1)[0].split('@')[0].lower() if len(update.message.text) > 1 else ''
+        return 'command', command
+    return None, None
+
+def classify_update_for_flood_control(update: Update) -> str:
+    """Maps an update to its command class without touching the database."""
+    kind, name = update_command(update)
+    return FLOOD_COMMAND_CLASSES.get(name, 'default') if kind else 'default'
+
+def take_flood_token(user_id: int, command_class: str, now: float):
+    """Refills and takes one token from the user's bucket. Returns the bucket if the update is over the limit, else None."""
+    current = tenant()
+    burst, rate = FLOOD_LIMITS[command_class]
+    key = (user_id, command_class)
+    bucket = current.flood_buckets.get(key)
+    if bucket is None:
+        bucket = current.flood_buckets[key] = [float(burst), now, 0.0]
+        if len(current.flood_buckets) > FLOOD_MAX_BUCKETS:
+            current.flood_buckets.popitem(last=False)
+            current.flood_stats['evicted'] += 1
+    else:
+        current.flood_buckets.move_to_end(key)
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    if bucket[0] >= 1:
+        bucket[0] -= 1
+        return None
+    return bucket
+
+async def flood_control_middleware(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pre-handler (group -2): drops updates from users over their rate before any handler opens the database."""
+    current = tenant()
+    user = update.effective_user
+    if not user or is_admin(user.id):
+        return
+    command_class = classify_update_for_flood_control(update)
+    now = time.monotonic()
+    bucket = take_flood_token(user.id, command_class, now)
+    if bucket is None:
+        current.flood_stats['allowed'] += 1
+        return
+
+    current.flood_stats['dropped'] += 1
+    current.flood_stats[f'dropped_{command_class}'] += 1
+    # Coalesce: at most one warning per bucket per cooldown, everything else is dropped silently
+    warn = now - bucket[2] >= FLOOD_WARNING_COOLDOWN_SECONDS
+    if warn:
+        bucket[2] = now
+        current.flood_stats['warned'] += 1
+    try:
+        if update.callback_query:
+            # Answered even when silent, or the button's loading spinner hangs until Telegram times it out
+            await update.callback_query.answer("You're going too fast. Please wait a moment." if warn else None)
+        elif warn and update.message:
+            await update.message.reply_text("You're sending requests too quickly. Please wait a moment and try again.")
+    except (Forbidden, BadRequest):
+        pass
+    raise ApplicationHandlerStop
+
+async def evict_idle_flood_buckets_job(context: ContextTypes.DEFAULT_TYPE):
+    """Drops buckets idle for longer than FLOOD_BUCKET_IDLE_SECONDS (the oldest are at the front)."""
+    current = tenant()
+    cutoff = time.monotonic() - FLOOD_BUCKET_IDLE_SECONDS
+    while current.flood_buckets:
+        key, bucket = next(iter(current.flood_buckets.items()))
+        if bucket[1] > cutoff:
+            break
+        del current.flood_buckets[key]
+        current.flood_stats['evicted'] += 1
+
+async def admin_flood_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command to show the flood control counters."""
+    current = tenant()
+    if not is_admin(update.effective_user.id): return
+    message = (
+        f"*Flood Control*\n\n"
+        f"Allowed: {current.flood_stats['allowed']}\n"
+        f"Dropped: {current.flood_stats['dropped']} "
+        f"(task {current.flood_stats['dropped_task']}, read {current.flood_stats['dropped_read']}, other {current.flood_stats['dropped_default']})\n"
+        f"Warnings sent: {current.flood_stats['warned']}\n"
+        f"Active buckets: {len(current.flood_buckets)} / {FLOOD_MAX_BUCKETS}\n"
+        f"Evicted buckets: {current.flood_stats['evicted']}"
+    )
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+
+# --- New Feature: Batch Proof Review ---
+
+def render_review_page(uploader_id: int, page: int, reviewed: set, notice: str = ""):
+    """Builds the text and keyboard for one page of the uploader's pending proofs."""
+    conn = get_db_connection()
+    total = conn.execute("SELECT COUNT(*) FROM tasks WHERE uploader_id = ? AND status = 'proof_submitted'", (uploader_id,)).fetchone()[0]
+    last_page = max(0, (total - 1) // REVIEW_PAGE_SIZE)
+    page = min(max(0, page), last_page)
+    rows = conn.execute(
+        "SELECT t.task_id, t.viewer_id, t.proof_duration, v.title, v.duration FROM tasks t JOIN videos v ON t.video_id = v.video_id "
+        "WHERE t.uploader_id = ? AND t.status = 'proof_submitted' ORDER BY t.task_id LIMIT ? OFFSET ?",
+        (uploader_id, REVIEW_PAGE_SIZE, page * REVIEW_PAGE_SIZE),
+    ).fetchall()
+    conn.close()
+    header = f"{notice}\n\n" if notice else ""
+    if not rows:
+        return f"{header}You have no proofs waiting for review.", None
+
+    lines, keyboard = [], []
+    for row in rows:
+        is_reviewed = row['task_id'] in reviewed
+        proof_length = f"{row['proof_duration'] // 60}m {row['proof_duration'] % 60}s" if row['proof_duration'] is not None else "unknown length"
+        lines.append(f"{'[x]' if is_reviewed else '[ ]'} #{row['task_id']} from {row['viewer_id']}: {row['title']} ({proof_length}, {max(1, row['duration'] // 2)}m required)")
+        keyboard.append([
+            InlineKeyboardButton(f"Watch #{row['task_id']}", callback_data=encode_callback("review_watch", row['task_id'], page)),
+            InlineKeyboardButton("Unmark" if is_reviewed else "Mark reviewed", callback_data=encode_callback("review_mark", row['task_id'], page)),
+        ])
+    navigation = []
+    if page > 0: navigation.append(InlineKeyboardButton("< Prev", callback_data=encode_callback("review_page", page - 1)))
+    if page < last_page: navigation.append(InlineKeyboardButton("Next >", callback_data=encode_callback("review_page", page + 1)))
+    if navigation: keyboard.append(navigation)
+    if reviewed: keyboard.append([InlineKeyboardButton(f"Accept all reviewed ({len(reviewed)})", callback_data=encode_callback("review_accept", page))])
+    text = f"{header}Pending proofs: {total} (page {page + 1}/{last_page + 1})\nWatch a proof to mark it reviewed, then accept them together.\n\n" + "\n".join(lines)
+    return text, InlineKeyboardMarkup(keyboard)
+
+def accept_reviewed_proofs(uploader_id: int, task_ids: list):
+    """Accepts every still-pending proof in task_ids that belongs to the uploader, in one transaction.
+
+    Returns (settings, accepted task rows); the viewers' notices are queued by accept_task.
+    """
+    conn = get_db_connection()
+    settings = {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings").fetchall()}
+    conn.execute("BEGIN IMMEDIATE")
+    tasks = conn.execute(
+        f"SELECT t.*, v.duration FROM tasks t JOIN videos v ON t.video_id = v.video_id "
+        f"WHERE t.task_id IN ({','.join('?' * len(task_ids))}) AND t.uploader_id = ? AND t.status = 'proof_submitted'",
+        (*task_ids, uploader_id),
+    ).fetchall()
+    cursor = conn.cursor()
+    for task in tasks:
+        accept_task(cursor, task, settings)
+    conn.commit()
+    conn.close()
+    invalidate_user_snapshots(uploader_id, *(task['viewer_id'] for task in tasks))
+    return settings, tasks
+
+async def review_proofs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows the first page of the uploader's pending proofs."""
+    reviewed = context.user_data.setdefault('reviewed_proofs', set())
+    text, reply_markup = render_review_page(update.effective_user.id, 0, reviewed)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def review_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles paging, watching, marking and batch-accepting in the review view."""
+    query, user_id = update.callback_query, update.effective_user.id
+    callback = decode_callback(query.data)
+    reviewed = context.user_data.setdefault('reviewed_proofs', set())
+    notice = ""
+    if callback.action == 'review_page':
+        page, = callback.args
+        await query.answer()
+    elif callback.action == 'review_mark':
+        task_id, page = callback.args
+        reviewed.symmetric_difference_update({task_id})
+        await query.answer()
+    elif callback.action == 'review_watch':
+        task_id, page = callback.args
+        conn = get_db_connection()
+        task = conn.execute("SELECT viewer_id, proof_file_id FROM tasks WHERE task_id = ? AND uploader_id = ? AND status = 'proof_submitted'", (task_id, user_id)).fetchone()
+        conn.close()
+        if not task:
+            reviewed.discard(task_id)
+            await query.answer("This proof was already processed.")
         else:
-            message = "âŒ Your free trial has expired.\nTo continue using the bot, please use the /pay command to subscribe."
-            
-        await update.message.reply_text(message, parse_mode='Markdown')
+            await query.answer()
+            reviewed.add(task_id)
+            keyboard = [[InlineKeyboardButton("Accept", callback_data=encode_callback("verify_accept", task_id)), InlineKeyboardButton("Reject", callback_data=encode_callback("verify_reject", task_id))]]
+            await context.bot.send_video(chat_id=user_id, video=task['proof_file_id'], caption=f"Proof #{task_id} from user {task['viewer_id']}", reply_markup=InlineKeyboardMarkup(keyboard))
+    else:
+        page, = callback.args
+        if not reviewed:
+            await query.answer("Mark at least one proof as reviewed first.")
+            return
+        await query.answer()
+        batch = sorted(reviewed)[:REVIEW_MAX_BATCH]
+        settings, accepted = await asyncio.to_thread(accept_reviewed_proofs, user_id, batch)
+        reviewed.difference_update(batch)
+        schedule_task_prefetch(context.application, {task['viewer_id'] for task in accepted})
+        notice = f"Accepted {len(accepted)} proof(s). The viewers are being notified."
+        if settings.get('reciprocal_tasks_enabled') == '1' and accepted:
+            notice += f" {len(accepted)} reciprocal task(s) were created."
+    text, reply_markup = render_review_page(user_id, page, reviewed, notice)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except TelegramError:
+        pass  # "message is not modified" when nothing on the page changed
 
-    except (ValueError, TypeError):
-        await update.message.reply_text("Could not determine your trial status. Please contact an admin.")
 
+# --- New Feature: Notification Digests ---
 
-# --- MAIN ---
-def main():
-    # Original initialization first
+def digest_window_seconds() -> float:
+    return float(tenant().snapshots.get('settings', fetch_settings).get('digest_window_seconds') or 0)
+
+async def notify_with_digest(recipient_id: int, kind: str, item: dict, send_now, urgent: bool = False):
+    """Sends an event notification, or buffers it for the recipient's next digest.
+
+    The first event after a quiet window and every urgent event go out at once via `send_now()`
+    (a coroutine factory); anything else within the window is folded into one digest message.
+    """
+    current = tenant()
+    now = time.monotonic()
+    window = digest_window_seconds()
+    last_sent = current.digest_last_sent.get(recipient_id)
+    if urgent or window <= 0 or (recipient_id not in current.digest_buffers and (last_sent is None or now - last_sent >= window)):
+        current.digest_last_sent[recipient_id] = now
+        try: await send_now()
+        except Forbidden: pass
+        return
+    buffer = current.digest_buffers.setdefault(recipient_id, {'flush_at': (last_sent or now) + window, 'events': {}})
+    buffer['events'].setdefault(kind, []).append(item)
+
+def build_digest_message(recipient_id: int, events: dict) -> dict:
+    """Turns a recipient's buffered events into one send_message call."""
+    sections, keyboard = [], []
+    proofs = events.get('proof', [])
+    if proofs:
+        lines = [f"- #{item['task_id']} from user {item['viewer_id']}" for item in proofs[:DIGEST_MAX_LINES_PER_KIND]]
+        if len(proofs) > DIGEST_MAX_LINES_PER_KIND: lines.append(f"...and {len(proofs) - DIGEST_MAX_LINES_PER_KIND} more")
+        sections.append(f"{len(proofs)} new proof(s) waiting for your verification:\n" + "\n".join(lines))
+        keyboard.append([InlineKeyboardButton("Review proofs", callback_data=encode_callback("review_page", 0))])
+    reports = events.get('report', [])
+    if reports:
+        ids = ", ".join(f"#{item['report_id']}" for item in reports[:DIGEST_MAX_LINES_PER_KIND])
+        more = f" and {len(reports) - DIGEST_MAX_LINES_PER_KIND} more" if len(reports) > DIGEST_MAX_LINES_PER_KIND else ""
+        sections.append(f"{len(reports)} new user report(s): {ids}{more}\nUse /viewreports to see details.")
+    message = {'chat_id': recipient_id, 'text': "Summary of recent activity\n\n" + "\n\n".join(sections)}
+    if keyboard: message['reply_markup'] = InlineKeyboardMarkup(keyboard)
+    return message
+
+async def flush_notification_digests_job(context: ContextTypes.DEFAULT_TYPE):
+    """Hands every digest whose window has closed to the throttled sender, and forgets idle recipients."""
+    current = tenant()
+    now = time.monotonic()
+    for recipient_id in [r for r, buffer in current.digest_buffers.items() if buffer['flush_at'] <= now]:
+        queue_notification(build_digest_message(recipient_id, current.digest_buffers.pop(recipient_id)['events']))
+        current.digest_last_sent[recipient_id] = now
+    window = digest_window_seconds()
+    for recipient_id in [r for r, sent_at in current.digest_last_sent.items() if now - sent_at > window and r not in current.digest_buffers]:
+        del current.digest_last_sent[recipient_id]
+
+
+# --- New Feature: Unreachable Chat Registry ---
+
+def load_unreachable_chats():
+    conn = get_db_connection()
+    tenant().unreachable_chat_ids.update((row['chat_id'], row['migrated_to']) for row in conn.execute("SELECT chat_id, migrated_to FROM unreachable_chats"))
+    conn.close()
+    logger.info(f"Loaded {len(tenant().unreachable_chat_ids)} unreachable chat(s).")
+
+def mark_chat_unreachable(chat_id: int, reason: str, migrated_to: int = None):
+    tenant().unreachable_chat_ids[chat_id] = migrated_to
+    conn = get_db_connection()
+    conn.execute("INSERT OR REPLACE INTO unreachable_chats (chat_id, reason, migrated_to) VALUES (?, ?, ?)", (chat_id, reason, migrated_to))
+    conn.commit()
+    conn.close()
+
+def clear_chat_unreachable(chat_id: int):
+    tenant().unreachable_chat_ids.pop(chat_id, None)
+    conn = get_db_connection()
+    conn.execute("DELETE FROM unreachable_chats WHERE chat_id = ?", (chat_id,))
+    conn.commit()
+    conn.close()
+
+class RegistryAwareBot(ExtBot):
+    """ExtBot that checks the unreachable-chat registry before every send and records new Forbidden/ChatMigrated errors.
+
+    A send to a registered chat raises Forbidden without a round trip, so the existing
+    `except Forbidden` handling at each call site keeps working unchanged.
+    """
+
+    async def _do_post(self, endpoint, data, **kwargs):
+        chat_id = data.get('chat_id') if endpoint.startswith(('send', 'copy', 'forward')) else None
+        if not isinstance(chat_id, int):
+            return await super()._do_post(endpoint, data, **kwargs)
+        unreachable_chat_ids = tenant().unreachable_chat_ids
+        if chat_id in unreachable_chat_ids:
+            migrated_to = unreachable_chat_ids[chat_id]
+            if migrated_to is None:
+                raise Forbidden("Forbidden: chat is in the unreachable registry")
+            data = {**data, 'chat_id': migrated_to}
+        try:
+            return await super()._do_post(endpoint, data, **kwargs)
+        except Forbidden as e:
+            mark_chat_unreachable(chat_id, e.message)
+            raise
+        except ChatMigrated as e:
+            mark_chat_unreachable(chat_id, "migrated", e.new_chat_id)
+            return await super()._do_post(endpoint, {**data, 'chat_id': e.new_chat_id}, **kwargs)
+
+async def track_chat_reachability(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pre-handler (group -3): clears a chat that contacts the bot again, and follows block/unblock events."""
+    if update.my_chat_member:
+        chat_id, status = update.my_chat_member.chat.id, update.my_chat_member.new_chat_member.status
+        if status in ('kicked', 'left'):
+            mark_chat_unreachable(chat_id, f"bot {status}")
+        elif chat_id in tenant().unreachable_chat_ids:
+            clear_chat_unreachable(chat_id)
+        return
+    chat = update.effective_chat
+    if chat and chat.id in tenant().unreachable_chat_ids:
+        clear_chat_unreachable(chat.id)
+
+
+# --- New Feature: Bounded Per-User State ---
+
+async def touch_user_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pre-handler (group -4): counts the update and records when each user was last active, for idle eviction."""
+    user, current = update.effective_user, tenant()
+    current.stats['updates'] += 1
+    if user:
+        current.user_state_last_seen[user.id] = time.monotonic()
+        current.user_state_last_seen.move_to_end(user.id)
+
+async def conversation_timed_out(update: Update, context: ContextTypes.DEFAULT_TYPE, owned_keys=()):
+    """Runs when a conversation is abandoned for CONVERSATION_TIMEOUT_SECONDS: frees the user_data keys that flow owns.
+
+    Other flows' state (a batch review in progress, the last search) is left alone.
+    """
+    for key in owned_keys:
+        context.user_data.pop(key, None)
+    tenant().user_state_stats['conversation_timeouts'] += 1
+
+def conversation_timeout_handlers(*owned_keys):
+    """The TIMEOUT state for a conversation whose flow keeps owned_keys in user_data."""
+    return [TypeHandler(Update, lambda update, context: conversation_timed_out(update, context, owned_keys))]
+
+def compact_user_data(data: dict) -> bool:
+    """Removes empty containers left behind by finished flows. Returns True when nothing is left."""
+    for key in [key for key, value in data.items() if isinstance(value, (dict, set, list)) and not value]:
+        del data[key]
+    return not data
+
+async def evict_user_state_job(context: ContextTypes.DEFAULT_TYPE):
+    """Evicts user_data idle for USER_DATA_IDLE_SECONDS or beyond USER_DATA_MAX_ENTRIES, and drops empty records."""
+    current = tenant()
+    application = context.application
+    now = time.monotonic()
+    for user_id in application.user_data.keys() - current.user_state_last_seen.keys():
+        current.user_state_last_seen[user_id] = now  # created outside a tracked update; age it from here
+
+    idle_cutoff = now - USER_DATA_IDLE_SECONDS
+    # Ceiling evictions never touch a user who may still be inside a conversation
+    ceiling_cutoff = now - CONVERSATION_TIMEOUT_SECONDS
+    while current.user_state_last_seen:
+        user_id, last_seen = next(iter(current.user_state_last_seen.items()))
+        if last_seen <= idle_cutoff:
+            current.user_state_stats['evicted_idle'] += 1
+        elif len(current.user_state_last_seen) > USER_DATA_MAX_ENTRIES and last_seen <= ceiling_cutoff:
+            current.user_state_stats['evicted_ceiling'] += 1
+        else:
+            break
+        del current.user_state_last_seen[user_id]
+        application.drop_user_data(user_id)
+        application.drop_chat_data(user_id)
+    if len(current.user_state_last_seen) > USER_DATA_MAX_ENTRIES:
+        logger.warning(f"{len(current.user_state_last_seen)} users active within the conversation timeout, above the ceiling of {USER_DATA_MAX_ENTRIES}.")
+
+    compact_cutoff = now - USER_DATA_COMPACT_AFTER_SECONDS
+    for user_id, data in list(application.user_data.items()):
+        if current.user_state_last_seen.get(user_id, now) <= compact_cutoff and compact_user_data(data):
+            application.drop_user_data(user_id)
+            current.user_state_stats['dropped_empty'] += 1
+    for chat_id, data in list(application.chat_data.items()):
+        if not data:
+            application.drop_chat_data(chat_id)
+
+async def admin_mem_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command to show the size of the in-memory state and the eviction counters."""
+    current = tenant()
+    if not is_admin(update.effective_user.id): return
+    application = context.application
+    message = (
+        f"*Memory* ({current.name})\n\n"
+        f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB\n"
+        f"user\\_data: {len(application.user_data)} / {USER_DATA_MAX_ENTRIES} "
+        f"(tracked {len(current.user_state_last_seen)})\n"
+        f"chat\\_data: {len(application.chat_data)}\n"
+        f"Evicted: {current.user_state_stats['evicted_idle']} idle, {current.user_state_stats['evicted_ceiling']} over ceiling, "
+        f"{current.user_state_stats['dropped_empty']} empty\n"
+        f"Conversation timeouts: {current.user_state_stats['conversation_timeouts']}\n\n"
+        f"Read snapshots: {len(current.snapshots.entries)} "
+        f"(hits {current.snapshots.stats['hits']}, misses {current.snapshots.stats['misses']})\n"
+        f"Flood buckets: {len(current.flood_buckets)}\n"
+        f"Digest buffers: {len(current.digest_buffers)}\n"
+        f"Outbox: sent {current.outbox_stats['sent']}, retried {current.outbox_stats['retried']}, dead {current.outbox_stats['dead']}\n"
+        f"Unreachable chats: {len(current.unreachable_chat_ids)}\n"
+        f"Engagement sketches pending: {len(current.engagement['sketches'])} "
+        f"({sum(len(sketch.registers) for sketch in current.engagement['sketches'].values()) // 1024} KB)\n"
+        f"Updates handled: {current.stats['updates']}, errors: {current.stats['errors']}"
+    )
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+
+# --- New Feature: Next-Task Prefetch ---
+def prefetch_next_tasks(viewer_ids):
+    """Runs the candidate search for viewers who just finished a task and leases each one its next video.
+
+    The searches run on a pooled read connection without any lock; the write transaction only re-checks
+    each pick and inserts the leases, so accepts, uploads and ratings never wait behind the searches.
+    """
+    ready_sql = (
+        "SELECT 1 FROM users WHERE user_id = ? AND status = 'active' AND wants_next_task = 1 AND (? = 0 OR credits > 0) "
+        "AND NOT EXISTS (SELECT 1 FROM tasks WHERE viewer_id = ? AND status IN ('assigned', 'proof_submitted'))"
+    )
+    picks = []
+    with tenant().read_pool.connection() as conn:
+        settings = fetch_settings(conn)
+        credits_required = settings.get('task_credits_enabled') == '1'
+        for viewer_id in viewer_ids:
+            if conn.execute(ready_sql, (viewer_id, credits_required, viewer_id)).fetchone():
+                video, reciprocal_task_id = find_task_candidate(conn, viewer_id, settings)
+                if video:
+                    picks.append((viewer_id, video['video_id'], reciprocal_task_id))
+    if not picks:
+        return 0
+
+    now = int(time.time())
+    leased = 0
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for viewer_id, video_id, reciprocal_task_id in picks:
+            # Things may have moved since the search; leases inserted earlier in this loop count as live, so two
+            # viewers handed the same video can't both get it. A skipped viewer falls back to the full search.
+            still_free = conn.execute(
+                "SELECT 1 FROM videos WHERE video_id = ? AND status = 'active' "
+                "AND NOT EXISTS (SELECT 1 FROM task_leases WHERE video_id = ? AND viewer_id != ? AND expires_at > ?)",
+                (video_id, video_id, viewer_id, now),
+            ).fetchone()
+            if still_free and conn.execute(ready_sql, (viewer_id, credits_required, viewer_id)).fetchone():
+                conn.execute("INSERT OR REPLACE INTO task_leases (viewer_id, video_id, reciprocal_task_id, expires_at) VALUES (?, ?, ?, ?)", (viewer_id, video_id, reciprocal_task_id, now + TASK_LEASE_SECONDS))
+                leased += 1
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return leased
+
+def schedule_task_prefetch(application, viewer_ids):
+    """Prefetches in a worker thread without holding up the handler that accepted the proofs."""
+    if viewer_ids:
+        application.create_task(asyncio.to_thread(prefetch_next_tasks, list(viewer_ids)), name="prefetch_next_tasks")
+
+def claim_task_lease(conn, user_id: int, credits_required: bool):
+    """Takes the viewer's prefetched lease if it is still valid. Returns (video row, reciprocal task id) or (None, None).
+
+    With task credits enabled the uploader must still be able to pay for the view.
+    """
+    lease = conn.execute("SELECT video_id, reciprocal_task_id, expires_at FROM task_leases WHERE viewer_id = ?", (user_id,)).fetchone()
+    if not lease:
+        return None, None
+    conn.execute("DELETE FROM task_leases WHERE viewer_id = ?", (user_id,))
+    if lease['expires_at'] <= time.time():
+        return None, None
+    video = conn.execute(
+        "SELECT v.*, u.tier FROM videos v JOIN users u ON v.user_id = u.user_id "
+        "WHERE v.video_id = ? AND v.status = 'active' AND NOT EXISTS (SELECT 1 FROM watched_videos WHERE user_id = ? AND video_id = v.video_id) "
+        "AND (? = 0 OR u.credits >= v.duration)",
+        (lease['video_id'], user_id, credits_required),
+    ).fetchone()
+    if not video:
+        return None, None
+    reciprocal_task_id = lease['reciprocal_task_id']
+    if reciprocal_task_id and not conn.execute("SELECT 1 FROM reciprocal_tasks WHERE id = ? AND status = 'pending'", (reciprocal_task_id,)).fetchone():
+        return None, None
+    return video, reciprocal_task_id
+
+async def expire_task_leases_job(context: ContextTypes.DEFAULT_TYPE):
+    """Deletes expired leases; their videos are already back in every viewer's candidate search."""
+    conn = get_db_connection()
+    conn.execute("DELETE FROM task_leases WHERE expires_at <= ?", (int(time.time()),))
+    conn.commit()
+    conn.close()
+
+
+# --- New Feature: Instrumented HTTP Client ---
+@lru_cache(maxsize=None)
+def bot_api_ssl_context():
+    """Loading the CA bundle dominates client construction (~25 ms each), so every client shares one context."""
+    return httpx.create_ssl_context()
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest with keep-alive tuning and per-endpoint call, error and latency counters."""
+
+    def __init__(self, pool_name: str, keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY_SECONDS, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_name = pool_name
+        limits = self._client_kwargs['limits']
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._client = self._build_client()
+        self.endpoint_stats = defaultdict(Counter)  # endpoint -> calls, errors, total_ms, max_ms
+
+    def _build_client(self) -> httpx.AsyncClient:
+        self._client_kwargs.setdefault('verify', bot_api_ssl_context())
+        return super()._build_client()
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        stats = self.endpoint_stats[url.rsplit('/', 1)[-1]]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **timeouts)
+        except Exception:
+            stats['errors'] += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats['calls'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        if code >= 400:
+            stats['errors'] += 1
+        return code, payload
+
+def build_api_request(pool_size: int = HTTP_POOL_SIZE, request_class=InstrumentedHTTPXRequest) -> HTTPXRequest:
+    """The request object for every Bot API call except getUpdates, sized for concurrent sends."""
+    return request_class(
+        "api", connection_pool_size=pool_size, http_version=HTTP_VERSION,
+        connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT, write_timeout=HTTP_WRITE_TIMEOUT,
+        media_write_timeout=HTTP_MEDIA_WRITE_TIMEOUT, pool_timeout=HTTP_POOL_TIMEOUT,
+    )
+
+def build_get_updates_request() -> HTTPXRequest:
+    """Long polling holds its connection for the whole poll, so it gets its own one-connection pool."""
+    return InstrumentedHTTPXRequest(
+        "updates", connection_pool_size=1,
+        connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT, pool_timeout=HTTP_POOL_TIMEOUT,
+    )
+
+async def admin_http_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command to show Bot API calls, errors and latency per endpoint."""
+    if not is_admin(update.effective_user.id): return
+    lines = ["*Bot API client*"]
+    for request in tenant().http_requests:
+        endpoints = sorted(request.endpoint_stats.items(), key=lambda item: item[1]['calls'], reverse=True)
+        lines.append(f"\n*{request.pool_name}* (HTTP/{request.http_version}, {len(endpoints)} endpoints)")
+        for endpoint, stats in endpoints[:HTTP_STATS_MAX_ENDPOINTS]:
+            lines.append(
+                f"{endpoint}: {stats['calls']} calls, {stats['errors']} errors, "
+                f"avg {stats['total_ms'] / max(stats['calls'], 1):.0f} ms, max {stats['max_ms']:.0f} ms"
+            )
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+
+
+# --- New Feature: Credit Ledger ---
+# users.credits stays the fast-path balance; every change to it also appends a credit_ledger row in the
+# same transaction. A balance is rebuilt from the user's latest snapshot plus the entries after it.
+LEDGER_BALANCE_SQL = (
+    "SELECT COALESCE(s.balance, 0) + COALESCE((SELECT SUM(l.delta) FROM credit_ledger l "
+    "WHERE l.user_id = u.user_id AND l.entry_id > COALESCE(s.entry_id, 0) AND l.entry_id <= ?), 0) "
+    "FROM (SELECT ? AS user_id) u LEFT JOIN credit_snapshots s ON s.user_id = u.user_id "
+    "AND s.entry_id = (SELECT MAX(entry_id) FROM credit_snapshots WHERE user_id = u.user_id AND entry_id <= ?)"
+)
+
+class InsufficientCredits(Exception):
+    """Raised by apply_credit_change when a debit would take a user's credits below zero."""
+
+def apply_credit_change(cursor, user_id: int, delta: int, reason: str, task_id: int = None) -> int:
+    """Changes a user's credits and appends the ledger entry. Runs inside the caller's transaction; returns the new balance.
+
+    A debit the balance cannot cover changes nothing and raises InsufficientCredits, so the ledger never records a
+    negative balance_after.
+    """
+    cursor.execute("UPDATE users SET credits = credits + ? WHERE user_id = ? AND (? >= 0 OR credits + ? >= 0)", (delta, user_id, delta, delta))
+    if cursor.rowcount == 0:
+        raise InsufficientCredits(f"User {user_id} cannot cover {reason} {delta:+d}")
+    balance = cursor.execute("SELECT credits FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+    cursor.execute(
+        "INSERT INTO credit_ledger (user_id, delta, balance_after, reason, task_id) VALUES (?, ?, ?, ?, ?)",
+        (user_id, delta, balance, reason, task_id),
+    )
+    return balance
+
+def ledger_balance(conn, user_id: int, up_to_entry_id: int = None) -> int:
+    """The user's balance as of an entry (default: now), from the nearest earlier snapshot and the entries since."""
+    up_to = up_to_entry_id if up_to_entry_id is not None else 2 ** 62
+    return conn.execute(LEDGER_BALANCE_SQL, (up_to, user_id, up_to)).fetchone()[0]
+
+def snapshot_credit_balances() -> int:
+    """Checkpoints every user with at least CREDIT_SNAPSHOT_MIN_ENTRIES entries since their last snapshot.
+
+    Only users with entries past the global watermark (credit_snapshot_watermark) are candidates, and each one's
+    entries are summed from its own last snapshot on the (user_id, entry_id) index, so a run reads the entries
+    since the last run rather than the whole ledger.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT value FROM settings WHERE key = 'credit_snapshot_watermark'").fetchone()
+        watermark = int(row['value']) if row else 0
+        high = conn.execute("SELECT COALESCE(MAX(entry_id), 0) FROM credit_ledger").fetchone()[0]
+        if high <= watermark:
+            conn.rollback()
+            return 0
+        since_snapshot = "FROM credit_ledger l WHERE l.user_id = c.user_id AND l.entry_id > COALESCE(s.entry_id, 0) AND l.entry_id <= c.last_entry_id"
+        created = conn.execute(
+            "INSERT INTO credit_snapshots (user_id, entry_id, balance) "
+            f"SELECT c.user_id, c.last_entry_id, COALESCE(s.balance, 0) + (SELECT SUM(l.delta) {since_snapshot}) "
+            "FROM (SELECT user_id, MAX(entry_id) AS last_entry_id FROM credit_ledger WHERE entry_id > ? AND entry_id <= ? GROUP BY user_id) c "
+            "LEFT JOIN credit_snapshots s ON s.user_id = c.user_id "
+            "AND s.entry_id = (SELECT MAX(entry_id) FROM credit_snapshots WHERE user_id = c.user_id) "
+            f"WHERE (SELECT COUNT(*) {since_snapshot}) >= ?",
+            (watermark, high, CREDIT_SNAPSHOT_MIN_ENTRIES),
+        ).rowcount
+        conn.execute(
+            "INSERT INTO settings (key, value) VALUES ('credit_snapshot_watermark', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (str(high),),
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return created
+
+def reconcile_credit_batch(after_user_id: int):
+    """Compares users.credits with the ledger for the next CREDIT_RECONCILE_BATCH users.
+
+    Returns (last user_id checked or 0 at the end of the table, {user_id: (credits, ledger_balance)} for mismatches).
+    """
+    conn = get_readonly_db_connection()
+    rows = conn.execute(
+        "SELECT u.user_id, u.credits, COALESCE(s.balance, 0) + COALESCE((SELECT SUM(l.delta) FROM credit_ledger l "
+        "WHERE l.user_id = u.user_id AND l.entry_id > COALESCE(s.entry_id, 0)), 0) AS ledger_balance "
+        "FROM users u LEFT JOIN credit_snapshots s ON s.user_id = u.user_id "
+        "AND s.entry_id = (SELECT MAX(entry_id) FROM credit_snapshots WHERE user_id = u.user_id) "
+        "WHERE u.user_id > ? ORDER BY u.user_id LIMIT ?",
+        (after_user_id, CREDIT_RECONCILE_BATCH),
+    ).fetchall()
+    conn.close()
+    mismatches = {row['user_id']: (row['credits'], row['ledger_balance']) for row in rows if row['credits'] != row['ledger_balance']}
+    last_user_id = rows[-1]['user_id'] if len(rows) == CREDIT_RECONCILE_BATCH else 0
+    return last_user_id, mismatches
+
+async def snapshot_credit_balances_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        created = await asyncio.to_thread(snapshot_credit_balances)
+    except sqlite3.Error as e:
+        logger.error(f"Credit snapshot failed: {e}")
+        return
+    if created:
+        logger.info(f"Credit snapshots: checkpointed {created} balance(s)")
+
+async def reconcile_credit_ledger_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: checks one batch of users per run and reports new mismatches to admins."""
+    current = tenant()
+    state = current.credit_reconcile
+    try:
+        next_after, mismatches = await asyncio.to_thread(reconcile_credit_batch, state['after_user_id'])
+    except sqlite3.Error as e:
+        logger.error(f"Credit reconciliation failed: {e}")
+        return
+    checked_range = (state['after_user_id'], next_after or float('inf'))
+    stale = [user_id for user_id in state['mismatches'] if checked_range[0] < user_id <= checked_range[1] and user_id not in mismatches]
+    for user_id in stale:
+        del state['mismatches'][user_id]
+    new = {user_id: values for user_id, values in mismatches.items() if state['mismatches'].get(user_id) != values}
+    state['mismatches'].update(mismatches)
+    state['after_user_id'] = next_after
+    if not next_after:
+        state['passes'] += 1
+    if not new:
+        return
+    message = "Credit ledger mismatches\n\n" + "\n".join(
+        f"User {user_id}: credits {credits}, ledger {balance}" for user_id, (credits, balance) in sorted(new.items())[:LEDGER_MAX_ENTRIES_SHOWN]
+    )
+    logger.warning(message.replace("\n", " "))
+    for admin_id in current.admin_ids:
+        try:
+            await context.bot.send_message(chat_id=admin_id, text=message)
+        except Forbidden:
+            pass
+
+async def ledger_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /ledger shows reconciliation status, /ledger <user_id> a user's balance and recent entries."""
+    if not is_admin(update.effective_user.id): return
+    state = tenant().credit_reconcile
+    if not context.args:
+        lines = [f"Credit ledger: {state['passes']} full reconciliation pass(es), {len(state['mismatches'])} open mismatch(es)"]
+        for user_id, (credits, balance) in sorted(state['mismatches'].items())[:LEDGER_MAX_ENTRIES_SHOWN]:
+            lines.append(f"User {user_id}: credits {credits}, ledger {balance}")
+        await update.message.reply_text("\n".join(lines))
+        return
+    try:
+        user_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("Usage: /ledger [user_id]")
+        return
+    with tenant().read_pool.connection() as conn:
+        user = conn.execute("SELECT credits FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        entries = conn.execute(
+            "SELECT entry_id, delta, balance_after, reason, task_id, created_timestamp FROM credit_ledger "
+            "WHERE user_id = ? ORDER BY entry_id DESC LIMIT ?", (user_id, LEDGER_MAX_ENTRIES_SHOWN),
+        ).fetchall()
+        balance = ledger_balance(conn, user_id)
+    if not user:
+        await update.message.reply_text("User not found.")
+        return
+    lines = [f"User {user_id}: credits {user['credits']}, ledger balance {balance}", ""]
+    for entry in entries:
+        task_info = f" (task {entry['task_id']})" if entry['task_id'] else ""
+        lines.append(f"#{entry['entry_id']} {entry['created_timestamp']} {entry['delta']:+d} -> {entry['balance_after']} {entry['reason']}{task_info}")
+    if not entries:
+        lines.append("No ledger entries.")
+    await update.message.reply_text("\n".join(lines))
+
+
+# --- New Feature: Full-Text Search ---
+# (FTS table, source table, id column, indexed text columns)
+SEARCH_INDEXES = [
+    ("reports_fts", "reports", "report_id", ("reason", "appeal_reason")),
+    ("videos_fts", "videos", "video_id", ("title",)),
+]
+
+def build_match_query(text: str) -> str:
+    """Turns free text into an FTS5 query: every word must match, as a prefix. Operators in the input are ignored."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+def search_index(conn, text: str, page: int):
+    """Returns (results, has_next_page) for one page of reports and videos matching the text, best match first."""
+    match, top = build_match_query(text), (page + 1) * SEARCH_PAGE_SIZE + 1
+    # Each index returns its own top matches through FTS5's rank ordering; only those are merged
+    rows = conn.execute(
+        "SELECT * FROM (SELECT 'report' AS kind, rowid AS ref_id, rank, snippet(reports_fts, -1, '[', ']', '...', ?) AS excerpt "
+        "FROM reports_fts WHERE reports_fts MATCH ? ORDER BY rank LIMIT ?) "
+        "UNION ALL SELECT * FROM (SELECT 'video', rowid, rank, snippet(videos_fts, 0, '[', ']', '...', ?) "
+        "FROM videos_fts WHERE videos_fts MATCH ? ORDER BY rank LIMIT ?) "
+        "ORDER BY rank LIMIT ? OFFSET ?",
+        (SEARCH_SNIPPET_TOKENS, match, top, SEARCH_SNIPPET_TOKENS, match, top, SEARCH_PAGE_SIZE + 1, page * SEARCH_PAGE_SIZE),
+    ).fetchall()
+    has_next = len(rows) > SEARCH_PAGE_SIZE
+    rows = rows[:SEARCH_PAGE_SIZE]
+    report_ids = [row['ref_id'] for row in rows if row['kind'] == 'report']
+    video_ids = [row['ref_id'] for row in rows if row['kind'] == 'video']
+    reports = {row['report_id']: row for row in conn.execute(
+        f"SELECT report_id, reporter_id, reported_user_id, status FROM reports WHERE report_id IN ({','.join('?' * len(report_ids))})", report_ids,
+    ).fetchall()} if report_ids else {}
+    videos = {row['video_id']: row for row in conn.execute(
+        f"SELECT video_id, user_id, status FROM videos WHERE video_id IN ({','.join('?' * len(video_ids))})", video_ids,
+    ).fetchall()} if video_ids else {}
+    results = []
+    for row in rows:
+        if row['kind'] == 'report' and row['ref_id'] in reports:
+            report = reports[row['ref_id']]
+            results.append(f"Report #{report['report_id']} ({report['status']}), {report['reporter_id']} against {report['reported_user_id']}:\n  {row['excerpt']}")
+        elif row['kind'] == 'video' and row['ref_id'] in videos:
+            video = videos[row['ref_id']]
+            results.append(f"Video #{video['video_id']} ({video['status']}) by {video['user_id']}:\n  {row['excerpt']}")
+    return results, has_next
+
+def render_search_page(text: str, page: int):
+    """Builds the text and keyboard for one page of search results."""
+    started = time.perf_counter()
+    with tenant().read_pool.connection() as conn:
+        results, has_next = search_index(conn, text, page)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if not results:
+        return f"No reports, appeals or videos match \"{text}\".", None
+    first = page * SEARCH_PAGE_SIZE + 1
+    message = f"Results {first}-{first + len(results) - 1} for \"{text}\" ({elapsed_ms:.0f} ms)\n\n" + "\n\n".join(results)
+    navigation = []
+    if page > 0: navigation.append(InlineKeyboardButton("< Prev", callback_data=encode_callback("search_page", page - 1)))
+    if has_next: navigation.append(InlineKeyboardButton("Next >", callback_data=encode_callback("search_page", page + 1)))
+    return message, InlineKeyboardMarkup([navigation]) if navigation else None
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /search <words> finds reports, appeals and video titles."""
+    if not is_admin(update.effective_user.id): return
+    text = " ".join(context.args)
+    if not build_match_query(text):
+        await update.message.reply_text("Usage: /search <words>")
+        return
+    # The query is kept in user_data; callback data only has room for the page number
+    context.user_data['search_query'] = text
+    message, reply_markup = render_search_page(text, 0)
+    await update.message.reply_text(message, reply_markup=reply_markup)
+
+async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not is_admin(update.effective_user.id): return
+    text = context.user_data.get('search_query')
+    if not text:
+        await query.answer("This search has expired. Run /search again.")
+        return
+    await query.answer()
+    page, = decode_callback(query.data).args
+    message, reply_markup = render_search_page(text, page)
+    await query.message.edit_text(message, reply_markup=reply_markup)
+
+
+# --- New Feature: Duplicate Video Detection ---
+YOUTUBE_ID_PATTERN = re.compile(r"(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:[^#]*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})")
+
+def video_dedupe_key(link: str, title: str, thumbnail_unique_id: str) -> str:
+    """Normalized identity of a video: the YouTube video id when the link has one, else its title plus thumbnail."""
+    match = YOUTUBE_ID_PATTERN.search(link or "")
+    if match:
+        return f"yt:{match.group(1)}"
+    normalized_title = " ".join(re.findall(r"\w+", title.casefold()))
+    return "tt:" + hashlib.sha1(f"{normalized_title}|{thumbnail_unique_id}".encode()).hexdigest()[:20]
+
+def find_duplicate_video(conn, dedupe_key: str):
+    return conn.execute("SELECT video_id, user_id FROM videos WHERE dedupe_key = ? AND status != 'duplicate' LIMIT 1", (dedupe_key,)).fetchone()
+
+def mark_duplicate_videos():
+    """Retires every later copy of a video, whatever its status (active, flagged, ...); the earliest upload of each key survives.
+
+    Copies that are being watched are left until their task ends. Returns (retired, still_waiting).
+    Once nothing is waiting, a unique index takes over from the upload-time check.
+    """
+    later_copy = "video_id > (SELECT MIN(video_id) FROM videos v2 WHERE v2.dedupe_key = videos.dedupe_key AND v2.status != 'duplicate')"
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        retired = conn.execute(f"UPDATE videos SET status = 'duplicate' WHERE status NOT IN ('duplicate', 'being_watched') AND dedupe_key IS NOT NULL AND {later_copy}").rowcount
+        waiting = conn.execute(f"SELECT COUNT(*) FROM videos WHERE status = 'being_watched' AND dedupe_key IS NOT NULL AND {later_copy}").fetchone()[0]
+        if not waiting:
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_videos_dedupe_key_unique ON videos (dedupe_key) WHERE status != 'duplicate'")
+            conn.execute("UPDATE settings SET value = '1' WHERE key = 'video_dedupe_completed'")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return retired, waiting
+
+async def dedupe_videos_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: one-time cleanup. Backfills dedupe keys for existing videos a batch at a time, then retires duplicates."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT video_id, title, link, thumbnail_file_id FROM videos WHERE dedupe_key IS NULL LIMIT ?", (DEDUPE_BACKFILL_BATCH,)).fetchall()
+    conn.close()
+    updates = []
+    for row in rows:
+        thumbnail_unique_id = None
+        if not YOUTUBE_ID_PATTERN.search(row['link'] or ""):
+            # Rows stored before this feature only have the thumbnail's file_id; its unique id comes from getFile
+            try:
+                thumbnail_unique_id = (await context.bot.get_file(row['thumbnail_file_id'])).file_unique_id
+            except RetryAfter:
+                break
+            except TelegramError as e:
+                logger.warning(f"Could not resolve the thumbnail of video {row['video_id']}: {e}")
+                thumbnail_unique_id = row['thumbnail_file_id']
+        updates.append((video_dedupe_key(row['link'], row['title'], thumbnail_unique_id), thumbnail_unique_id, row['video_id']))
+    if updates:
+        conn = get_db_connection()
+        conn.executemany("UPDATE videos SET dedupe_key = ?, thumbnail_unique_id = ? WHERE video_id = ?", updates)
+        conn.commit()
+        conn.close()
+    if len(updates) < len(rows) or len(rows) == DEDUPE_BACKFILL_BATCH:
+        return
+    try:
+        retired, waiting = await asyncio.to_thread(mark_duplicate_videos)
+    except sqlite3.Error as e:
+        logger.error(f"Duplicate video cleanup failed: {e}")
+        return
+    logger.info(f"Duplicate video cleanup: retired {retired} copies, {waiting} waiting for their task to end")
+    if waiting:
+        return
+    context.job.schedule_removal()
+    tenant().snapshots.invalidate('settings')
+
+
+# --- New Feature: Tier Engine ---
+# A user's tier is the highest one whose thresholds they meet. Quality is the rating-weighted average
+# quality score of their videos (100 while unrated). The same query serves the per-event update and
+# the periodic batch, so the two can never disagree.
+TIERS = ('Bronze', 'Silver', 'Gold')
+TIER_SQL = (
+    "SELECT u.user_id, u.tier, CASE "
+    "WHEN u.completed_tasks >= :gold_min_completed AND COALESCE(q.quality, 100) >= :gold_min_quality AND u.strikes <= :gold_max_strikes THEN 'Gold' "
+    "WHEN u.completed_tasks >= :silver_min_completed AND COALESCE(q.quality, 100) >= :silver_min_quality AND u.strikes <= :silver_max_strikes THEN 'Silver' "
+    "ELSE 'Bronze' END AS computed_tier "
+    "FROM users u LEFT JOIN (SELECT user_id, 100.0 * SUM(good_ratings) / NULLIF(SUM(total_ratings), 0) AS quality "
+    "FROM videos WHERE {video_filter} GROUP BY user_id) q ON q.user_id = u.user_id WHERE {user_filter}"
+)
+
+def tier_thresholds(cursor) -> dict:
+    """The tier_* settings as TIER_SQL parameters, e.g. {'gold_min_completed': 100.0, ...}."""
+    rows = cursor.execute("SELECT key, value FROM settings WHERE key LIKE 'tier\\_%' ESCAPE '\\'").fetchall()
+    return {row[0][len('tier_'):]: float(row[1]) for row in rows}
+
+def apply_tier_changes(cursor, changes) -> None:
+    """Writes (user_id, old_tier, new_tier) changes and congratulates promoted users, once per user and tier."""
+    cursor.executemany("UPDATE users SET tier = ? WHERE user_id = ?", [(new, user_id) for user_id, old, new in changes])
+    for user_id, old, new in changes:
+        if TIERS.index(new) > TIERS.index(old if old in TIERS else 'Bronze'):
+            queue_notification(dict(chat_id=user_id, text=f"You have been promoted to the {new} tier. Your videos now get higher priority in the task queue."), cursor, f"tier_promoted:{user_id}:{new}")
+
+def evaluate_user_tier(cursor, user_id: int) -> str:
+    """Re-evaluates one user's tier after their counters changed. Runs inside the caller's transaction; returns the tier."""
+    row = cursor.execute(TIER_SQL.format(video_filter="user_id = :user_id", user_filter="u.user_id = :user_id"), {**tier_thresholds(cursor), 'user_id': user_id}).fetchone()
+    if row is None:
+        return None
+    if row[1] != row[2]:
+        apply_tier_changes(cursor, [(user_id, row[1], row[2])])
+    return row[2]
+
+def recompute_all_tiers() -> int:
+    """Batch pass over every user; corrects any drift from missed events or changed thresholds. Returns the number changed."""
+    conn = get_db_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    cursor = conn.cursor()
+    changes = [tuple(row) for row in cursor.execute(
+        f"SELECT user_id, tier, computed_tier FROM ({TIER_SQL.format(video_filter='1', user_filter='1')}) WHERE tier != computed_tier",
+        tier_thresholds(cursor),
+    ).fetchall()]
+    apply_tier_changes(cursor, changes)
+    conn.commit()
+    conn.close()
+    return len(changes)
+
+async def recompute_tiers_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        changed = await asyncio.to_thread(recompute_all_tiers)
+    except sqlite3.Error as e:
+        logger.error(f"Tier recompute failed: {e}")
+        return
+    if changed:
+        logger.info(f"Tier recompute: {changed} user(s) changed tier")
+
+async def admin_tiers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /tiers shows thresholds and tier sizes; /tiers <silver|gold> <min_completed> <min_quality> <max_strikes> changes them."""
+    if not is_admin(update.effective_user.id): return
+    if context.args:
+        try:
+            tier, min_completed, min_quality, max_strikes = context.args[0].lower(), int(context.args[1]), float(context.args[2]), int(context.args[3])
+            if tier not in ('silver', 'gold'):
+                raise ValueError
+        except (IndexError, ValueError):
+            await update.message.reply_text("Usage: /tiers <silver|gold> <min_completed> <min_quality> <max_strikes>")
+            return
+        conn = get_db_connection()
+        conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", [
+            (f"tier_{tier}_min_completed", str(min_completed)), (f"tier_{tier}_min_quality", str(min_quality)), (f"tier_{tier}_max_strikes", str(max_strikes)),
+        ])
+        conn.commit()
+        conn.close()
+        tenant().snapshots.invalidate('settings')
+        context.job_queue.run_once(recompute_tiers_job, when=0, name="recompute_tiers_now")
+    with tenant().read_pool.connection() as conn:
+        thresholds = tier_thresholds(conn)
+        counts = dict(conn.execute("SELECT tier, COUNT(*) FROM users GROUP BY tier").fetchall())
+    lines = ["Tiers (completed tasks / video quality / strikes)"]
+    for tier in reversed(TIERS):
+        key = tier.lower()
+        rule = "default" if tier == 'Bronze' else f">= {thresholds[f'{key}_min_completed']:.0f} / >= {thresholds[f'{key}_min_quality']:.0f}% / <= {thresholds[f'{key}_max_strikes']:.0f}"
+        lines.append(f"{tier}: {counts.get(tier, 0)} user(s), {rule}")
+    await update.message.reply_text("\n".join(lines))
+
+
+# --- New Feature: Quality Flagging ---
+def flag_low_quality_videos():
+    """Pauses every rated-since-last-scan video whose Wilson upper bound is below the flag threshold.
+
+    Using the upper bound flags a video only once even an optimistic reading of its ratings is poor,
+    so a few early bad ratings no longer pause it. Returns the flagged rows.
+    """
+    conn = get_db_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    flagged = conn.execute(
+        "SELECT video_id, user_id, title, good_ratings, total_ratings FROM videos WHERE rating_dirty = 1 AND status = 'active' "
+        "AND total_ratings >= ? AND wilson_upper_bound(good_ratings, total_ratings) < ? ORDER BY video_id",
+        (MIN_RATINGS_FOR_FLAG, QUALITY_SCORE_FLAG_THRESHOLD / 100),
+    ).fetchall()
+    conn.executemany("UPDATE videos SET status = 'flagged' WHERE video_id = ?", [(row['video_id'],) for row in flagged])
+    # A video mid-task is looked at again on the next scan, once accept/reject has set it back to active
+    conn.execute("UPDATE videos SET rating_dirty = 0 WHERE rating_dirty = 1 AND status != 'being_watched'")
+    conn.commit()
+    conn.close()
+    return flagged
+
+async def flag_low_quality_videos_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: runs the flag scan and sends admins one digest of the newly paused videos."""
+    try:
+        flagged = await asyncio.to_thread(flag_low_quality_videos)
+    except sqlite3.Error as e:
+        logger.error(f"Quality flag scan failed: {e}")
+        return
+    if not flagged:
+        return
+    lines = [
+        f"- {row['title']} (ID: {row['video_id']}, user {row['user_id']}): {row['good_ratings']}/{row['total_ratings']} good"
+        for row in flagged[:DIGEST_MAX_LINES_PER_KIND]
+    ]
+    if len(flagged) > DIGEST_MAX_LINES_PER_KIND: lines.append(f"...and {len(flagged) - DIGEST_MAX_LINES_PER_KIND} more")
+    message = f"{len(flagged)} video(s) automatically flagged for low quality and paused:\n" + "\n".join(lines)
+    for admin_id in tenant().admin_ids:
+        queue_notification(dict(chat_id=admin_id, text=message))
+
+
+# --- New Feature: Durable Outbox ---
+def queue_notification(message: dict, cursor=None, idempotency_key: str = None):
+    """Queues one bot.send_message call in the outbox for drain_outbox_job.
+
+    With a cursor, the message commits or rolls back with the caller's transaction. A message with
+    an idempotency_key is queued at most once, however often the code that queues it runs.
+    """
+    payload = dict(message)
+    if payload.get('reply_markup') is not None:
+        payload['reply_markup'] = payload['reply_markup'].to_dict()
+    row = (idempotency_key, message['chat_id'], json.dumps(payload))
+    if cursor is not None:
+        cursor.execute("INSERT OR IGNORE INTO outbox (idempotency_key, chat_id, payload) VALUES (?, ?, ?)", row)
+        return
+    conn = get_db_connection()
+    conn.execute("INSERT OR IGNORE INTO outbox (idempotency_key, chat_id, payload) VALUES (?, ?, ?)", row)
+    conn.commit()
+    conn.close()
+
+def load_due_outbox(limit: int):
+    conn = get_db_connection()
+    rows = conn.execute(
+        "SELECT outbox_id, payload, attempts FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY outbox_id LIMIT ?",
+        (int(time.time()), limit),
+    ).fetchall()
+    conn.close()
+    return rows
+
+def record_outbox_results(sent_ids, failures):
+    """Marks sent rows and stores (status, attempts, next_attempt_at, error, outbox_id) for failed ones."""
+    conn = get_db_connection()
+    conn.executemany("UPDATE outbox SET status = 'sent', sent_timestamp = CURRENT_TIMESTAMP WHERE outbox_id = ?", [(outbox_id,) for outbox_id in sent_ids])
+    conn.executemany("UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE outbox_id = ?", failures)
+    conn.commit()
+    conn.close()
+
+async def drain_outbox_job(context: ContextTypes.DEFAULT_TYPE):
+    """Sends up to NOTIFICATION_SENDS_PER_TICK due outbox messages in order, retrying failures with backoff.
+
+    Delivery is at-least-once: if the process dies between a send and its bookkeeping, that one
+    message is sent again after the restart.
+    """
+    current = tenant()
+    if time.monotonic() < current.notification_state['resume_at']:
+        return
+    rows = load_due_outbox(NOTIFICATION_SENDS_PER_TICK)
+    sent, failures, now = [], [], int(time.time())
+    for row in rows:
+        payload = json.loads(row['payload'])
+        if payload.get('reply_markup'):
+            payload['reply_markup'] = InlineKeyboardMarkup.de_json(payload['reply_markup'], context.bot)
+        attempts = row['attempts'] + 1
+        try:
+            await context.bot.send_message(**payload)
+            sent.append(row['outbox_id'])
+        except RetryAfter as e:
+            current.notification_state['resume_at'] = time.monotonic() + float(e.retry_after)
+            logger.warning(f"Outbox throttled by Telegram for {e.retry_after}s.")
+            break
+        except (Forbidden, BadRequest) as e:
+            # Retrying can't help: the chat blocked the bot or the message itself is invalid
+            failures.append(('dead', attempts, now, str(e), row['outbox_id']))
+        except TelegramError as e:
+            status = 'dead' if attempts >= OUTBOX_MAX_ATTEMPTS else 'pending'
+            delay = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+            failures.append((status, attempts, now + delay, str(e), row['outbox_id']))
+    if not sent and not failures:
+        return
+    record_outbox_results(sent, failures)
+    current.outbox_stats['sent'] += len(sent)
+    for status, attempts, _, error, outbox_id in failures:
+        current.outbox_stats['dead' if status == 'dead' else 'retried'] += 1
+        if status == 'dead':
+            logger.error(f"Outbox message {outbox_id} gave up after {attempts} attempt(s): {error}")
+
+async def prune_outbox_job(context: ContextTypes.DEFAULT_TYPE):
+    conn = get_db_connection()
+    pruned = conn.execute("DELETE FROM outbox WHERE status = 'sent' AND sent_timestamp < datetime('now', ?)", (f"-{OUTBOX_RETENTION_HOURS} hours",)).rowcount
+    conn.commit()
+    conn.close()
+    if pruned:
+        logger.info(f"Outbox: pruned {pruned} delivered message(s)")
+
+
+# --- New Feature: Engagement Analytics ---
+# Distinct users per day and per command are HyperLogLog sketches: a few KB each whatever the audience size, and
+# merging two sketches (register-wise max) gives the union, so weekly actives come from seven daily sketches.
+class HyperLogLog:
+    """Approximate distinct counter in 2**precision one-byte registers; standard error about 1.04 / sqrt(2**precision)."""
+
+    def __init__(self, precision: int = ENGAGEMENT_HLL_PRECISION, registers: bytes = None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers else bytearray(1 << precision)
+
+    @staticmethod
+    def hash_user(user_id: int) -> int:
+        return int.from_bytes(hashlib.blake2b(user_id.to_bytes(8, 'big', signed=True), digest_size=8).digest(), 'big')
+
+    def add_hash(self, hashed: int):
+        tail_bits = 64 - self.precision
+        index, tail = hashed >> tail_bits, hashed & ((1 << tail_bits) - 1)
+        rank = tail_bits - tail.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        """Folds in other's set. Idempotent, so re-merging an already persisted sketch never double counts."""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        raw = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))  # linear counting is the better estimate for small sets
+        return round(raw)
+
+    def to_blob(self) -> bytes:
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_blob(cls, blob: bytes) -> 'HyperLogLog':
+        registers = zlib.decompress(blob)
+        return cls(len(registers).bit_length() - 1, registers)
+
+def registered_commands(handlers) -> frozenset:
+    """Every command a CommandHandler among handlers answers to, including those inside conversations."""
+    commands = set()
+    for handler in handlers:
+        if isinstance(handler, CommandHandler):
+            commands |= handler.commands
+        elif isinstance(handler, ConversationHandler):
+            commands |= registered_commands([*handler.entry_points, *handler.fallbacks, *(h for state in handler.states.values() for h in state)])
+    return frozenset(commands)
+
+def engagement_metric(update: Update):
+    """command_<name> or button_<action> for the update, from a fixed set so the counters stay bounded; None otherwise."""
+    kind, name = update_command(update)
+    if kind == 'button':
+        return f"button_{name}"  # decode_callback only accepts actions declared in CALLBACK_ACTIONS
+    if kind == 'command':
+        return f"command_{name}" if name in tenant().engagement_commands else "command_other"
+    return None
+
+def record_engagement(update: Update, user_id: int):
+    """Adds the user to today's active-user sketch and, for commands and buttons, to that metric's sketch and call count."""
+    pending = tenant().engagement
+    hour = time.strftime('%Y-%m-%d %H:00:00', time.gmtime())
+    metrics = ['active_users']
+    metric = engagement_metric(update)
+    if metric:
+        metrics.append(metric)
+        pending['counts'][(hour, metric)] += 1
+    hashed = HyperLogLog.hash_user(user_id)
+    for name in metrics:
+        sketch = pending['sketches'].get((hour[:10], name))
+        if sketch is None:
+            sketch = pending['sketches'][(hour[:10], name)] = HyperLogLog()
+        sketch.add_hash(hashed)
+
+async def track_engagement(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pre-handler (group -1): records engagement after flood control, so dropped updates are not counted."""
+    if update.effective_user:
+        record_engagement(update, update.effective_user.id)
+
+def persist_engagement(sketches: dict, counts: Counter):
+    """Merges pending sketches into rollup_sketches and adds pending call counts to the rollups, in one transaction."""
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for (day, metric), sketch in sketches.items():
+            row = conn.execute("SELECT registers FROM rollup_sketches WHERE bucket = ? AND metric = ?", (day, metric)).fetchone()
+            if row:
+                sketch.merge(HyperLogLog.from_blob(row['registers']))
+            conn.execute("INSERT OR REPLACE INTO rollup_sketches (bucket, metric, registers) VALUES (?, ?, ?)", (day, metric, sketch.to_blob()))
+        add_to_rollups(conn, counts)
+        conn.execute("DELETE FROM rollup_sketches WHERE bucket < date('now', ?)", (f"-{ENGAGEMENT_SKETCH_RETENTION_DAYS} days",))
+        conn.commit()
+    finally:
+        conn.close()
+
+async def flush_engagement_job(context: ContextTypes.DEFAULT_TYPE):
+    """Swaps out the pending sketches and counts and persists them; on failure they are folded back for the next run."""
+    current = tenant()
+    pending = current.engagement
+    if not pending['sketches'] and not pending['counts']:
+        return
+    current.engagement = {'sketches': {}, 'counts': Counter()}
+    try:
+        await asyncio.to_thread(persist_engagement, pending['sketches'], pending['counts'])
+    except sqlite3.Error as e:
+        logger.error(f"Engagement flush failed, retrying next run: {e}")
+        for key, sketch in pending['sketches'].items():
+            current.engagement['sketches'].setdefault(key, HyperLogLog()).merge(sketch)
+        current.engagement['counts'].update(pending['counts'])
+
+def summarize_engagement(days: int, pending_sketches: dict, pending_counts: Counter) -> dict:
+    """Active users per day, over the window and over the last 7 days, plus calls and distinct users per command."""
+    def day_ago(n): return time.strftime('%Y-%m-%d', time.gmtime(time.time() - n * 86400))
+    window_start, week_start = day_ago(days - 1), day_ago(6)
+    since = min(window_start, week_start)
+    with tenant().read_pool.connection() as conn:
+        sketch_rows = conn.execute("SELECT bucket, metric, registers FROM rollup_sketches WHERE bucket >= ?", (since,)).fetchall()
+        count_rows = conn.execute(
+            "SELECT metric, SUM(value) AS calls FROM rollup_daily WHERE bucket >= ? AND (metric LIKE 'command_%' OR metric LIKE 'button_%') GROUP BY metric",
+            (window_start,)
+        ).fetchall()
+
+    by_metric = defaultdict(dict)  # metric -> {day: HyperLogLog}
+    for day, metric, sketch in [(row['bucket'], row['metric'], HyperLogLog.from_blob(row['registers'])) for row in sketch_rows] + [(day, metric, sketch) for (day, metric), sketch in pending_sketches.items()]:
+        if day >= since:
+            by_metric[metric].setdefault(day, HyperLogLog()).merge(sketch)
+
+    def union(metric, start):
+        combined = HyperLogLog()
+        for day, sketch in by_metric.get(metric, {}).items():
+            if day >= start:
+                combined.merge(sketch)
+        return combined.estimate()
+
+    calls = Counter({row['metric']: row['calls'] for row in count_rows})
+    for (hour, metric), count in pending_counts.items():
+        if hour[:10] >= window_start:
+            calls[metric] += count
+    commands = (set(by_metric) - {'active_users'}) | set(calls)
+    return {
+        'daily_active': {day: sketch.estimate() for day, sketch in by_metric.get('active_users', {}).items() if day >= window_start},
+        'window_active': union('active_users', window_start),
+        'week_active': union('active_users', week_start),
+        'commands': sorted(((metric, calls[metric], union(metric, window_start)) for metric in commands), key=lambda item: item[1], reverse=True),
+    }
+
+async def engagement_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: /engagement [days] - approximate active users and per-command usage from the sketches."""
+    if not is_admin(update.effective_user.id): return
+    try:
+        days = int(context.args[0]) if context.args else 7
+    except ValueError:
+        await update.message.reply_text("Usage: `/engagement [days]`", parse_mode='Markdown')
+        return
+    days = max(1, min(days, ENGAGEMENT_SKETCH_RETENTION_DAYS))
+
+    # Copied on the event loop: record_engagement keeps updating the live ones while the summary runs in a thread
+    pending = tenant().engagement
+    pending_sketches = {key: HyperLogLog(sketch.precision, sketch.registers) for key, sketch in pending['sketches'].items()}
+    started = time.perf_counter()
+    summary = await asyncio.to_thread(summarize_engagement, days, pending_sketches, Counter(pending['counts']))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    message = f"*Engagement for the last {days} day(s)* (UTC, user counts ±{104 / math.sqrt(1 << ENGAGEMENT_HLL_PRECISION):.1f}%)\n```\n"
+    message += f"{'Day':<10} {'Active':>7}\n"
+    for day in sorted(summary['daily_active'], reverse=True):
+        message += f"{day:<10} {summary['daily_active'][day]:>7}\n"
+    message += "```\n"
+    message += f"*Active users:* {summary['window_active']} over the window, {summary['week_active']} in the last 7 days.\n\n"
+    if summary['commands']:
+        message += f"*Top commands*\n```\n{'Command':<24} {'Calls':>6} {'Users':>6}\n"
+        for metric, calls, users in summary['commands'][:ENGAGEMENT_TOP_COMMANDS]:
+            kind, _, name = metric.partition('_')
+            label = f"{name} (button)" if kind == 'button' else "(unknown command)" if name == 'other' else f"/{name}"
+            message += f"{label[:24]:<24} {calls:>6} {users:>6}\n"
+        message += "```\n"
+    message += f"_Served from sketches in {elapsed_ms:.1f} ms; new activity is flushed every {ENGAGEMENT_FLUSH_SECONDS} s._"
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+
+# --- New Feature: Startup Path ---
+# The schema version lives in the database header (PRAGMA user_version), so a restart on an up-to-date database
+# runs no DDL at all. Every schema change appends a migration; steps must stay idempotent, since databases created
+# before versioning start at 0 and replay step 1 over tables that already exist.
+def migrate_to_v1():
     initialize_database()
-    # âœ… Call new function to add features to DB
     initialize_database_additions()
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+def migrate_to_v2():
+    conn = get_db_connection()
+    # Engagement analytics: one compressed HyperLogLog per (day, metric), next to the integer rollups
+    conn.execute("CREATE TABLE IF NOT EXISTS rollup_sketches (bucket TEXT NOT NULL, metric TEXT NOT NULL, registers BLOB NOT NULL, PRIMARY KEY (bucket, metric))")
+    conn.commit()
+    conn.close()
+
+def migrate_to_v3():
+    conn = get_db_connection()
+    # New databases declare marked_seq in initialize_database_additions; this only upgrades older ones
+    add_column_if_missing(conn.cursor(), "exchange_dirty_users", "marked_seq", "INTEGER NOT NULL DEFAULT 0")
+    conn.commit()
+    conn.close()
+
+MIGRATIONS = [(1, migrate_to_v1), (2, migrate_to_v2), (3, migrate_to_v3)]
+
+def prepare_database() -> tuple:
+    """Brings the tenant's database to the latest schema version. Returns (version found, migrations run)."""
+    conn = sqlite3.connect(tenant().db_name)
+    found = conn.execute("PRAGMA user_version").fetchone()[0]
+    pending = [(version, migrate) for version, migrate in MIGRATIONS if version > found]
+    for version, migrate in pending:
+        logger.info(f"Migrating database schema to version {version}...")
+        migrate()
+        conn.execute(f"PRAGMA user_version = {version}")
+    conn.close()
+    return found, len(pending)
+
+def record_startup_phase(name: str, started: float):
+    tenant().startup['phases'][name] = round((time.perf_counter() - started) * 1000, 1)
+
+# Each warm-up task takes its own pooled connection, so running them side by side also opens the read pool
+WARMUP_QUERIES = {
+    'user_access': "SELECT COUNT(*), MAX(trial_expires_at), SUM(has_paid) FROM users",
+    'matcher': "SELECT (SELECT COUNT(*) FROM videos WHERE status = 'active'), (SELECT COUNT(*) FROM watched_videos), (SELECT COUNT(*) FROM task_leases)",
+}
+
+def run_warmup_task(name: str) -> tuple:
+    started = time.perf_counter()
+    if name == 'settings':
+        tenant().snapshots.get('settings', fetch_settings)
+    elif name == 'unreachable_chats':
+        load_unreachable_chats()
+    else:
+        with tenant().read_pool.connection() as conn:
+            conn.execute(WARMUP_QUERIES[name]).fetchone()
+    return name, round((time.perf_counter() - started) * 1000, 1)
+
+async def warm_up_caches(application: Application):
+    """Fills the settings snapshot, unreachable-chat registry and read pool before the first update, then logs the startup breakdown."""
+    current = tenant()
+    phases = current.startup['phases']
+    phases['bot_init'] = round((time.perf_counter() - current.startup['built_at']) * 1000, 1)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(asyncio.to_thread(run_warmup_task, name) for name in ('settings', 'unreachable_chats', *WARMUP_QUERIES)))
+    record_startup_phase('warmup', started)
+    current.startup['warmup_tasks'] = dict(results)
+    current.startup['ready_ms'] = round((time.perf_counter() - current.startup['started_at']) * 1000, 1)
+    breakdown = ", ".join(f"{name} {ms:.0f} ms" for name, ms in phases.items())
+    tasks = ", ".join(f"{name} {ms:.0f}" for name, ms in results)
+    logger.info(f"[{current.name}] Ready in {current.startup['ready_ms']:.0f} ms: {breakdown} (warm-up tasks in ms: {tasks})")
+
+
+# --- New Feature: Multi-Tenant Runner ---
+class SharedHTTPXRequest(InstrumentedHTTPXRequest):
+    """One connection pool for the API calls of every hosted bot, closed when the last bot shuts down."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.users = 0
+
+    async def initialize(self):
+        self.users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self.users -= 1
+        if self.users <= 0:
+            await super().shutdown()
+
+async def log_tenant_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    current = tenant()
+    current.stats['errors'] += 1
+    logger.error(f"[{current.name}] Error while handling an update: {context.error}", exc_info=context.error)
+
+def load_tenants(config_path: str):
+    """Reads the runner config: {"tenants": [{"name", "token" or "token_env", "admin_ids", "db_path", "backup_dir"?}], ...}."""
+    with open(config_path, encoding='utf-8') as f:
+        config = json.load(f)
+    tenants = []
+    for entry in config['tenants']:
+        token = entry.get('token') or os.getenv(entry.get('token_env', ''))
+        if not token:
+            raise ValueError(f"Tenant '{entry['name']}' has no token")
+        tenants.append(Tenant(entry['name'], token, entry.get('admin_ids', []), entry['db_path'], entry.get('backup_dir')))
+    for attribute in ('name', 'db_name'):
+        values = [getattr(t, attribute) for t in tenants]
+        if len(set(values)) != len(values):
+            raise ValueError(f"Tenant {attribute} values must be unique")
+    return config, tenants
+
+async def serve_tenant(bot_tenant: Tenant, request: HTTPXRequest, stop_event: asyncio.Event):
+    """Runs one tenant's Application until stop_event is set. A failing tenant is logged and leaves the others running."""
+    # This task's context; the application's update, job and worker tasks inherit it
+    current_tenant.set(bot_tenant)
+    try:
+        application = build_application(bot_tenant, request)
+        async with application:
+            # post_init only runs under run_polling(); this manual start warms up explicitly
+            await warm_up_caches(application)
+            await application.updater.start_polling()
+            await application.start()
+            logger.info(f"[{bot_tenant.name}] Bot started.")
+            await stop_event.wait()
+            await application.updater.stop()
+            await application.stop()
+    except Exception:
+        bot_tenant.stats['crashed'] += 1
+        logger.exception(f"[{bot_tenant.name}] Bot failed; the other tenants keep running.")
+
+async def log_tenant_metrics(tenants, stop_event: asyncio.Event):
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), TENANT_METRICS_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        for t in tenants:
+            logger.info(
+                f"[{t.name}] updates={t.stats['updates']} errors={t.stats['errors']} crashed={t.stats['crashed']} "
+                f"users_tracked={len(t.user_state_last_seen)} outbox_sent={t.outbox_stats['sent']} outbox_dead={t.outbox_stats['dead']}"
+            )
+
+async def run_tenants(config_path: str):
+    """Hosts every configured bot on this event loop with one shared HTTP pool and worker executor."""
+    config, tenants = load_tenants(config_path)
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=config.get('executor_workers', SHARED_EXECUTOR_WORKERS), thread_name_prefix="tenant-worker"))
+    request = build_api_request(config.get('http_pool_size', SHARED_HTTP_POOL_SIZE), SharedHTTPXRequest)
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    logger.info(f"Starting {len(tenants)} tenant(s): {', '.join(t.name for t in tenants)}")
+    await asyncio.gather(log_tenant_metrics(tenants, stop_event), *(serve_tenant(t, request, stop_event) for t in tenants))
+
+
+# --- MAIN ---
+def build_application(bot_tenant: Tenant, request: HTTPXRequest = None) -> Application:
+    """Prepares the tenant's database and builds its Application with every handler and job. Runs as that tenant."""
+    started = time.perf_counter()
+    found, migrated = prepare_database()
+    record_startup_phase('schema', started)
+    if migrated:
+        logger.info(f"Database schema upgraded from version {found} to {MIGRATIONS[-1][0]}.")
+    started = time.perf_counter()
+    request = request or build_api_request()
+    get_updates_request = build_get_updates_request()
+    bot_tenant.http_requests = (request, get_updates_request)
+    bot = RegistryAwareBot(bot_tenant.token, base_url=BOT_API_BASE_URL, request=request, get_updates_request=get_updates_request)
+    application = Application.builder().bot(bot).post_init(warm_up_caches).build()
+    application.add_error_handler(log_tenant_error)
+
+    # Middleware: runs before every other handler group
+    application.add_handler(TypeHandler(Update, touch_user_state), group=-4)
+    application.add_handler(TypeHandler(Update, track_chat_reachability), group=-3)
+    application.add_handler(TypeHandler(Update, flood_control_middleware), group=-2)
+    application.add_handler(TypeHandler(Update, track_engagement), group=-1)
     
+    # Abandoned conversations end after CONVERSATION_TIMEOUT_SECONDS and drop the user_data keys of their flow
+
     # Conversations (Original)
-    payment_proof_conv = ConversationHandler(entry_points=[CallbackQueryHandler(submit_payment_proof_start, pattern='^submit_payment_proof$')], states={AWAIT_PAYMENT_PROOF: [MessageHandler(filters.PHOTO, received_payment_proof)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
-    upload_conv = ConversationHandler(entry_points=[CommandHandler('upload', lambda u,c: command_wrapper(u,c,upload_start,True)), CallbackQueryHandler(lambda u,c: command_wrapper(u,c,upload_start,True), pattern='^start_upload$')], states={AWAIT_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_title)], AWAIT_THUMBNAIL: [MessageHandler(filters.PHOTO, received_thumbnail)], AWAIT_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_duration)], AWAIT_LINK: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_link)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
-    task_proof_conv = ConversationHandler(entry_points=[CommandHandler('submitproof', lambda u,c: command_wrapper(u,c,submit_task_proof_start,True)), CallbackQueryHandler(lambda u,c: command_wrapper(u,c,submit_task_proof_start,True), pattern='^submit_task_proof$')], states={AWAIT_TASK_PROOF: [MessageHandler(filters.VIDEO, received_task_proof)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
-    rejection_conv = ConversationHandler(entry_points=[CallbackQueryHandler(handle_verification_callback, pattern='^verify_reject_.*$')], states={AWAIT_REJECTION_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_rejection_reason)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
-    price_conv = ConversationHandler(entry_points=[CallbackQueryHandler(admin_set_price_start, pattern='^admin_set_price$')], states={AWAIT_PAYMENT_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_received_price)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
-    instructions_conv = ConversationHandler(entry_points=[CallbackQueryHandler(admin_set_instructions_start, pattern='^admin_set_instructions$')], states={AWAIT_PAYMENT_INSTRUCTIONS: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_received_instructions)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
-    photo_conv = ConversationHandler(entry_points=[CallbackQueryHandler(admin_set_photo_start, pattern='^admin_set_photo$')], states={AWAIT_PAYMENT_PHOTO: [MessageHandler(filters.PHOTO, admin_received_photo)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False)
+    payment_proof_conv = ConversationHandler(entry_points=[CallbackQueryHandler(submit_payment_proof_start, pattern=callback_pattern('submit_payment_proof'))], states={ConversationHandler.TIMEOUT: conversation_timeout_handlers(), AWAIT_PAYMENT_PROOF: [MessageHandler(filters.PHOTO, received_payment_proof)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, conversation_timeout=CONVERSATION_TIMEOUT_SECONDS)
+    upload_conv = ConversationHandler(entry_points=[CommandHandler('upload', lambda u,c: command_wrapper(u,c,upload_start,True)), CallbackQueryHandler(lambda u,c: command_wrapper(u,c,upload_start,True), pattern=callback_pattern('start_upload'))], states={ConversationHandler.TIMEOUT: conversation_timeout_handlers('video_info'), AWAIT_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_title)], AWAIT_THUMBNAIL: [MessageHandler(filters.PHOTO, received_thumbnail)], AWAIT_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_duration)], AWAIT_LINK: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_link)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, conversation_timeout=CONVERSATION_TIMEOUT_SECONDS)
+    task_proof_conv = ConversationHandler(entry_points=[CommandHandler('submitproof', lambda u,c: command_wrapper(u,c,submit_task_proof_start,True)), CallbackQueryHandler(lambda u,c: command_wrapper(u,c,submit_task_proof_start,True), pattern=callback_pattern('submit_task_proof'))], states={ConversationHandler.TIMEOUT: conversation_timeout_handlers('task_id_for_proof'), AWAIT_TASK_PROOF: [MessageHandler(filters.VIDEO, received_task_proof)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, conversation_timeout=CONVERSATION_TIMEOUT_SECONDS)
+    rejection_conv = ConversationHandler(entry_points=[CallbackQueryHandler(handle_verification_callback, pattern=callback_pattern('verify_reject'))], states={ConversationHandler.TIMEOUT: conversation_timeout_handlers('rejection_info'), AWAIT_REJECTION_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_rejection_reason)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, conversation_timeout=CONVERSATION_TIMEOUT_SECONDS)
+    price_conv = ConversationHandler(entry_points=[CallbackQueryHandler(admin_set_price_start, pattern=callback_pattern('admin_set_price'))], states={ConversationHandler.TIMEOUT: conversation_timeout_handlers(), AWAIT_PAYMENT_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_received_price)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, conversation_timeout=CONVERSATION_TIMEOUT_SECONDS)
+    instructions_conv = ConversationHandler(entry_points=[CallbackQueryHandler(admin_set_instructions_start, pattern=callback_pattern('admin_set_upi'))], states={ConversationHandler.TIMEOUT: conversation_timeout_handlers(), AWAIT_PAYMENT_INSTRUCTIONS: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_received_instructions)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, conversation_timeout=CONVERSATION_TIMEOUT_SECONDS)
+    photo_conv = ConversationHandler(entry_points=[CallbackQueryHandler(admin_set_photo_start, pattern=callback_pattern('admin_set_photo'))], states={ConversationHandler.TIMEOUT: conversation_timeout_handlers(), AWAIT_PAYMENT_PHOTO: [MessageHandler(filters.PHOTO, admin_received_photo)]}, fallbacks=[CommandHandler('cancel', cancel_conversation)], per_message=False, conversation_timeout=CONVERSATION_TIMEOUT_SECONDS)
 
     application.add_handler(payment_proof_conv)
     application.add_handler(upload_conv)
@@ -1278,33 +3894,39 @@ def main():
 
     # âœ… NEW CONVERSATION HANDLERS
     appeal_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(appeal_start, pattern=r"^appeal_report_")],
+        entry_points=[CallbackQueryHandler(appeal_start, pattern=callback_pattern('appeal_report'))],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers('appeal_report_id'),
             AWAIT_APPEAL_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_appeal_reason)],
         },
         fallbacks=[CommandHandler('cancel', cancel_conversation)],
-        per_message=False
+        per_message=False,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS
     )
     report_conv = ConversationHandler(
         entry_points=[CommandHandler("report", report_start)],
         states={
+            ConversationHandler.TIMEOUT: conversation_timeout_handlers('reported_user_id'),
             AWAIT_REPORT_USER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_report_user_id)],
             AWAIT_REPORT_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_report_reason)],
         },
         fallbacks=[CommandHandler('cancel', cancel_conversation)],
-        per_message=False
+        per_message=False,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS
     )
     subscription_proof_conv = ConversationHandler(
         entry_points=[CommandHandler('submitpaymentproof', submit_payment_proof_convo_start)],
-        states={AWAIT_SUBSCRIPTION_PROOF: [MessageHandler(filters.PHOTO, received_subscription_proof)]},
+        states={ConversationHandler.TIMEOUT: conversation_timeout_handlers(), AWAIT_SUBSCRIPTION_PROOF: [MessageHandler(filters.PHOTO, received_subscription_proof)]},
         fallbacks=[CommandHandler('cancel', cancel_conversation)],
-        per_message=False
+        per_message=False,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS
     )
     set_trial_days_conv = ConversationHandler(
         entry_points=[CommandHandler('settrialdays', admin_set_trial_days_start)],
-        states={AWAIT_TRIAL_DAYS: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_received_trial_days)]},
+        states={ConversationHandler.TIMEOUT: conversation_timeout_handlers(), AWAIT_TRIAL_DAYS: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_received_trial_days)]},
         fallbacks=[CommandHandler('cancel', cancel_conversation)],
-        per_message=False
+        per_message=False,
+        conversation_timeout=CONVERSATION_TIMEOUT_SECONDS
     )
     application.add_handler(appeal_conv)
     application.add_handler(subscription_proof_conv)
@@ -1313,7 +3935,7 @@ def main():
 
     # Commands (Original)
     application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("approve", admin_approve_payment, filters=filters.Chat(chat_id=ADMIN_IDS)))
+    application.add_handler(CommandHandler("approve", admin_approve_payment, filters=filters.Chat(chat_id=bot_tenant.admin_ids)))
     application.add_handler(CommandHandler("approve", approve_user_command))
     application.add_handler(CommandHandler("rules", lambda u,c: command_wrapper(u,c,rules_command)))
     application.add_handler(CommandHandler("menu", lambda u,c: command_wrapper(u,c,menu_command)))
@@ -1335,35 +3957,87 @@ def main():
     application.add_handler(CommandHandler("addstrike", admin_add_strike))
     application.add_handler(CommandHandler("removestrike", admin_remove_strike))
     application.add_handler(CommandHandler("pendingproofs", admin_get_pending_proofs))
-    application.add_handler(CallbackQueryHandler(admin_user_management_panel, pattern="^admin_user_management$"))
-    application.add_handler(CallbackQueryHandler(admin_show_command_instructions, pattern="^instruct_"))
     application.add_handler(CommandHandler("viewreports", admin_view_reports))
     application.add_handler(CommandHandler("viewreport", admin_view_reports)) # Alias
+    application.add_handler(CommandHandler("export", admin_export_command))
+    application.add_handler(CommandHandler("backup", admin_backup_command))
+    application.add_handler(CommandHandler("adminstats", admin_stats_command))
+    application.add_handler(CommandHandler("floodstats", admin_flood_stats_command))
+    application.add_handler(CommandHandler("memstats", admin_mem_stats_command))
+    application.add_handler(CommandHandler("httpstats", admin_http_stats_command))
+    application.add_handler(CommandHandler("ledger", ledger_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("tiers", admin_tiers_command))
+    application.add_handler(CommandHandler("engagement", engagement_command))
+    application.add_handler(CommandHandler("reviewproofs", lambda u,c: command_wrapper(u,c,review_proofs_command)))
     
     
 
 
 
-    # Callbacks (Original)
-    application.add_handler(CallbackQueryHandler(lambda u,c: command_wrapper(u,c,get_task_command), pattern='^get_task$'))
-    application.add_handler(CallbackQueryHandler(lambda u,c: command_wrapper(u,c,my_status_command), pattern='^my_status$'))
-    application.add_handler(CallbackQueryHandler(lambda u,c: command_wrapper(u,c,remove_video_start), pattern='^remove_video_start$'))
-    application.add_handler(CallbackQueryHandler(remove_video_confirm, pattern='^remove_confirm_'))
-    application.add_handler(CallbackQueryHandler(lambda u,c: u.callback_query.edit_message_text("Cancelled."), pattern='^remove_cancel$'))
-    application.add_handler(CallbackQueryHandler(handle_verification_callback, pattern="^verify_accept_"))
-    application.add_handler(CallbackQueryHandler(rate_video_callback, pattern="^rate_"))
-    application.add_handler(CallbackQueryHandler(admin_panel_command, pattern="^admin_main_panel$"))
-    application.add_handler(CallbackQueryHandler(admin_payment_settings_panel, pattern="^admin_payment_settings$"))
-    application.add_handler(CallbackQueryHandler(admin_feature_settings_panel, pattern="^admin_feature_settings$"))
-    application.add_handler(CallbackQueryHandler(admin_toggle_setting, pattern=r"^admin_toggle_(payment|reciprocal|quality|credits|tx)$"))
-    application.add_handler(CallbackQueryHandler(admin_approve_info, pattern="^admin_approve_info$"))
-    application.add_handler(CallbackQueryHandler(admin_remove_photo, pattern="^admin_remove_photo$"))
-
-    # âœ… NEW CALLBACK HANDLER
-    application.add_handler(CallbackQueryHandler(handle_subscription_approval, pattern=r"^sub_(approve|reject)_"))
+    # Callbacks: one dispatcher, routed on the decoded action (conversation entry points are matched above)
+    callback_router = CallbackRouter()
+    callback_router.route('get_task', lambda u,c: command_wrapper(u,c,get_task_command))
+    callback_router.route('my_status', lambda u,c: command_wrapper(u,c,my_status_command))
+    callback_router.route('remove_video_start', lambda u,c: command_wrapper(u,c,remove_video_start))
+    callback_router.route('remove_confirm', remove_video_confirm)
+    callback_router.route('remove_cancel', lambda u,c: u.callback_query.edit_message_text("Cancelled."))
+    callback_router.route('verify_accept', handle_verification_callback)
+    callback_router.route('rate_good', rate_video_callback)
+    callback_router.route('rate_bad', rate_video_callback)
+    callback_router.route('admin_main_panel', admin_panel_command)
+    callback_router.route('admin_payment_settings', admin_payment_settings_panel)
+    callback_router.route('admin_feature_settings', admin_feature_settings_panel)
+    callback_router.route('admin_user_management', admin_user_management_panel)
+    callback_router.route('admin_toggle', admin_toggle_setting)
+    callback_router.route('admin_approve_info', admin_approve_info)
+    callback_router.route('admin_remove_photo', admin_remove_photo)
+    callback_router.route('instruct', admin_show_command_instructions)
+    callback_router.route('sub_approve', handle_subscription_approval)
+    callback_router.route('sub_reject', handle_subscription_approval)
+    for action in ('review_page', 'review_watch', 'review_mark', 'review_accept'):
+        callback_router.route(action, review_callback)
+    callback_router.route('search_page', search_page_callback)
+    application.add_handler(CallbackQueryHandler(callback_router.dispatch, pattern=callback_router.can_route))
+    bot_tenant.engagement_commands = registered_commands([h for group in application.handlers.values() for h in group])
+
+    # Background jobs
+    application.job_queue.run_repeating(archive_finished_rows_job, interval=timedelta(hours=ARCHIVE_INTERVAL_HOURS), first=timedelta(minutes=5), name="archive_finished_rows")
+    application.job_queue.run_repeating(backup_database_job, interval=timedelta(hours=BACKUP_INTERVAL_HOURS), first=timedelta(minutes=15), name="backup_database")
+    application.job_queue.run_repeating(refresh_rollups_job, interval=timedelta(minutes=ROLLUP_INTERVAL_MINUTES), first=timedelta(seconds=30), name="refresh_rollups")
+    application.job_queue.run_repeating(trial_expiry_reminder_job, interval=timedelta(minutes=TRIAL_REMINDER_INTERVAL_MINUTES), first=timedelta(minutes=1), name="trial_expiry_reminders")
+    application.job_queue.run_repeating(collusion_scan_job, interval=timedelta(minutes=COLLUSION_SCAN_INTERVAL_MINUTES), first=timedelta(minutes=10), name="collusion_scan")
+    application.job_queue.run_repeating(evict_idle_flood_buckets_job, interval=FLOOD_EVICTION_INTERVAL_SECONDS, name="evict_idle_flood_buckets")
+    # First run right after startup replays whatever was committed but not delivered before the last shutdown
+    application.job_queue.run_repeating(drain_outbox_job, interval=NOTIFICATION_TICK_SECONDS, first=1, name="drain_outbox")
+    application.job_queue.run_repeating(prune_outbox_job, interval=timedelta(hours=1), first=timedelta(minutes=7), name="prune_outbox")
+    application.job_queue.run_repeating(flush_notification_digests_job, interval=DIGEST_FLUSH_TICK_SECONDS, name="flush_notification_digests")
+    application.job_queue.run_repeating(evict_user_state_job, interval=USER_DATA_EVICTION_INTERVAL_SECONDS, first=USER_DATA_EVICTION_INTERVAL_SECONDS, name="evict_user_state")
+    application.job_queue.run_repeating(expire_task_leases_job, interval=TASK_LEASE_SECONDS, first=TASK_LEASE_SECONDS, name="expire_task_leases")
+    application.job_queue.run_repeating(snapshot_credit_balances_job, interval=timedelta(minutes=CREDIT_SNAPSHOT_INTERVAL_MINUTES), first=timedelta(minutes=3), name="snapshot_credit_balances")
+    conn = get_db_connection()
+    dedupe_pending = fetch_settings(conn).get('video_dedupe_completed') != '1'
+    conn.close()
+    if dedupe_pending:
+        application.job_queue.run_repeating(dedupe_videos_job, interval=DEDUPE_INTERVAL_SECONDS, first=30, name="dedupe_videos")
+    application.job_queue.run_repeating(flag_low_quality_videos_job, interval=QUALITY_FLAG_INTERVAL_SECONDS, first=QUALITY_FLAG_INTERVAL_SECONDS, name="flag_low_quality_videos")
+    application.job_queue.run_repeating(recompute_tiers_job, interval=timedelta(hours=TIER_RECOMPUTE_INTERVAL_HOURS), first=timedelta(minutes=20), name="recompute_tiers")
+    application.job_queue.run_repeating(reconcile_credit_ledger_job, interval=timedelta(minutes=CREDIT_RECONCILE_INTERVAL_MINUTES), first=timedelta(minutes=2), name="reconcile_credit_ledger")
+    application.job_queue.run_repeating(flush_engagement_job, interval=ENGAGEMENT_FLUSH_SECONDS, first=ENGAGEMENT_FLUSH_SECONDS, name="flush_engagement")
+    record_startup_phase('handlers', started)
+    bot_tenant.startup['built_at'] = time.perf_counter()
+    return application
 
+def main():
+    bot_tenant = Tenant("default", TELEGRAM_BOT_TOKEN, ADMIN_IDS, DB_NAME, BACKUP_DIR)
+    current_tenant.set(bot_tenant)
+    application = build_application(bot_tenant)
     logger.info("Bot Final Version with new features is starting...")
     application.run_polling()
 
 if __name__ == "__main__":
-    main()
+    tenants_config = os.getenv("BOT_TENANTS_CONFIG")
+    if tenants_config:
+        asyncio.run(run_tenants(tenants_config))
+    else:
+        main()